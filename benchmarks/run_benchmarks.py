@@ -0,0 +1,398 @@
+"""
+DB・センサー・カメラの主要な処理経路のベンチマーク。
+
+    python -m benchmarks.run_benchmarks                       # 全ベンチマークを実行して JSON を出力
+    python -m benchmarks.run_benchmarks --quick               # 件数を減らして短時間で実行
+    python -m benchmarks.run_benchmarks --only db_helpers photo_job
+    python -m benchmarks.run_benchmarks --save-baseline       # 結果を基準値として保存
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json
+
+基準値と比較した場合、許容幅 (--tolerance) を超えて悪化した指標があれば終了コード 1 を返す。
+各ベンチマークは一時ディレクトリに作った専用のDB・画像ディレクトリで実行し、既存のDBには触れない。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from config import *
+from core.db_connection import connection_manager, close_all_connections, get_connection
+from core.config_cache import system_config_cache, layers_cache
+from core.db_manager import (init_db, insert_sensor_log, insert_system_log, select_layer_info,
+                             select_latest_canopy_coverage, start_log_writer, stop_log_writer,
+                             _write_log_batches)
+from core.sensor_query import query_sensor_range
+from core.sensor_sampling import sampling_engine
+from core.camera_session import camera_manager, MockCameraBackend
+from core.frame_dedup import frame_deduplicator
+from jobs.sensor_jobs import execute_sensor_job
+from jobs.camera_jobs import execute_photo_job, delete_old_images
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# 値が小さいほど良い指標 (それ以外の ops_per_sec などは大きいほど良い)。
+# max_ms は1回の外れ値で大きく揺れるため比較しない
+_LOWER_IS_BETTER = ('p50_ms', 'p99_ms', 'mean_ms', 'total_sec')
+
+
+def summarize(latencies, wall_sec=None):
+    """
+    1回ごとの所要時間 (秒) のリストから統計値を求める。
+
+    :param wall_sec: 全体の経過時間。指定した場合は ops_per_sec をこれから求める (並列実行時)
+    """
+    ms = np.asarray(latencies, dtype=np.float64) * 1000
+    wall_sec = wall_sec if wall_sec is not None else float(np.sum(ms)) / 1000
+    return {
+        'n': int(len(ms)),
+        'p50_ms': round(float(np.percentile(ms, 50)), 4),
+        'p99_ms': round(float(np.percentile(ms, 99)), 4),
+        'mean_ms': round(float(np.mean(ms)), 4),
+        'max_ms': round(float(np.max(ms)), 4),
+        'ops_per_sec': round(len(ms) / wall_sec, 1) if wall_sec > 0 else None,
+    }
+
+
+def time_calls(func, count):
+    latencies = []
+    for i in range(count):
+        started = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def run_threads(func, threads, calls_per_thread):
+    """threads 本のスレッドから同時に func を呼び、(全所要時間のリスト, 経過時間) を返す。"""
+    results = [None] * threads
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(index):
+        barrier.wait()
+        results[index] = time_calls(func, calls_per_thread)
+        # スレッドごとの接続は close_all_connections() でまとめて閉じる
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.join()
+    wall_sec = time.perf_counter() - started
+    return [latency for result in results for latency in result], wall_sec
+
+
+@contextlib.contextmanager
+def isolated_workspace():
+    """一時ディレクトリに新しいDBを作り、ベンチマーク中の接続・画像の保存先をそこへ向ける。"""
+    workdir = tempfile.mkdtemp(prefix='smart_grow_bench_')
+    previous_cwd = os.getcwd()
+    previous_db_path = connection_manager.db_path
+    os.chdir(workdir)
+    db_path = os.path.join(workdir, 'bench.db')
+    close_all_connections()
+    connection_manager.db_path = db_path
+    # 変更回数は DB ごとの値のため、別の DB で読み込んだ設定を使い回さない
+    system_config_cache.invalidate()
+    layers_cache.invalidate()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            init_db(db_path)
+        yield workdir
+    finally:
+        close_all_connections()
+        connection_manager.db_path = previous_db_path
+        system_config_cache.invalidate()
+        layers_cache.invalidate()
+        os.chdir(previous_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def quiet():
+    """ジョブのコンソール出力を計測結果に混ぜないよう捨てる。"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def bench_db_helpers(quick):
+    """db_manager のヘルパーを複数スレッドから同時に呼んだ時のスループットと遅延。"""
+    calls = 200 if quick else 1000
+    helpers = {
+        'insert_sensor_log': lambda i: insert_sensor_log(1, 25.0 + i % 10, 60.0),
+        'insert_system_log': lambda i: insert_system_log(1, 'INFO', 'benchmark', f'call {i}'),
+        'select_layer_info': lambda i: select_layer_info(1),
+    }
+    results = {}
+    with isolated_workspace():
+        for name, func in helpers.items():
+            modes = ['sync', 'log_writer'] if name.startswith('insert') else ['sync']
+            for mode in modes:
+                for threads in (1, 4, 8):
+                    if mode == 'log_writer':
+                        start_log_writer()
+                    with quiet():
+                        latencies, wall_sec = run_threads(func, threads, calls // threads)
+                        if mode == 'log_writer':
+                            # キューに残った分の書き込みまでをスループットに含める
+                            started = time.perf_counter()
+                            stop_log_writer()
+                            wall_sec += time.perf_counter() - started
+                    results[f'{name}/{mode}/threads={threads}'] = summarize(latencies, wall_sec)
+                    close_all_connections()
+    return results
+
+
+def bench_sensor_job(quick):
+    """execute_sensor_job 1回の所要時間 (単発測定と、バッファを集計する場合)。"""
+    calls = 100 if quick else 500
+    results = {}
+    with isolated_workspace():
+        sampling_engine.remove_layer(1)
+        with quiet():
+            results['single_reading'] = summarize(time_calls(lambda i: execute_sensor_job(1), calls))
+
+        sampling_engine.add_layer(1)
+        latencies = []
+        with quiet():
+            for _ in range(calls):
+                # 1時間分のサンプル (5秒間隔) を溜めてから計測する
+                for _ in range(min(720, SENSOR_BUFFER_CAPACITY)):
+                    sampling_engine.sample_all()
+                started = time.perf_counter()
+                execute_sensor_job(1)
+                latencies.append(time.perf_counter() - started)
+        sampling_engine.remove_layer(1)
+        results['buffered_summary'] = summarize(latencies)
+    return results
+
+
+def bench_photo_job(quick):
+    """合成フレームのカメラで execute_photo_job を実行した時の、ジョブの所要時間と保存完了までの時間。"""
+    calls = 10 if quick else 50
+    previous_backend = camera_manager.backend
+    previous_interval = frame_deduplicator.max_interval_sec
+    camera_manager.close_all()
+    camera_manager.backend = MockCameraBackend()
+    # 合成フレームは毎回同じ画像のため、重複判定で保存が省かれないよう毎回保存させる (保存経路を計測する)
+    frame_deduplicator.max_interval_sec = 0
+    frame_deduplicator.reset()
+    try:
+        with isolated_workspace():
+            started = time.perf_counter()
+            with quiet():
+                latencies = time_calls(lambda i: execute_photo_job(1), calls)
+                # 保存パイプラインが最後の記録 (完了の system_logs) まで書き終えるまで待つ
+                # (ai_reports だけを待つと、後片付けの後に残りのログが元のディレクトリの DB に書かれる)
+                deadline = time.monotonic() + 60
+                while get_connection().execute(
+                        "SELECT COUNT(*) FROM system_logs WHERE message = 'Camera job finished successfully.'"
+                ).fetchone()[0] < calls:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError('保存パイプラインが60秒以内に完了しませんでした。')
+                    time.sleep(0.005)
+            total_sec = time.perf_counter() - started
+            result = summarize(latencies)
+            result['total_sec'] = round(total_sec, 3)
+            result['saved_per_sec'] = round(calls / total_sec, 2)
+    finally:
+        camera_manager.close_all()
+        camera_manager.backend = previous_backend
+        frame_deduplicator.max_interval_sec = previous_interval
+        frame_deduplicator.reset()
+    return {'mock_camera': result}
+
+
+def bench_delete_old_images(quick):
+    """delete_old_images の走査・削除時間 (半数が保持期間切れのディレクトリ)。"""
+    sizes = [10000] if quick else [10000, 100000]
+    expired_mtime = time.time() - (RETENTION_DAYS + 1) * 86400
+    results = {}
+    for size in sizes:
+        save_dir = tempfile.mkdtemp(prefix='smart_grow_bench_images_')
+        try:
+            for i in range(size):
+                file_path = os.path.join(save_dir, f'{i:07d}.jpg')
+                with open(file_path, 'wb'):
+                    pass
+                if i % 2 == 0:
+                    os.utime(file_path, (expired_mtime, expired_mtime))
+            started = time.perf_counter()
+            with quiet():
+                delete_old_images(save_dir)
+            elapsed = time.perf_counter() - started
+            results[f'files={size}'] = {
+                'n': size,
+                'total_sec': round(elapsed, 4),
+                'ops_per_sec': round(size / elapsed, 1),
+                'remaining': len(os.listdir(save_dir)),
+            }
+        finally:
+            shutil.rmtree(save_dir, ignore_errors=True)
+    return results
+
+
+def _populate_large_db(layers, days, interval_sec, images_per_layer):
+    """sensor_logs (ロールアップを含む) と ai_reports に過去 days 日分のデータを書き込む。"""
+    end_ms = int(time.time() * 1000)
+    start_ms = end_ms - days * 86400 * 1000
+    step_ms = interval_sec * 1000
+    rng = np.random.default_rng(0)
+    chunk = []
+    for ts_ms in range(start_ms, end_ms, step_ms):
+        timestamp = datetime.fromtimestamp(ts_ms / 1000).isoformat()
+        for layer_id in range(1, layers + 1):
+            temperature, humidity = 25 + rng.random() * 5, 55 + rng.random() * 15
+            chunk.append((layer_id, timestamp, ts_ms, temperature, humidity) + (None,) * 7)
+        if len(chunk) >= 10000:
+            _write_log_batches({'sensor': chunk})
+            chunk = []
+    if chunk:
+        _write_log_batches({'sensor': chunk})
+
+    conn = get_connection()
+    with conn:
+        image_step_ms = (end_ms - start_ms) // images_per_layer
+        conn.executemany(
+            """
+            INSERT INTO ai_reports (layer_id, timestamp, ts_ms, image_path, growth_rate, ai_summary, canopy_coverage)
+            VALUES (?, ?, ?, ?, 0.0, 'benchmark', ?)
+            """,
+            [(layer_id, datetime.fromtimestamp(ts_ms / 1000).isoformat(), ts_ms, f'layer_{layer_id}/{ts_ms}.jpg', 0.5)
+             for layer_id in range(1, layers + 1)
+             for ts_ms in range(start_ms, end_ms, image_step_ms)]
+        )
+    return end_ms
+
+
+def bench_queries(quick):
+    """大きなDBに対する期間検索・最新値検索の遅延。"""
+    days = 7 if quick else 90
+    calls = 20 if quick else 100
+    results = {}
+    with isolated_workspace():
+        started = time.perf_counter()
+        end_ms = _populate_large_db(layers=4, days=days, interval_sec=60, images_per_layer=days * 24)
+        rows = get_connection().execute("SELECT COUNT(*) FROM sensor_logs").fetchone()[0]
+        results['populate'] = {'n': rows, 'total_sec': round(time.perf_counter() - started, 3)}
+
+        spans = {'1h': 1 / 24, '1d': 1, '7d': 7, f'{days}d': days}
+        for label, span_days in spans.items():
+            start_ms = end_ms - int(span_days * 86400 * 1000)
+            results[f'query_sensor_range/{label}'] = summarize(
+                time_calls(lambda i: query_sensor_range(1 + i % 4, start_ms, end_ms), calls))
+            results[f'query_sensor_range/{label}/all_layers'] = summarize(
+                time_calls(lambda i: query_sensor_range(None, start_ms, end_ms), calls))
+
+        results['select_latest_canopy_coverage'] = summarize(
+            time_calls(lambda i: select_latest_canopy_coverage(1 + i % 4), calls * 10))
+        results['recent_sensor_logs'] = summarize(time_calls(
+            lambda i: get_connection().execute(
+                "SELECT * FROM sensor_logs WHERE layer_id = ? AND ts_ms >= ? ORDER BY ts_ms",
+                (1 + i % 4, end_ms - 3600 * 1000)).fetchall(),
+            calls * 10))
+    return results
+
+
+BENCHMARKS = {
+    'db_helpers': bench_db_helpers,
+    'sensor_job': bench_sensor_job,
+    'photo_job': bench_photo_job,
+    'delete_old_images': bench_delete_old_images,
+    'queries': bench_queries,
+}
+
+
+def compare_results(results, baseline, tolerance):
+    """
+    基準値と比較し、許容幅を超えて悪化した指標の一覧を返す。
+
+    :return: [(ベンチマーク名, 指標名, 基準値, 今回の値, 変化率), ...]
+    """
+    regressions = []
+    for bench_name, cases in results.items():
+        for case_name, metrics in cases.items():
+            base_metrics = baseline.get(bench_name, {}).get(case_name, {})
+            for metric, value in metrics.items():
+                base = base_metrics.get(metric)
+                if metric == 'n' or not isinstance(value, (int, float)) or not base:
+                    continue
+                change = (value - base) / base
+                if metric in _LOWER_IS_BETTER:
+                    worse = change > tolerance
+                elif metric.endswith('per_sec'):
+                    worse = change < -tolerance
+                else:
+                    continue
+                if worse:
+                    regressions.append((f'{bench_name}/{case_name}', metric, base, value, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='DB・センサー・カメラの処理経路のベンチマークを実行する。')
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='実行するベンチマーク (省略時は全て)')
+    parser.add_argument('--quick', action='store_true', help='件数を減らして短時間で実行する')
+    parser.add_argument('--output', default=None, help='結果の JSON を書き込むパス (省略時は標準出力)')
+    parser.add_argument('--baseline', default=None, help='比較する基準値の JSON')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE_PATH, default=None,
+                        help=f'結果を基準値として保存する (既定: {DEFAULT_BASELINE_PATH})')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='悪化とみなす変化率 (既定: 0.2 = 20%%)')
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output) if args.output else None
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'quick': args.quick,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': {},
+    }
+
+    for name in args.only or BENCHMARKS:
+        print(f"ベンチマーク実行中: {name} ...", file=sys.stderr)
+        started = time.perf_counter()
+        report['results'][name] = BENCHMARKS[name](args.quick)
+        print(f"  完了 ({time.perf_counter() - started:.1f} 秒)", file=sys.stderr)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            f.write(text)
+        print(f"基準値を保存しました: {args.save_baseline}", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('quick') != args.quick:
+            print("警告: 基準値と --quick の指定が異なるため、比較結果は参考値です。", file=sys.stderr)
+        regressions = compare_results(report['results'], baseline['results'], args.tolerance)
+        for case, metric, base, value, change in regressions:
+            print(f"悪化: {case} {metric}: {base} -> {value} ({change:+.1%})", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"基準値からの悪化はありません (許容幅 {args.tolerance:.0%})。", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,57 @@
 # core/db_manager.py
 DB_PATH = 'smart_grow_system.db'
 
+# core/scheduler.py
+SCHEDULE_RECONCILE_INTERVAL_SEC = 30  # schedules テーブルの変更を反映する間隔
+JOB_PRELOAD_HANDLERS = True  # 起動後、登録されたジョブのモジュールを裏で読み込む (False なら初回実行時)
+
+# core/executors.py
+EXECUTOR_DEFAULT_THREADS = 10  # 撮影・保守・システムジョブを実行するスレッド数
+EXECUTOR_IO_THREADS = 4        # センサー・ポンプのジョブ専用のスレッド数 (画像処理に待たされない)
+EXECUTOR_IMAGE_PROCESSES = 2   # 画像処理ジョブを実行するプロセス数 (0 で無効。default のスレッドで実行)
+# ジョブタイプ -> 実行する executor ('default' / 'io' / 'image')。記載の無いジョブタイプは 'default'
+JOB_EXECUTORS = {
+    'sensor': 'io',
+    'water': 'io',
+    'sensor_sampling': 'io',
+    'growth_analysis': 'image',
+}
+
+# core/triggers.py
+STAGGER_ENABLED = True     # 間隔実行ジョブ (sensor/water) の開始時刻を層ごとにずらす
+STAGGER_WINDOW_SEC = 300   # オフセットを散らす幅 (秒)。実行間隔より長い場合は実行間隔まで
+STAGGER_JITTER_SEC = 0     # 毎回の実行に加えるランダムな遅延の最大秒数 (0 で無効)
+STAGGER_OFFSETS_SEC = {}   # {schedule_id: オフセット秒}。指定したスケジュールは自動計算より優先
+
+# core/db_connection.py
+DB_JOURNAL_MODE = 'WAL'        # 読み取りと書き込みを並行させる
+DB_SYNCHRONOUS = 'NORMAL'      # WAL では NORMAL でも破損しない (fsync はチェックポイント時)
+DB_BUSY_TIMEOUT_MS = 5000      # ロック競合時に待機する最大時間 (ミリ秒)
+DB_STATEMENT_CACHE_SIZE = 128  # 接続ごとのプリペアドステートメントキャッシュ数
+
+# core/log_writer.py
+LOG_WRITER_QUEUE_SIZE = 10000        # 書き込み待ちキューの上限 (超えるとバックプレッシャー)
+LOG_WRITER_BATCH_SIZE = 500          # この件数に達したら即座に一括書き込み
+LOG_WRITER_FLUSH_INTERVAL_SEC = 1.0  # 最初のレコード到着から一括書き込みまでの最大待ち時間
+LOG_WRITER_PUT_TIMEOUT_SEC = 2.0     # キュー満杯時の待機時間 (超えたら同期書き込み)
+LOG_WRITER_CRITICAL_BYPASS = True    # CRITICAL ログはキューを経由せず即時書き込みする
+LOG_WRITER_MAX_RETRIES = 3           # 一括書き込みに失敗したバッチの再試行回数 (その後は1行ずつ書き込む)
+LOG_WRITER_RETRY_BACKOFF_SEC = 0.5   # 最初の再試行までの待ち時間 (再試行ごとに2倍)
+
+# core/export.py
+EXPORT_CHUNK_SIZE = 5000  # エクスポート時に1回のクエリで読み込む行数
+
+# core/job_metrics.py
+JOB_METRICS_ENABLED = True             # ジョブの実行時間・DB時間・デバイス時間を計測する
+METRICS_HTTP_HOST = '127.0.0.1'        # メトリクスの HTTP エンドポイントの待ち受けアドレス
+METRICS_HTTP_PORT = 9108               # Prometheus 形式で /metrics を公開するポート (None で無効)
+METRICS_SNAPSHOT_INTERVAL_SEC = 300    # job_metrics_snapshots に記録する間隔 (None で無効)
+METRICS_SNAPSHOT_RETENTION_DAYS = 30   # スナップショットの保持日数
+METRICS_PROFILE_DIR = 'profiles'       # 1回分のプロファイル結果 (.prof) の保存先
+
+# core/sensor_query.py
+ROLLUP_DEFAULT_MAX_POINTS = 1000  # 期間検索で返す1層あたりの最大点数
+
 DEFAULT_SYSTEM_CONFIG = {
     "water_duration_sec": 10,
     "slack_webhook_url": "",
@@ -15,14 +66,104 @@ DEFAULT_LAYERS = [
     (1, '1段目', 0, 1), # layer_id, name, cam_id, is_active
 ]
 
+# exec_time: sensor/water は実行間隔 ('00:30:00' -> 30分おき, '02:00:00' -> 2時間おき)、
+# camera などは毎日の実行時刻。sensor/water を毎日指定時刻に実行する場合は '@' を付ける ('@12:00:00' -> 毎日12時)
 DEFAULT_SCHEDULES = [
-    (0, 'water', '12:00:00', 1), # layer_id=0 はシステム全体のジョブ
+    (0, 'water', '@12:00:00', 1), # layer_id=0 はシステム全体のジョブ。毎日12時に給水
     (0, 'sensor', '00:30:00', 1),
     (1, 'camera', '09:00:00', 1),
 ]
 
+# core/sensor_sampling.py
+SENSOR_BACKEND = 'dummy'          # センサーバックエンド ('dummy': ランダムなダミー値)
+SENSOR_SAMPLING_ENABLED = True    # sensor ジョブの間に高頻度でサンプリングし、集計値を記録する
+SENSOR_SAMPLE_INTERVAL_SEC = 5    # サンプリング間隔 (秒)
+SENSOR_BUFFER_CAPACITY = 1024     # 層ごとのリングバッファのサンプル数 (超えると古い順に上書き)
+SENSOR_MEDIAN_WINDOW = 5          # メディアンフィルタの窓幅 (1 で無効)
+SENSOR_OUTLIER_K = 3.5            # 中央値から MAD のこの倍数以上離れたサンプルを外れ値として除外
+
+# core/alert_engine.py
+ALERT_ENABLED = True              # サンプルごとにアラートを評価する
+ALERT_MIN_DURATION_SEC = 30       # 条件がこの秒数続いてから発報する (単発のスパイクでは発報しない)
+ALERT_TEMP_HYSTERESIS = 1.0       # 温度アラートの解除幅 (℃)。閾値からこの幅だけ戻るまで解消としない
+ALERT_HUMIDITY_HIGH = 90.0        # 高湿度アラート閾値 (%)。None で無効
+ALERT_HUMIDITY_LOW = 30.0         # 低湿度アラート閾値 (%)。None で無効
+ALERT_HUMIDITY_HYSTERESIS = 3.0   # 湿度アラートの解除幅 (%)
+ALERT_TEMP_RATE_PER_MIN = None    # 温度の急変アラート閾値 (℃/分)。None で無効 (ダミーセンサではノイズで発報するため)
+ALERT_RATE_SMOOTHING = 0.2        # 変化率の指数移動平均の係数 (小さいほどノイズに鈍感)
+
+# core/notifier.py
+NOTIFY_ENABLED = True               # アラートを system_config.slack_webhook_url に通知する
+NOTIFY_COALESCE_WINDOW_SEC = 30     # 最初の通知からこの秒数の間に届いた通知を1通にまとめる
+NOTIFY_DIGEST_MAX_LINES = 50        # まとめた通知に含める最大行数
+NOTIFY_MIN_INTERVAL_SEC = 1.0       # 送信の最小間隔 (秒)
+NOTIFY_HTTP_TIMEOUT_SEC = 10        # 1回の送信のタイムアウト (秒)
+NOTIFY_BACKOFF_BASE_SEC = 5         # 再送待ちの初期値 (秒)。失敗するごとに2倍
+NOTIFY_BACKOFF_MAX_SEC = 900        # 再送待ちの上限 (秒)
+NOTIFY_MAX_ATTEMPTS = 20            # この回数失敗した通知は破棄する
+NOTIFY_BATCH_LIMIT = 20             # 1回の送信処理でキューから取り出す最大件数
+NOTIFY_POLL_INTERVAL_SEC = 60       # 通知が無い時にキューを確認する間隔 (秒)
+
 # jobs/camera_jobs.py
 IMAGE_WIDTH = 1280
 IMAGE_HEIGHT = 720
 RETENTION_DAYS = 90
-BASE_SAVE_DIR = "plant_images" 
+BASE_SAVE_DIR = "plant_images"
+IMAGE_DEFAULT_FORMAT = 'jpg'  # 層ごとの設定 (layers.image_format) が無い場合の保存形式: 'jpg' / 'webp' / 'png'
+IMAGE_DEFAULT_QUALITY = 95    # 層ごとの設定 (layers.image_quality) が無い場合の品質 (jpg/webp)
+IMAGE_PNG_COMPRESSION = 3     # png 保存時の圧縮レベル (0-9)
+
+# core/frame_dedup.py
+DEDUP_ENABLED = True                 # 直前に保存したフレームとほぼ同じフレームを保存しない
+DEDUP_HASH_DISTANCE_THRESHOLD = 4    # dHash (64 ビット) のハミング距離がこれ以下なら同じとみなす
+DEDUP_CELL_DIFF_THRESHOLD = 8        # 縮小グレー画像 (32x18) の1画素の輝度差がこれを超えたら、その区画は変化したとみなす
+DEDUP_CHANGED_RATIO_THRESHOLD = 0.005  # 変化した区画の割合がこれ以下なら同じとみなす (0.005 は 576 区画中 2 区画)
+DEDUP_MAX_INTERVAL_SEC = 3600        # 変化が無くてもこの間隔で1枚は保存する (None で無効)
+
+# core/timelapse.py
+TIMELAPSE_ENABLED = True        # 撮影のたびにフレームを層ごとのタイムラプスに追記する
+TIMELAPSE_DIR = "timelapse"     # セグメントの保存先 (layer_N/YYYYMMDD_NN.ts)
+TIMELAPSE_FPS = 24              # タイムラプスのフレームレート
+TIMELAPSE_FOURCC = 'mp4v'       # MPEG-4 Part 2 (MPEG-TS に格納し、セグメントを連結できるようにする)
+                                # MPEG-TS にはコーデックのタグが無いため、どの FOURCC でも OpenCV は起動時に
+                                # "tag ... is not supported with codec id 12 and format 'mpegts'" と警告し、
+                                # タグ無し (0) で書き込む。コーデックは FOURCC から選ばれるため動画は正しく再生できる
+TIMELAPSE_PREVIEW_WIDTH = 320   # 縮小プレビューの横幅 (None でプレビューを作らない)
+
+# core/capture_coordinator.py
+CAPTURE_MAX_CONCURRENCY = 4  # 一括撮影で同時に撮影するカメラ/USBバスの最大数
+CAMERA_USB_BUS = {}          # {cam_id: バス名}。同じバス名のカメラは帯域を分け合うため順番に撮影する
+
+# core/growth_analysis.py
+GROWTH_HSV_LOWER = (35, 40, 40)     # 葉とみなす HSV の下限 (OpenCV の H は 0-179)
+GROWTH_HSV_UPPER = (85, 255, 255)   # 葉とみなす HSV の上限
+GROWTH_ANALYSIS_WIDTH = 320         # 解析前に縮小する横幅 (画素)
+GROWTH_BACKFILL_WORKERS = 4         # 過去画像の一括解析で並列にデコードするスレッド数
+GROWTH_BACKFILL_CHUNK_SIZE = 256    # 一括解析で1回に読み込む ai_reports の行数
+
+# core/capture_pipeline.py
+ENCODE_WORKERS = 2        # エンコード・保存を行うスレッド数
+ENCODE_MAX_PENDING = 8    # 保存待ちフレーム数の上限 (超えると撮影ジョブが待機する)
+
+# core/camera_session.py
+CAMERA_BACKEND = 'opencv'            # 'opencv': 実機カメラ / 'mock': 合成フレーム (ハードウェア無しの検証用)
+CAMERA_KEEP_OPEN = True              # 撮影後もデバイスを開いたままにする
+CAMERA_WARMUP_FRAMES = 5             # デバイスを開いた直後に読み捨てるフレーム数 (露出安定待ち)
+CAMERA_FLUSH_FRAMES = 2              # 開いたままのデバイスで撮影前に grab() で捨てるフレーム数 (バッファの古いフレーム)
+CAMERA_IDLE_TIMEOUT_SEC = 600        # この秒数使われていないセッションを閉じる
+CAMERA_IDLE_CHECK_INTERVAL_SEC = 60  # アイドルセッション確認ジョブの実行間隔
+
+# core/retention.py
+DB_RETENTION_POLICIES = {  # テーブル名: 保持日数 (None は無期限)
+    'sensor_logs': 14,          # 生データは2週間 (以降はロールアップで参照)
+    'system_logs': 30,
+    # ai_reports は画像ファイルと一緒に削除する (RETENTION_DAYS / 画像保持期間ジョブ)
+    'sensor_rollup_1m': 30,
+    'sensor_rollup_1h': 365,
+    'sensor_rollup_1d': None,
+}
+RETENTION_CHUNK_SIZE = 1000           # 1トランザクションで削除する最大行数
+RETENTION_CHUNK_PAUSE_SEC = 0.05      # チャンク間の休止 (他ジョブに書き込みロックを譲る)
+RETENTION_VACUUM_PAGES_PER_STEP = 200 # incremental_vacuum 1回で解放するページ数
+RETENTION_JOB_TIME = '03:15:00'       # 保持期間処理ジョブの実行時刻 (毎日)
+IMAGE_RETENTION_JOB_TIME = '03:45:00' # 画像保持期間ジョブの実行時刻 (毎日, 撮影の少ない時間帯)
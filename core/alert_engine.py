@@ -0,0 +1,266 @@
+import json
+import threading
+import time
+from dataclasses import dataclass
+from config import *
+from core.db_manager import insert_alert_log
+from core.config_cache import get_system_config
+
+# ルールの種類
+# above: 値が threshold を超えたら発報し、clear_threshold 以下に戻ったら解消
+# below: 値が threshold を下回ったら発報し、clear_threshold 以上に戻ったら解消
+# rate:  1分あたりの変化量 (平滑化した絶対値) が threshold を超えたら発報
+RULE_KINDS = ('above', 'below', 'rate')
+
+
+@dataclass(frozen=True)
+class AlertRule:
+    """
+    1つのアラート条件。clear_threshold を threshold より内側に置くことでヒステリシスを持たせ、
+    閾値付近で値が揺れても発報と解消を繰り返さないようにする。
+    """
+    name: str
+    metric: str                  # 'temperature' または 'humidity'
+    kind: str                    # RULE_KINDS のいずれか
+    threshold: float
+    clear_threshold: float
+    min_duration_sec: float = 0  # 条件がこの秒数続いてから発報する
+    severity: str = 'CRITICAL'
+    unit: str = ''
+
+    def is_triggered(self, value):
+        if self.kind == 'below':
+            return value < self.threshold
+        return value > self.threshold
+
+    def is_cleared(self, value):
+        if self.kind == 'below':
+            return value >= self.clear_threshold
+        return value <= self.clear_threshold
+
+
+@dataclass(frozen=True)
+class AlertEvent:
+    """インシデントの発生 (state='open') または解消 (state='resolved') を表すイベント。"""
+    layer_id: int
+    rule: AlertRule
+    state: str
+    value: float
+    peak: float        # インシデント中で最も閾値から離れた値
+    started_at: float  # 条件を満たし始めた時刻 (エポック秒)
+    ts: float
+
+    def message(self):
+        rule = self.rule
+        if self.state == 'open':
+            direction = '未満' if rule.kind == 'below' else '超過'
+            return f"{rule.name}: {self.value}{rule.unit} (閾値 {rule.threshold}{rule.unit} {direction})"
+        duration = int(self.ts - self.started_at)
+        return f"{rule.name} 解消: {self.value}{rule.unit} (継続 {duration}秒, ピーク {self.peak}{rule.unit})"
+
+
+class _RuleState:
+    """層・ルールごとの状態。1サンプルあたりの更新は定数時間。"""
+    __slots__ = ('active', 'pending_since', 'peak')
+
+    def __init__(self):
+        self.active = False
+        self.pending_since = None
+        self.peak = None
+
+
+class _RateState:
+    """変化率ルール用に直前のサンプルと平滑化した変化率を保持する。"""
+    __slots__ = ('last_value', 'last_ts', 'rate')
+
+    def __init__(self):
+        self.last_value = None
+        self.last_ts = None
+        self.rate = None
+
+    def update(self, value, ts, smoothing):
+        """1分あたりの変化量を指数移動平均で更新し、絶対値を返す (算出できない場合は None)。"""
+        if self.last_ts is not None and ts > self.last_ts:
+            slope = (value - self.last_value) * 60.0 / (ts - self.last_ts)
+            self.rate = slope if self.rate is None else smoothing * slope + (1 - smoothing) * self.rate
+        self.last_value, self.last_ts = value, ts
+        return None if self.rate is None else abs(self.rate)
+
+
+def build_rules(config):
+    """
+    システム設定と ALERT_* 設定から評価するルールの一覧を作る。
+
+    :param config: SystemConfig
+    """
+    rules = [
+        AlertRule('高温アラート', 'temperature', 'above', config.temp_high_threshold,
+                  config.temp_high_threshold - ALERT_TEMP_HYSTERESIS, ALERT_MIN_DURATION_SEC, unit='℃'),
+        AlertRule('低温アラート', 'temperature', 'below', config.temp_low_threshold,
+                  config.temp_low_threshold + ALERT_TEMP_HYSTERESIS, ALERT_MIN_DURATION_SEC, unit='℃'),
+    ]
+    if ALERT_HUMIDITY_HIGH is not None:
+        rules.append(AlertRule('高湿度アラート', 'humidity', 'above', ALERT_HUMIDITY_HIGH,
+                               ALERT_HUMIDITY_HIGH - ALERT_HUMIDITY_HYSTERESIS, ALERT_MIN_DURATION_SEC,
+                               severity='WARNING', unit='%'))
+    if ALERT_HUMIDITY_LOW is not None:
+        rules.append(AlertRule('低湿度アラート', 'humidity', 'below', ALERT_HUMIDITY_LOW,
+                               ALERT_HUMIDITY_LOW + ALERT_HUMIDITY_HYSTERESIS, ALERT_MIN_DURATION_SEC,
+                               severity='WARNING', unit='%'))
+    if ALERT_TEMP_RATE_PER_MIN is not None:
+        rules.append(AlertRule('温度急変アラート', 'temperature', 'rate', ALERT_TEMP_RATE_PER_MIN,
+                               ALERT_TEMP_RATE_PER_MIN / 2, ALERT_MIN_DURATION_SEC,
+                               severity='WARNING', unit='℃/分'))
+    return rules
+
+
+class AlertEngine:
+    """
+    サンプルを1件ずつ受け取り、層ごとの状態を更新しながらアラートを評価する。
+    インシデント1件につき発生・解消のイベントを1回ずつだけハンドラに渡す。
+    """
+
+    def __init__(self, rules=None, rate_smoothing=ALERT_RATE_SMOOTHING):
+        self.rules = list(rules or [])
+        self.rate_smoothing = rate_smoothing
+        self._handlers = []
+        self._config = None
+        self._states = {}       # {(layer_id, ルール名): _RuleState}
+        self._rate_states = {}  # {(layer_id, 指標名): _RateState}
+        self._lock = threading.Lock()
+
+    def add_handler(self, handler):
+        """イベントを受け取る関数 handler(event) を登録する (登録済みの場合は何もしない)。"""
+        if handler not in self._handlers:
+            self._handlers.append(handler)
+
+    def configure(self, config):
+        """システム設定が変わった場合だけルールを作り直す (発生中のインシデントの状態は保持する)。"""
+        if config is self._config:
+            return
+        rules = build_rules(config)
+        with self._lock:
+            self.rules = rules
+            self._config = config
+
+    def is_configured(self):
+        return self._config is not None
+
+    def reset(self, layer_id=None):
+        """層 (None の場合は全層) の状態を破棄する。"""
+        with self._lock:
+            if layer_id is None:
+                self._states.clear()
+                self._rate_states.clear()
+                return
+            for states in (self._states, self._rate_states):
+                for key in [key for key in states if key[0] == layer_id]:
+                    del states[key]
+
+    def evaluate(self, layer_id, temperature, humidity, ts=None):
+        """
+        1件のサンプルを評価する。
+
+        :return: 発生した AlertEvent のリスト (通常は空)
+        """
+        ts = time.time() if ts is None else ts
+        values = {'temperature': temperature, 'humidity': humidity}
+        events = []
+
+        with self._lock:
+            rates = {}
+            for rule in self.rules:
+                if rule.kind == 'rate':
+                    if rule.metric not in rates:
+                        rate_state = self._rate_states.get((layer_id, rule.metric))
+                        if rate_state is None:
+                            rate_state = self._rate_states[(layer_id, rule.metric)] = _RateState()
+                        value = values[rule.metric]
+                        rates[rule.metric] = None if value is None else rate_state.update(value, ts, self.rate_smoothing)
+                    value = rates[rule.metric]
+                else:
+                    value = values[rule.metric]
+                if value is None:
+                    continue
+
+                state = self._states.get((layer_id, rule.name))
+                if state is None:
+                    state = self._states[(layer_id, rule.name)] = _RuleState()
+                event = self._step(layer_id, rule, state, round(value, 2), ts)
+                if event:
+                    events.append(event)
+
+        for event in events:
+            self._dispatch(event)
+        return events
+
+    @staticmethod
+    def _step(layer_id, rule, state, value, ts):
+        if state.active:
+            state.peak = min(state.peak, value) if rule.kind == 'below' else max(state.peak, value)
+            if rule.is_cleared(value):
+                state.active = False
+                started_at, state.pending_since = state.pending_since, None
+                return AlertEvent(layer_id, rule, 'resolved', value, state.peak, started_at, ts)
+            return None
+
+        if not rule.is_triggered(value):
+            state.pending_since = None
+            return None
+        if state.pending_since is None:
+            state.pending_since = ts
+            state.peak = value
+        else:
+            state.peak = min(state.peak, value) if rule.kind == 'below' else max(state.peak, value)
+        if ts - state.pending_since >= rule.min_duration_sec:
+            state.active = True
+            return AlertEvent(layer_id, rule, 'open', value, state.peak, state.pending_since, ts)
+        return None
+
+    def _dispatch(self, event):
+        for handler in self._handlers:
+            try:
+                handler(event)
+            except Exception as e:
+                print(f"アラートハンドラの実行エラー ({event.rule.name}): {e}")
+
+
+def record_alert_event(event):
+    """
+    イベントを system_logs に記録する。発生はルールの重要度、解消は INFO で記録する。
+    同じトランザクションで layer_status の発生中のアラートにも追加・削除する。
+    """
+    level = event.rule.severity if event.state == 'open' else 'INFO'
+    details = f'state: {event.state}, value: {event.value}, peak: {event.peak}'
+    alert = {'severity': event.rule.severity, 'message': event.message(), 'value': event.value,
+             'since_ms': int(event.started_at * 1000)}
+    insert_alert_log(event.layer_id, level, event.message(), details, event.rule.name, event.state,
+                     json.dumps(alert, ensure_ascii=False))
+    print(f"[ALERT - {level}] Layer {event.layer_id}: {event.message()}")
+
+
+# アプリ全体で共有するアラートエンジン
+alert_engine = AlertEngine()
+alert_engine.add_handler(record_alert_event)
+
+
+def refresh_alert_rules():
+    """
+    システム設定の変更回数が変わった場合だけルールを作り直す。
+    サンプリングの1周ごとに1回呼び出し、サンプルごとの評価では設定を参照しない。
+    """
+    if ALERT_ENABLED:
+        # 変更回数が同じ間は get_system_config() が同じオブジェクトを返すため、configure() は何もしない
+        alert_engine.configure(get_system_config())
+
+
+def evaluate_sample(layer_id, temperature, humidity, ts=None):
+    """
+    現在のルールでサンプルを評価する (SamplingEngine のリスナーとして使う)。
+    ルールは refresh_alert_rules() で更新し、未設定の場合だけここで読み込む。
+    """
+    if not ALERT_ENABLED:
+        return []
+    if not alert_engine.is_configured():
+        refresh_alert_rules()
+    return alert_engine.evaluate(layer_id, temperature, humidity, ts)
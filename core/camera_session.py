@@ -0,0 +1,219 @@
+import threading
+import time
+import cv2
+import numpy as np
+from config import *
+from core.phase_timer import phase
+
+
+class CameraOpenError(Exception):
+    """カメラデバイスを開けなかった場合に送出される。"""
+
+
+class OpenCVCameraBackend:
+    """cv2.VideoCapture で実機カメラを開くバックエンド。"""
+
+    def open(self, cam_id, width, height):
+        cap = cv2.VideoCapture(cam_id)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        # 開いたままの間にドライバが古いフレームを溜め込まないよう、バッファを最小にする (未対応のバックエンドでは無視される)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+
+class MockCameraDevice:
+    """
+    合成フレームを返すダミーデバイス。
+    開いた直後のフレームは暗く、数フレームかけて明るくなる (自動露出の立ち上がりを模擬)。
+    """
+
+    def __init__(self, cam_id, width, height, settle_frames=CAMERA_WARMUP_FRAMES):
+        self.cam_id = cam_id
+        self.width = width
+        self.height = height
+        self.settle_frames = max(settle_frames, 1)
+        self.frame_count = 0
+        self.opened = True
+        # 横方向のグラデーションに緑の矩形 (植物の代わり) を描いた基準フレーム
+        base = np.zeros((height, width, 3), dtype=np.uint8)
+        base[:, :, 0] = np.linspace(40, 120, width, dtype=np.uint8)[np.newaxis, :]
+        base[:, :, 2] = 60
+        base[height // 4: height * 3 // 4, width // 3: width * 2 // 3] = (40, 160, 60)
+        self._base = base
+
+    def isOpened(self):
+        return self.opened
+
+    def grab(self):
+        if not self.opened:
+            return False
+        self.frame_count += 1
+        return True
+
+    def read(self):
+        if not self.opened:
+            return False, None
+        self.frame_count += 1
+        gain = min(self.frame_count / self.settle_frames, 1.0)
+        frame = (self._base * gain).astype(np.uint8)
+        return True, frame
+
+    def release(self):
+        self.opened = False
+
+
+class MockCameraBackend:
+    """ハードウェア無しで動作確認するための合成フレームバックエンド。"""
+
+    def open(self, cam_id, width, height):
+        return MockCameraDevice(cam_id, width, height)
+
+
+def create_camera_backend(name=CAMERA_BACKEND):
+    """設定名からカメラバックエンドを生成する ('opencv' または 'mock')。"""
+    if name == 'mock':
+        return MockCameraBackend()
+    return OpenCVCameraBackend()
+
+
+class CameraSession:
+    """1台のカメラデバイスの状態。lock で同じデバイスへのアクセスを直列化する。"""
+
+    def __init__(self, cam_id):
+        self.cam_id = cam_id
+        self.device = None
+        self.lock = threading.Lock()
+        self.last_used = 0.0
+
+    def is_open(self):
+        return self.device is not None and self.device.isOpened()
+
+    def close(self):
+        if self.device is not None:
+            self.device.release()
+            self.device = None
+
+
+class CameraSessionManager:
+    """
+    cam_id ごとにカメラデバイスを開いたまま保持するセッションマネージャ。
+
+    毎回のデバイスオープンとネゴシエーションを避け、開いた直後に warmup_frames 枚を
+    読み捨てて露出が安定したフレームを返す。開いたままのデバイスは、前回の撮影以降に
+    バッファに溜まったフレームを flush_frames 枚 grab() で捨ててから読み込む。
+    一定時間使われていないセッションは close_idle() で閉じる。
+    """
+
+    def __init__(self, backend=None, warmup_frames=CAMERA_WARMUP_FRAMES, idle_timeout_sec=CAMERA_IDLE_TIMEOUT_SEC,
+                 keep_open=CAMERA_KEEP_OPEN, width=IMAGE_WIDTH, height=IMAGE_HEIGHT,
+                 flush_frames=CAMERA_FLUSH_FRAMES):
+        self.backend = backend or create_camera_backend()
+        self.warmup_frames = warmup_frames
+        self.flush_frames = flush_frames
+        self.idle_timeout_sec = idle_timeout_sec
+        self.keep_open = keep_open
+        self.width = width
+        self.height = height
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def _get_session(self, cam_id):
+        with self._lock:
+            session = self._sessions.get(cam_id)
+            if session is None:
+                session = self._sessions[cam_id] = CameraSession(cam_id)
+            return session
+
+    def _ensure_open(self, session):
+        """
+        セッションのデバイスが閉じていれば開いてウォームアップする (session.lock 取得済みで呼ぶ)。
+
+        :return: 新しく開いた場合 True。開いたままのデバイスを再利用する場合 False
+        """
+        if session.is_open():
+            return False
+        session.close()
+        device = self.backend.open(session.cam_id, self.width, self.height)
+        if device is None:
+            raise CameraOpenError(f"VideoCapture({session.cam_id}) failed to open.")
+        session.device = device
+
+        # 開いた直後のフレームは露出が安定しないため読み捨てる
+        for _ in range(self.warmup_frames):
+            device.read()
+        return True
+
+    def _flush(self, session):
+        """
+        開いたままのデバイスのバッファに残っている古いフレームを捨てる (session.lock 取得済みで呼ぶ)。
+        grab() はデコードしないため read() より安価。
+        """
+        for _ in range(self.flush_frames):
+            if not session.device.grab():
+                break
+
+    def capture(self, cam_id):
+        """
+        指定カメラから1フレームを取得する。同じ cam_id への同時呼び出しは直列化される。
+
+        :param cam_id: layers テーブルの cam_id
+        :return: (ret, frame) cv2.VideoCapture.read() と同じ形式
+        :raises CameraOpenError: デバイスを開けなかった場合
+        """
+        session = self._get_session(cam_id)
+        with session.lock:
+            with phase('device'):
+                if not self._ensure_open(session):
+                    # 前回の撮影時のフレームが返らないよう、溜まっているフレームを捨ててから読み込む
+                    self._flush(session)
+            try:
+                with phase('device'):
+                    ret, frame = session.device.read()
+            finally:
+                session.last_used = time.monotonic()
+
+            if not ret or not self.keep_open:
+                # 読み込みに失敗したデバイスは次回開き直す
+                session.close()
+            return ret, frame
+
+    def close_idle(self):
+        """
+        idle_timeout_sec 以上使われていないセッションを閉じる。
+        撮影中のセッションには触れない。
+
+        :return: 閉じたセッション数
+        """
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.values())
+
+        closed = 0
+        for session in sessions:
+            if not session.lock.acquire(blocking=False):
+                continue
+            try:
+                if session.is_open() and now - session.last_used >= self.idle_timeout_sec:
+                    session.close()
+                    closed += 1
+            finally:
+                session.lock.release()
+        return closed
+
+    def close_all(self):
+        """すべてのセッションを閉じる (シャットダウン時に呼び出す)。"""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions = {}
+
+        for session in sessions:
+            with session.lock:
+                session.close()
+
+
+# アプリ全体で共有するカメラセッションマネージャ
+camera_manager = CameraSessionManager()
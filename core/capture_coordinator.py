@@ -0,0 +1,87 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import *
+
+# 一括撮影で共有する撮影スレッド (プロセスの間使い続ける)。
+# ジョブごとにプールを作るとスレッドごとのDB接続がジョブのたびに増えていくため、スレッドを再利用する
+_capture_executor = ThreadPoolExecutor(max_workers=CAPTURE_MAX_CONCURRENCY, thread_name_prefix='capture')
+
+
+def get_device_group(layer_info):
+    """
+    撮影を直列化する単位 (グループキー) を返す。
+    CAMERA_USB_BUS に登録された cam_id は同じバスのカメラとまとめ、それ以外は cam_id 単位とする。
+    """
+    cam_id = layer_info['cam_id']
+    bus = CAMERA_USB_BUS.get(cam_id)
+    if bus is not None:
+        return f'bus:{bus}'
+    return f'cam:{cam_id}'
+
+
+def plan_capture_groups(layers):
+    """
+    層のリストをグループキーごとに分ける (グループ内は layer_id 順)。
+
+    :return: {グループキー: [layer_info, ...]}
+    """
+    groups = {}
+    for layer_info in sorted(layers, key=lambda l: l['layer_id']):
+        groups.setdefault(get_device_group(layer_info), []).append(layer_info)
+    return groups
+
+
+def run_capture_plan(layers, capture_func, max_concurrency=CAPTURE_MAX_CONCURRENCY):
+    """
+    複数層の撮影を、グループ間は並列・グループ内は順番に実行する。
+    同時に撮影するグループ数は max_concurrency で制限する。
+
+    :param layers: layers テーブルの行のリスト
+    :param capture_func: layer_info を受け取り成否 (bool) を返す撮影関数
+    :return: {'wall_time_sec': float,
+              'layers': [{'layer_id', 'cam_id', 'group', 'ok', 'latency_sec'}, ...]}
+    """
+    groups = plan_capture_groups(layers)
+    started = time.monotonic()
+
+    def capture_group(group, group_layers):
+        results = []
+        for layer_info in group_layers:
+            t0 = time.monotonic()
+            try:
+                ok = bool(capture_func(layer_info))
+            except Exception as e:
+                print(f"エラー: Layer {layer_info['layer_id']} の撮影中に例外が発生しました: {e}")
+                ok = False
+            results.append({
+                'layer_id': layer_info['layer_id'],
+                'cam_id': layer_info['cam_id'],
+                'group': group,
+                'ok': ok,
+                'latency_sec': round(time.monotonic() - t0, 3),
+            })
+        return results
+
+    # 共有プールに workers 個のタスクを投入し、各タスクが未撮影のグループを順に取り出して撮影する
+    # (同時に撮影するグループ数は max_concurrency とプールのスレッド数の小さい方になる)
+    pending = iter(groups.items())
+    pending_lock = threading.Lock()
+
+    def capture_next_groups():
+        results = []
+        while True:
+            with pending_lock:
+                item = next(pending, None)
+            if item is None:
+                return results
+            results.extend(capture_group(*item))
+
+    workers = max(1, min(max_concurrency, len(groups)))
+    futures = [_capture_executor.submit(capture_next_groups) for _ in range(workers)]
+    results = [r for future in futures for r in future.result()]
+
+    return {
+        'wall_time_sec': round(time.monotonic() - started, 3),
+        'layers': sorted(results, key=lambda r: r['layer_id']),
+    }
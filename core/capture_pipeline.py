@@ -0,0 +1,174 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from config import *
+from core.db_manager import insert_camera_log, insert_system_log, select_latest_canopy_coverage
+from core.growth_analysis import analyze_frame, compute_growth_rate, build_summary
+from core.timelapse import timelapse_writer
+
+# 保存形式: (拡張子, cv2 の品質パラメータ)
+IMAGE_FORMATS = {
+    'jpg': ('.jpg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', cv2.IMWRITE_WEBP_QUALITY),
+    'png': ('.png', cv2.IMWRITE_PNG_COMPRESSION),
+}
+
+
+def resolve_image_format(image_format):
+    """未知の形式は警告を出して既定形式 (IMAGE_DEFAULT_FORMAT) に置き換える。"""
+    image_format = (image_format or IMAGE_DEFAULT_FORMAT).lower()
+    if image_format == 'jpeg':
+        image_format = 'jpg'
+    if image_format not in IMAGE_FORMATS:
+        print(f"警告: 未対応の画像形式 '{image_format}' のため {IMAGE_DEFAULT_FORMAT} で保存します。")
+        image_format = IMAGE_DEFAULT_FORMAT
+    return image_format
+
+
+def get_extension(image_format):
+    """保存形式に対応する拡張子 (例: '.jpg') を返す。"""
+    return IMAGE_FORMATS[resolve_image_format(image_format)][0]
+
+
+def encode_image(frame, image_format=IMAGE_DEFAULT_FORMAT, quality=IMAGE_DEFAULT_QUALITY):
+    """
+    フレームをメモリ上でエンコードする (cv2.imencode は実行中に GIL を解放する)。
+
+    :param image_format: 'jpg' / 'webp' / 'png'
+    :param quality: jpg/webp は品質 (0-100)。png は IMAGE_PNG_COMPRESSION を使用
+    :return: エンコード済みのバイト列
+    :raises ValueError: エンコードに失敗した場合
+    """
+    image_format = resolve_image_format(image_format)
+    extension, param = IMAGE_FORMATS[image_format]
+    value = IMAGE_PNG_COMPRESSION if image_format == 'png' else int(quality)
+
+    ok, buffer = cv2.imencode(extension, frame, [int(param), value])
+    if not ok:
+        raise ValueError(f"cv2.imencode({extension}) failed.")
+    return buffer.tobytes()
+
+
+def write_atomic(data, file_path):
+    """
+    一時ファイルに書き込んで fsync した後、rename で置き換える。
+    途中で失敗しても書きかけのファイルが file_path に残らない。
+
+    :raises OSError: 書き込みまたはサイズ検証に失敗した場合
+    """
+    # 同じパスへの書き込みが並行しても一時ファイルが衝突しないよう、スレッドごとに名前を分ける
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    written = os.path.getsize(file_path)
+    if written != len(data):
+        raise OSError(f"Size mismatch after write: {written} != {len(data)} bytes ({file_path})")
+
+
+class CapturePipeline:
+    """
+    撮影済みフレームのエンコード・保存・DB記録をスケジューラのスレッドから切り離す。
+
+    submit() されたフレームは有界のエンコードプールで処理される。未処理のフレームが
+    max_pending に達すると submit() は空きが出るまで待つ (メモリ使用量の上限)。
+    ai_reports への記録は、ファイルの書き込みと検証が成功した後にのみ行う。
+    on_stored はファイルの保存と ai_reports への記録の両方が成功した場合にのみ呼び出す。
+    """
+
+    def __init__(self, max_workers=ENCODE_WORKERS, max_pending=ENCODE_MAX_PENDING):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='encode')
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, layer_id, frame, file_path, image_format=IMAGE_DEFAULT_FORMAT, quality=IMAGE_DEFAULT_QUALITY,
+               on_stored=None):
+        """
+        フレームの保存を依頼する。
+
+        :param on_stored: 保存と DB 記録が成功した後に引数なしで呼び出す関数 (重複判定の比較対象の更新など)
+        :return: concurrent.futures.Future (結果は保存成否の bool)
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._process, layer_id, frame, file_path, image_format, quality,
+                                           on_stored)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _process(self, layer_id, frame, file_path, image_format, quality, on_stored=None):
+        try:
+            return self._store(layer_id, frame, file_path, image_format, quality, on_stored)
+        except Exception as e:
+            # Future の例外は誰も参照しないため、想定外のエラーもここで記録しておく
+            error_msg = f"Layer {layer_id} の画像保存中に予期せぬエラーが発生しました。"
+            insert_system_log(layer_id, 'ERROR', error_msg, f'Path: {file_path}, Error: {type(e).__name__}: {e}')
+            print(f"エラー: {error_msg} {e}")
+            return False
+
+    def _store(self, layer_id, frame, file_path, image_format, quality, on_stored):
+        try:
+            data = encode_image(frame, image_format, quality)
+            write_atomic(data, file_path)
+        except (OSError, ValueError, cv2.error) as e:
+            error_msg = f"Layer {layer_id} の画像保存失敗。"
+            insert_system_log(layer_id, 'ERROR', error_msg, f'Path: {file_path}, Error: {e}')
+            print(f"エラー: {error_msg} {e}")
+            return False
+
+        if not insert_camera_log(layer_id, file_path, **self._analyze(layer_id, frame)):
+            error_msg = f"Layer {layer_id} の画像のDB記録失敗。"
+            insert_system_log(layer_id, 'ERROR', error_msg, f'Path: {file_path}')
+            print(f"エラー: {error_msg}")
+            return False
+        if on_stored is not None:
+            on_stored()
+        self._append_timelapse(layer_id, frame)
+        insert_system_log(layer_id, 'INFO', 'Camera job finished successfully.', f'Path: {file_path}')
+        print(f"[CAMERA JOB] Layer {layer_id} の画像を {file_path} に保存しました。")
+        return True
+
+    def _analyze(self, layer_id, frame):
+        """撮影フレームのキャノピーを解析し、insert_camera_log に渡す値を返す。解析失敗時は仮の値。"""
+        try:
+            coverage, area = analyze_frame(frame)
+        except cv2.error as e:
+            print(f"警告: Layer {layer_id} の画像解析に失敗しました: {e}")
+            return {}
+
+        growth_rate = compute_growth_rate(coverage, select_latest_canopy_coverage(layer_id))
+        return {
+            'growth_rate': growth_rate,
+            'ai_summary': build_summary(coverage, area, growth_rate),
+            'canopy_coverage': coverage,
+            'canopy_area_px': area,
+        }
+
+    def _append_timelapse(self, layer_id, frame):
+        """保存したフレームを層のタイムラプスに追記する (失敗しても撮影は成功として扱う)。"""
+        if not TIMELAPSE_ENABLED:
+            return
+        try:
+            timelapse_writer.append_frame(layer_id, frame)
+        except (OSError, cv2.error) as e:
+            print(f"警告: Layer {layer_id} のタイムラプスへの追記に失敗しました: {e}")
+
+    def shutdown(self, wait=True):
+        """処理待ちのフレームをすべて保存してからエンコードプールを停止し、タイムラプスのセグメントを閉じる。"""
+        self._executor.shutdown(wait=wait)
+        timelapse_writer.close_all()
+
+
+# アプリ全体で共有するキャプチャパイプライン
+capture_pipeline = CapturePipeline()
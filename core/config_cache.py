@@ -0,0 +1,125 @@
+import sqlite3
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from config import *
+from core.db_connection import get_connection
+
+
+@dataclass(frozen=True)
+class SystemConfig:
+    """system_config テーブル (config_id=1) の型付き・不変のスナップショット。"""
+    water_duration_sec: int
+    slack_webhook_url: str
+    temp_high_threshold: float
+    temp_low_threshold: float
+    pump_gpio_sig: int
+    dashboard_url: str
+    last_modified: str = ''
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        DBの行 (辞書) から生成する。変換できない値・欠けている値は DEFAULT_SYSTEM_CONFIG で補う。
+        """
+        row = row or {}
+
+        def typed(name, cast):
+            try:
+                return cast(row[name])
+            except (KeyError, TypeError, ValueError):
+                return cast(DEFAULT_SYSTEM_CONFIG[name])
+
+        return cls(
+            water_duration_sec=typed('water_duration_sec', int),
+            slack_webhook_url=row.get('slack_webhook_url') or '',
+            temp_high_threshold=typed('temp_high_threshold', float),
+            temp_low_threshold=typed('temp_low_threshold', float),
+            pump_gpio_sig=typed('pump_gpio_sig', int),
+            dashboard_url=row.get('dashboard_url') or '',
+            last_modified=row.get('last_modified') or '',
+        )
+
+
+def get_table_version(table):
+    """
+    change_counters に記録されたテーブルの変更回数を返す (トリガーで更新される)。
+    主キー1行の参照のみのため、毎回呼び出しても安価。
+    """
+    row = get_connection().execute(
+        "SELECT version FROM change_counters WHERE table_name = ?", (table,)
+    ).fetchone()
+    return row[0] if row else None
+
+
+class VersionedCache:
+    """
+    テーブルの変更回数 (change_counters) が変わった時だけ loader で読み直すキャッシュ。
+    ダッシュボードなど別プロセスからの変更も、次の get() で反映される。
+    """
+
+    def __init__(self, table, loader):
+        self.table = table
+        self.loader = loader
+        self._lock = threading.Lock()
+        self._version = None
+        self._value = None
+
+    def get(self):
+        try:
+            # 読み込み前のバージョンを記録し、読み込み中の変更は次回の get() で拾う
+            version = get_table_version(self.table)
+            if version is not None and version == self._version:
+                return self._value
+            value = self.loader()
+        except sqlite3.Error as e:
+            print(f"設定キャッシュ更新エラー ({self.table}): {e}")
+            return self._value
+
+        with self._lock:
+            self._version = version
+            self._value = value
+        return value
+
+    def invalidate(self):
+        """次の get() で必ず読み直すようにする。"""
+        with self._lock:
+            self._version = None
+
+
+def _load_system_config():
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+    row = cursor.execute("SELECT * FROM system_config WHERE config_id = 1").fetchone()
+    return SystemConfig.from_row(dict(row) if row else None)
+
+
+def _load_layers():
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute("SELECT * FROM layers")
+    # 呼び出し側で書き換えられないよう読み取り専用のビューで保持する
+    return {row['layer_id']: MappingProxyType(dict(row)) for row in cursor.fetchall()}
+
+
+system_config_cache = VersionedCache('system_config', _load_system_config)
+layers_cache = VersionedCache('layers', _load_layers)
+
+
+def get_system_config():
+    """
+    キャッシュされたシステム設定を返す。
+
+    :return: SystemConfig (DBから読めない場合は DEFAULT_SYSTEM_CONFIG の値)
+    """
+    return system_config_cache.get() or SystemConfig.from_row(None)
+
+
+def get_layer_info(layer_id: int):
+    """
+    キャッシュされた層の設定を返す (select_layer_info のキャッシュ版)。
+
+    :return: 読み取り専用の辞書 (レコードが見つからない場合は None)
+    """
+    layers = layers_cache.get() or {}
+    return layers.get(layer_id)
@@ -0,0 +1,142 @@
+import sqlite3
+import threading
+from config import *
+from core.phase_timer import phase
+
+
+class TimedCursor(sqlite3.Cursor):
+    """SQL の実行と結果の取得にかかった時間をフェーズ 'db' として計測するカーソル。"""
+
+    def execute(self, sql, parameters=()):
+        with phase('db'):
+            return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        with phase('db'):
+            return super().executemany(sql, seq_of_parameters)
+
+    def fetchone(self):
+        with phase('db'):
+            return super().fetchone()
+
+    def fetchmany(self, size=None):
+        with phase('db'):
+            return super().fetchmany(self.arraysize if size is None else size)
+
+    def fetchall(self):
+        with phase('db'):
+            return super().fetchall()
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    ジョブのDB時間を計測する接続 (JOB_METRICS_ENABLED の場合に使用)。
+    conn.execute() も TimedCursor を経由させ、結果の取得時間まで含める。
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        with phase('db'):
+            return super().commit()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # with conn: のコミット/ロールバック
+        with phase('db'):
+            return super().__exit__(exc_type, exc_value, traceback)
+
+
+class ConnectionManager:
+    """
+    スレッドごとに長寿命の SQLite 接続を保持する接続マネージャ。
+
+    APScheduler のスレッドプールから同時に呼ばれても、各スレッドが自分専用の接続を
+    再利用するため、ヘルパー呼び出しのたびに connect/close を繰り返さない。
+    接続時に WAL・synchronous・busy_timeout を設定し、ステートメントキャッシュで
+    同じ SQL の再パースを避ける。
+    終了したスレッドの接続は、次に新しい接続を作る時に閉じて破棄する。
+    """
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # [(作成したスレッド, 接続), ...]
+        self._connections = []
+        # close_all() のたびに世代を進め、スレッドに残った古い接続を無効化する
+        self._generation = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+            # close_all() をメインスレッドから呼ぶため。接続自体は作成スレッド専用で使う
+            check_same_thread=False,
+            factory=TimedConnection if JOB_METRICS_ENABLED else sqlite3.Connection,
+        )
+        conn.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}")
+        conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}")
+        return conn
+
+    def get_connection(self):
+        """
+        呼び出し元スレッド専用の接続を返す。未作成またはクローズ済みの場合は新規に接続する。
+
+        :return: sqlite3.Connection
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.generation == self._generation:
+            return conn
+
+        conn = self._connect()
+        with self._lock:
+            dead = [c for thread, c in self._connections if not thread.is_alive()]
+            self._connections = [(thread, c) for thread, c in self._connections if thread.is_alive()]
+            self._connections.append((threading.current_thread(), conn))
+            self._local.conn = conn
+            self._local.generation = self._generation
+        # ジョブごとのスレッドなどで作られた接続が溜まり続けないよう、終了したスレッドの接続を閉じる
+        self._close(dead)
+        return conn
+
+    def _close(self, connections):
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"DB接続クローズエラー: {e}")
+
+    def close_all(self):
+        """
+        このマネージャが作成したすべての接続をクローズする。
+        以降に get_connection() が呼ばれた場合は新しい接続が作られる。
+        """
+        with self._lock:
+            connections = [conn for _, conn in self._connections]
+            self._connections = []
+            self._generation += 1
+
+        self._close(connections)
+
+
+# アプリ全体で共有する接続マネージャ
+connection_manager = ConnectionManager()
+
+
+def get_connection():
+    """現在のスレッド用の共有接続を返す。"""
+    return connection_manager.get_connection()
+
+
+def close_all_connections():
+    """共有接続マネージャの接続をすべてクローズする (シャットダウン時に呼び出す)。"""
+    connection_manager.close_all()
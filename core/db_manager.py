@@ -3,6 +3,11 @@ import os
 from datetime import datetime
 import json
 from config import *
+from core.db_connection import get_connection
+from core.log_writer import LogWriter
+from core.migrations import run_migrations
+from core.sensor_rollups import update_rollups
+from core.layer_status import update_sensor_status, update_image_status, update_alert_status
 
 def get_create_table_queries():
     return [
@@ -90,6 +95,7 @@ def get_create_table_queries():
 def init_db(db_path=DB_PATH):
     """
     データベースファイルが存在しない場合、初期化して必要なテーブルを作成し、デフォルト設定を挿入する。
+    既存のデータベースを含め、最後に未適用のスキーマ移行を適用する。
 
     :param db_path: データベースファイルのパス
     """
@@ -151,95 +157,224 @@ def init_db(db_path=DB_PATH):
     else:
         print(f"データベース '{db_path}' は既に存在します。初期化をスキップしました。")
 
-def insert_sensor_log(layer_id: int, temperature: float, humidity: float):
+    # 新規・既存どちらのDBも最新スキーマへ移行する
+    run_migrations(db_path)
+
+
+def _now_timestamps():
+    """現在時刻を (ISO 8601 文字列, エポックミリ秒) の組で返す。"""
+    now = datetime.now()
+    return now.isoformat(), int(now.timestamp() * 1000)
+
+def _write_log_batches(batches):
+    """
+    ログレコードを種別ごとに executemany で書き込み、1回のコミットで確定する。
+
+    :param batches: {'sensor': [(layer_id, timestamp, ts_ms, temperature, humidity, *SENSOR_STAT_COLUMNS), ...],
+                     'system': [(timestamp, ts_ms, layer_id, log_level, message, details), ...],
+                     'alert': [(timestamp, ts_ms, layer_id, log_level, message, details, rule_name, state, alert_json), ...]}
+    """
+    conn = get_connection()
+    with conn:
+        if batches.get('sensor'):
+            conn.executemany(
+                """
+                INSERT INTO sensor_logs (layer_id, timestamp, ts_ms, temperature, humidity,
+                                         temp_min, temp_max, temp_std, hum_min, hum_max, hum_std, sample_count) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                batches['sensor']
+            )
+            # 同じトランザクションでロールアップも差分更新する
+            update_rollups(conn, [(row[0], row[2], row[3], row[4], row[5], row[6], row[8], row[9])
+                                  for row in batches['sensor']])
+            update_sensor_status(conn, [(row[0], row[2], row[3], row[4]) for row in batches['sensor']])
+        if batches.get('system'):
+            conn.executemany(
+                """
+                INSERT INTO system_logs (timestamp, ts_ms, layer_id, log_level, message, details) 
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                batches['system']
+            )
+        if batches.get('alert'):
+            # アラートは system_logs に記録し、同じトランザクションで層の発生中のアラートを更新する
+            conn.executemany(
+                """
+                INSERT INTO system_logs (timestamp, ts_ms, layer_id, log_level, message, details) 
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [row[:6] for row in batches['alert']]
+            )
+            update_alert_status(conn, [(row[2], row[1], row[6], row[7], row[8]) for row in batches['alert']])
+
+
+# sensor_logs / system_logs のライトビハインド書き込み (run_scheduler が起動・停止する)
+log_writer = LogWriter(_write_log_batches)
+
+
+def start_log_writer():
+    """ログの一括書き込みスレッドを起動する。起動前のログは同期的に書き込まれる。"""
+    log_writer.start()
+
+
+def stop_log_writer():
+    """キューに残っているログをすべて書き込んでから一括書き込みスレッドを停止する。"""
+    log_writer.stop()
+
+
+# sensor_logs の集計値の列 (insert_sensor_log の stats 引数のキー)
+SENSOR_STAT_COLUMNS = ('temp_min', 'temp_max', 'temp_std', 'hum_min', 'hum_max', 'hum_std', 'sample_count')
+
+
+def insert_sensor_log(layer_id: int, temperature: float, humidity: float, stats: dict = None):
     """
     温湿度センサの値をセンサーログテーブル (sensor_logs) にレコードを挿入する。
+    ログライタが起動している場合はキューに積み、一括書き込みに任せる。
 
     :param layer_id: イベントが発生した層ID 
-    :param temperature: 測定された温度値
-    :param humidity: 測定された湿度値
+    :param temperature: 測定された温度値 (集計時は平均値)
+    :param humidity: 測定された湿度値 (集計時は平均値)
+    :param stats: 高頻度サンプリングの集計値 {SENSOR_STAT_COLUMNS の列名: 値}。単発の測定では None
     """
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        timestamp = datetime.now().isoformat()
+    stats = stats or {}
+    timestamp, ts_ms = _now_timestamps()
+    row = (layer_id, timestamp, ts_ms, temperature, humidity) + tuple(stats.get(c) for c in SENSOR_STAT_COLUMNS)
+    if log_writer.submit('sensor', row):
+        return
 
-        cursor.execute(
-            """
-            INSERT INTO sensor_logs (layer_id, timestamp, temperature, humidity) 
-            VALUES (?, ?, ?, ?)
-            """,
-            (layer_id, timestamp, temperature, humidity)
-        )
-        conn.commit()
-        
+    try:
+        _write_log_batches({'sensor': [row]})
     except sqlite3.Error as e:
         print(f"センサーログ記録エラー: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 
-def insert_camera_log(layer_id: int, image_path: str):
-    """ai_reports テーブルに画像パスと仮のAIデータを記録する。"""
-    conn = None
+def insert_camera_log(layer_id: int, image_path: str, growth_rate: float = 0.0, ai_summary: str = 'N/A',
+                      canopy_coverage: float = None, canopy_area_px: int = None):
+    """
+    ai_reports テーブルに画像パスと画像解析結果を記録する。
+
+    :param growth_rate: 直前の画像からのキャノピー被覆率の変化率 (%)
+    :param ai_summary: 解析結果の要約 (解析していない場合は 'N/A')
+    :param canopy_coverage: キャノピー被覆率 (%)
+    :param canopy_area_px: キャノピー面積 (画素)
+    :return: 記録できた場合 True
+    """
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        timestamp = datetime.now().isoformat()
+        conn = get_connection()
+        timestamp, ts_ms = _now_timestamps()
 
-        # growth_rate, ai_summary は Webアプリ/AI機能が未実装のため仮の値 ('N/A')
-        cursor.execute(
-            """
-            INSERT INTO ai_reports (layer_id, timestamp, growth_rate, ai_summary, ai_advice, image_path) 
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            # layer_idはデフォルト値を持たず、ジョブから渡される想定
-            (layer_id, timestamp, 0.0, 'N/A', '', image_path)
-        )
-        conn.commit()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO ai_reports (layer_id, timestamp, ts_ms, growth_rate, ai_summary, ai_advice, image_path,
+                                        canopy_coverage, canopy_area_px) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                # layer_idはデフォルト値を持たず、ジョブから渡される想定
+                (layer_id, timestamp, ts_ms, growth_rate, ai_summary, '', image_path, canopy_coverage, canopy_area_px)
+            )
+            update_image_status(conn, layer_id, ts_ms, image_path, growth_rate, canopy_coverage)
+        return True
         
     except sqlite3.Error as e:
         print(f"カメラログ記録エラー: {e}")
         # DBログ記録失敗自体は system_logs に記録できないため、コンソールに出力
-    finally:
-        if conn:
-            conn.close()
+        return False
+
+
+def select_latest_canopy_coverage(layer_id: int):
+    """
+    指定された層で解析済みの最新のキャノピー被覆率を取得する。
+
+    :return: 被覆率 (%)。解析済みの画像が無い場合は None
+    """
+    try:
+        row = get_connection().execute(
+            """
+            SELECT canopy_coverage FROM ai_reports
+            WHERE layer_id = ? AND canopy_coverage IS NOT NULL
+            ORDER BY ts_ms DESC LIMIT 1
+            """,
+            (layer_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    except sqlite3.Error as e:
+        print(f"被覆率取得エラー: {e}")
+        return None
+
+
+def select_latest_image_path(layer_id: int):
+    """
+    指定された層で最後に保存された画像のパスを取得する。
+
+    :return: 画像のパス。画像が無い場合は None
+    """
+    try:
+        row = get_connection().execute(
+            "SELECT image_path FROM ai_reports WHERE layer_id = ? ORDER BY ts_ms DESC LIMIT 1",
+            (layer_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    except sqlite3.Error as e:
+        print(f"画像パス取得エラー: {e}")
+        return None
                
             
-def insert_system_log(layer_id: int, log_level: str, message: str, details: str = None):
+def insert_system_log(layer_id: int, log_level: str, message: str, details: str = None, immediate: bool = None):
     """
     システムログテーブル (system_logs) にレコードを挿入する。
+    ログライタが起動している場合はキューに積み、一括書き込みに任せる。
 
     :param layer_id: イベントが発生した層ID (0: システム全体)
     :param log_level: ログの重要度 ('INFO', 'ERROR'など)
     :param message: ログの概要メッセージ
     :param details: 詳細情報 (スタックトレースなど)
+    :param immediate: True の場合はキューを経由せず即時に書き込む。
+                      None の場合は CRITICAL かつ LOG_WRITER_CRITICAL_BYPASS のとき即時書き込み
     """
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        timestamp = datetime.now().isoformat()
+    if immediate is None:
+        immediate = log_level == 'CRITICAL' and LOG_WRITER_CRITICAL_BYPASS
 
-        cursor.execute(
-            """
-            INSERT INTO system_logs (timestamp, layer_id, log_level, message, details) 
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (timestamp, layer_id, log_level, message, details)
-        )
-        conn.commit()
-        
+    timestamp, ts_ms = _now_timestamps()
+    row = (timestamp, ts_ms, layer_id, log_level, message, details)
+    if not immediate and log_writer.submit('system', row):
+        return
+
+    try:
+        _write_log_batches({'system': [row]})
     except sqlite3.Error as e:
         # このエラー自体をログに記録することはできないので、コンソールに出力
         print(f"致命的なエラー: System Log記録中にDBエラーが発生しました: {e}")
-        
-    finally:
-        if conn:
-            conn.close()
             
+def insert_alert_log(layer_id: int, log_level: str, message: str, details: str, rule_name: str, state: str,
+                     alert_json: str, immediate: bool = None):
+    """
+    アラートの発生・解消を system_logs に記録し、同じトランザクションで layer_status の発生中のアラートを更新する。
+    ログライタが起動している場合はキューに積み、一括書き込みに任せる。
+
+    :param rule_name: アラートルールの名前 (layer_status.open_alerts のキー)
+    :param state: 'open' (発生) または 'resolved' (解消)
+    :param alert_json: open_alerts に保存するアラートの内容 (JSON 文字列)
+    :param immediate: True の場合はキューを経由せず即時に書き込む。
+                      None の場合は CRITICAL かつ LOG_WRITER_CRITICAL_BYPASS のとき即時書き込み (insert_system_log と同じ)
+    """
+    if immediate is None:
+        immediate = log_level == 'CRITICAL' and LOG_WRITER_CRITICAL_BYPASS
+
+    timestamp, ts_ms = _now_timestamps()
+    row = (timestamp, ts_ms, layer_id, log_level, message, details, rule_name, state, alert_json)
+    if not immediate and log_writer.submit('alert', row):
+        return
+
+    try:
+        _write_log_batches({'alert': [row]})
+    except sqlite3.Error as e:
+        print(f"アラートログ記録エラー: {e}")
+
+
 def select_layer_info(layer_id: int):
     """
     指定された層 (layer_id) の設定情報を取得する。
@@ -247,10 +382,8 @@ def select_layer_info(layer_id: int):
     :param layer_id: 取得したい層のID
     :return: 層の設定を格納した辞書 (レコードが見つからない場合は None)
     """
-    conn = None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        cursor = get_connection().cursor()
         
         # layer_idに基づいてlayersテーブルから情報を取得
         cursor.execute("SELECT * FROM layers WHERE layer_id = ?", (layer_id,))
@@ -272,10 +405,24 @@ def select_layer_info(layer_id: int):
         print(f"層情報取得エラー: {e}")
         # システムログは使えないため、コンソールに出力
         return None
-    finally:
-        if conn:
-            conn.close()
             
+
+def select_active_layers():
+    """
+    有効な (is_active=1) 層をすべて取得する。
+
+    :return: 層の設定を格納した辞書のリスト (layer_id 順)
+    """
+    try:
+        cursor = get_connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute("SELECT * FROM layers WHERE is_active = 1 ORDER BY layer_id")
+        return [dict(row) for row in cursor.fetchall()]
+
+    except sqlite3.Error as e:
+        print(f"層情報取得エラー: {e}")
+        return []
+
     
 def select_schedules():
     """
@@ -283,12 +430,10 @@ def select_schedules():
 
     :return: スケジュールレコードのリスト。各要素は辞書形式。
     """
-    conn = None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        # 結果を辞書形式 (カラム名: 値) で取得できるように設定
-        conn.row_factory = sqlite3.Row 
-        cursor = conn.cursor()
+        cursor = get_connection().cursor()
+        # 結果を辞書形式 (カラム名: 値) で取得できるように設定 (共有接続には影響させない)
+        cursor.row_factory = sqlite3.Row 
 
         # is_enabled が 1 の（有効な）スケジュールのみを取得
         cursor.execute("SELECT * FROM schedules WHERE is_enabled = 1")
@@ -301,24 +446,213 @@ def select_schedules():
         print(f"スケジュール情報取得エラー: {e}")
         # エラー発生時は空のリストを返す
         return []
-    finally:
-        if conn:
-            conn.close()
-            
+
+
+def select_schedules_by_ids(schedule_ids):
+    """
+    指定した schedule_id のスケジュールを無効なものも含めて取得する。
+
+    :return: {schedule_id: スケジュールの辞書} (存在しないIDは含まれない)。
+             取得に失敗した場合は None (空の辞書は「すべて削除された」と区別できないため)
+    """
+    try:
+        cursor = get_connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        placeholders = ','.join('?' * len(schedule_ids))
+        cursor.execute(f"SELECT * FROM schedules WHERE schedule_id IN ({placeholders})", list(schedule_ids))
+        return {row['schedule_id']: dict(row) for row in cursor.fetchall()}
+
+    except sqlite3.Error as e:
+        print(f"スケジュール情報取得エラー: {e}")
+        return None
+
+
+def select_last_schedule_change_id():
+    """schedule_changes の最新の change_id を返す (変更が無い場合は 0)。"""
+    try:
+        row = get_connection().execute("SELECT MAX(change_id) FROM schedule_changes").fetchone()
+        return row[0] or 0
+
+    except sqlite3.Error as e:
+        print(f"スケジュール変更ログ取得エラー: {e}")
+        return 0
+
+
+def select_schedule_changes(after_change_id: int):
+    """
+    指定した change_id より後に変更されたスケジュールのIDを取得する。
+
+    :return: (最新の change_id, 変更された schedule_id のリスト)。変更が無い場合は (after_change_id, [])
+    """
+    try:
+        rows = get_connection().execute(
+            "SELECT change_id, schedule_id FROM schedule_changes WHERE change_id > ? ORDER BY change_id",
+            (after_change_id,)
+        ).fetchall()
+
+    except sqlite3.Error as e:
+        print(f"スケジュール変更ログ取得エラー: {e}")
+        return after_change_id, []
+
+    if not rows:
+        return after_change_id, []
+    # 同じスケジュールの複数回の変更は1回にまとめる
+    return rows[-1][0], list(dict.fromkeys(schedule_id for _, schedule_id in rows))
+
+
+def delete_schedule_changes(up_to_change_id: int):
+    """反映済みの変更ログ (change_id が指定値以下) を削除する。"""
+    try:
+        conn = get_connection()
+        with conn:
+            conn.execute("DELETE FROM schedule_changes WHERE change_id <= ?", (up_to_change_id,))
+
+    except sqlite3.Error as e:
+        print(f"スケジュール変更ログ削除エラー: {e}")
             
+
+
+def insert_notification(webhook_url: str, payload: str, next_attempt_ms: int = None):
+    """
+    送信する通知を notification_queue に保存する (送信に成功したら delete_notification で削除する)。
+
+    :return: notification_id (失敗した場合は None)
+    """
+    _, now_ms = _now_timestamps()
+    try:
+        conn = get_connection()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO notification_queue (created_ms, next_attempt_ms, webhook_url, payload) VALUES (?, ?, ?, ?)",
+                (now_ms, next_attempt_ms or now_ms, webhook_url, payload)
+            )
+        return cursor.lastrowid
+
+    except sqlite3.Error as e:
+        print(f"通知キュー保存エラー: {e}")
+        return None
+
+
+def select_due_notifications(now_ms: int, limit: int = 10):
+    """送信時刻 (next_attempt_ms) を過ぎた通知を古い順に取得する。"""
+    try:
+        cursor = get_connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(
+            "SELECT * FROM notification_queue WHERE next_attempt_ms <= ? ORDER BY next_attempt_ms, notification_id LIMIT ?",
+            (now_ms, limit)
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+    except sqlite3.Error as e:
+        print(f"通知キュー取得エラー: {e}")
+        return []
+
+
+def select_next_notification_ms():
+    """次に送信予定の通知の next_attempt_ms を返す (キューが空の場合は None)。"""
+    try:
+        return get_connection().execute("SELECT MIN(next_attempt_ms) FROM notification_queue").fetchone()[0]
+
+    except sqlite3.Error as e:
+        print(f"通知キュー取得エラー: {e}")
+        return None
+
+
+def update_notification_retry(notification_id: int, attempts: int, next_attempt_ms: int, last_error: str):
+    """送信に失敗した通知の試行回数と次回の送信時刻を更新する。"""
+    try:
+        conn = get_connection()
+        with conn:
+            conn.execute(
+                "UPDATE notification_queue SET attempts = ?, next_attempt_ms = ?, last_error = ? WHERE notification_id = ?",
+                (attempts, next_attempt_ms, last_error, notification_id)
+            )
+
+    except sqlite3.Error as e:
+        print(f"通知キュー更新エラー: {e}")
+
+
+def delete_notification(notification_id: int):
+    """送信済み (または破棄する) 通知をキューから削除する。"""
+    try:
+        conn = get_connection()
+        with conn:
+            conn.execute("DELETE FROM notification_queue WHERE notification_id = ?", (notification_id,))
+
+    except sqlite3.Error as e:
+        print(f"通知キュー削除エラー: {e}")
+
+
+
+def insert_job_metrics_snapshots(rows, delete_before_ms: int = None):
+    """
+    ジョブメトリクスのスナップショットを記録し、delete_before_ms より古いスナップショットを削除する。
+
+    :param rows: [(ts_ms, job_type, runs, failures, skipped, misfires, duration_sum_sec,
+                   p50_ms, p99_ms, max_ms, db_sec, device_sec), ...]
+    """
+    try:
+        conn = get_connection()
+        with conn:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO job_metrics_snapshots
+                    (ts_ms, job_type, runs, failures, skipped, misfires, duration_sum_sec,
+                     p50_ms, p99_ms, max_ms, db_sec, device_sec)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+            if delete_before_ms is not None:
+                conn.execute("DELETE FROM job_metrics_snapshots WHERE ts_ms < ?", (delete_before_ms,))
+
+    except sqlite3.Error as e:
+        print(f"ジョブメトリクス記録エラー: {e}")
+
+
+def select_export_mark(export_name: str):
+    """
+    差分エクスポートの位置を取得する。
+
+    :return: {'table_name': str, 'last_id': int} (未保存の場合は None)
+    """
+    try:
+        row = get_connection().execute(
+            "SELECT table_name, last_id FROM export_marks WHERE export_name = ?", (export_name,)
+        ).fetchone()
+        return {'table_name': row[0], 'last_id': row[1]} if row else None
+
+    except sqlite3.Error as e:
+        print(f"エクスポート位置取得エラー: {e}")
+        return None
+
+
+def update_export_mark(export_name: str, table_name: str, last_id: int):
+    """差分エクスポートの位置を保存する (出力ファイルの書き込みが完了してから呼ぶ)。"""
+    timestamp, _ = _now_timestamps()
+    conn = get_connection()
+    with conn:
+        conn.execute(
+            """
+            INSERT INTO export_marks (export_name, table_name, last_id, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (export_name) DO UPDATE SET
+                table_name = excluded.table_name, last_id = excluded.last_id, updated_at = excluded.updated_at
+            """,
+            (export_name, table_name, last_id, timestamp)
+        )
+
 def select_system_config():
     """
     system_config テーブルの全設定を取得し、{カラム名: 値} の辞書形式で返す。
     
     :return: {設定名: 値} の辞書
     """
-    conn = None
     config = {}
     try:
-        conn = sqlite3.connect(DB_PATH)
-        # 結果を辞書形式で取得できるように設定
-        conn.row_factory = sqlite3.Row 
-        cursor = conn.cursor()
+        cursor = get_connection().cursor()
+        # 結果を辞書形式で取得できるように設定 (共有接続には影響させない)
+        cursor.row_factory = sqlite3.Row 
         
         # テーブル全体を取得 (config_id=1の行のみを想定)
         cursor.execute("SELECT * FROM system_config WHERE config_id = 1")
@@ -349,8 +683,5 @@ def select_system_config():
                 
     except sqlite3.Error as e:
         print(f"システム設定読み込みエラー: {e}")
-    finally:
-        if conn:
-            conn.close()
             
     return config
\ No newline at end of file
@@ -0,0 +1,66 @@
+import atexit
+import time
+import traceback
+from apscheduler.executors.pool import ThreadPoolExecutor, ProcessPoolExecutor
+from config import *
+from core import phase_timer
+
+# 別プロセスでジョブを実行する executor の名前
+PROCESS_EXECUTOR = 'image'
+
+
+def build_executors():
+    """
+    スケジューラの executor を作成する。
+
+    * default: 撮影・保守・システムジョブ (スレッド)
+    * io: センサー・ポンプのジョブ (スレッド)。CPU 負荷の高いジョブと同じプールで待たされない
+    * image: 画像処理ジョブ (プロセス)。GIL を共有しないため、処理中も他のジョブの実行を遅らせない
+    """
+    executors = {
+        'default': ThreadPoolExecutor(EXECUTOR_DEFAULT_THREADS),
+        'io': ThreadPoolExecutor(EXECUTOR_IO_THREADS),
+    }
+    if EXECUTOR_IMAGE_PROCESSES:
+        # ワーカーは spawn で起動する (親プロセスの DB 接続・ロック・スレッドを引き継がない)
+        executors[PROCESS_EXECUTOR] = ProcessPoolExecutor(EXECUTOR_IMAGE_PROCESSES,
+                                                          pool_kwargs={'initializer': init_worker})
+    return executors
+
+
+def get_executor_name(job_type):
+    """ジョブタイプを実行する executor の名前を返す (プロセスプールが無効の場合は 'default')。"""
+    name = JOB_EXECUTORS.get(job_type, 'default')
+    if name == PROCESS_EXECUTOR and not EXECUTOR_IMAGE_PROCESSES:
+        return 'default'
+    return name
+
+
+def init_worker():
+    """
+    プロセスプールのワーカーの初期化。DB 接続はワーカー内で (スレッドごとに) 新しく作られ、
+    ワーカーの終了時に閉じる。ログライタは起動しないため、ログは同期的に書き込まれる。
+    """
+    from core.db_connection import close_all_connections
+    atexit.register(close_all_connections)
+
+
+def run_in_worker(ref, job_type, job_kwargs):
+    """
+    プロセスプールで実行するジョブの入口。モジュールの関数として pickle できるよう、
+    ハンドラは 'モジュール:関数名' で受け取りワーカー内で import する。
+    メトリクスは親プロセスで集計するため、計測結果を戻り値で返す (例外もここで捕捉する)。
+
+    :return: {'job_type', 'duration', 'failed', 'phases'}
+    """
+    from core.job_registry import resolve_handler
+    phase_timer.begin()
+    started = time.perf_counter()
+    failed = False
+    try:
+        resolve_handler(ref)(**job_kwargs)
+    except Exception:
+        failed = True
+        print(f"[CRITICAL ERROR] {job_type} ジョブ (ワーカープロセス) が失敗しました:\n{traceback.format_exc()}")
+    return {'job_type': job_type, 'duration': time.perf_counter() - started, 'failed': failed,
+            'phases': phase_timer.end()}
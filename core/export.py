@@ -0,0 +1,317 @@
+"""
+sensor_logs / ai_reports / system_logs をチャンク単位で読み出し、CSV・JSON Lines・npz に書き出す。
+
+    python -m core.export --table sensor_logs --format csv --output sensor.csv
+    python -m core.export --table sensor_logs --format npz --output sensor.npz --layer 1 --start 2025-01-01
+    python -m core.export --table system_logs --format jsonl --output - --since-mark nightly_system_logs
+
+--since-mark を指定すると、前回そのエクスポート名で出力した最大の主キーより後の行だけを出力し、
+出力ファイルの書き込みが完了してから位置を更新する (夜間の差分同期用)。
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import zipfile
+import numpy as np
+from config import *
+from core.db_connection import get_connection
+from core.db_manager import select_export_mark, update_export_mark
+from core.migrations import iso_to_epoch_ms
+
+# テーブルごとの主キーと出力列 (列名, 型)。型は npz の列の型で、'text' は可変長文字列。
+# 整数列の NULL は npz では -1、実数列の NULL は NaN になる
+EXPORT_TABLES = {
+    'sensor_logs': {
+        'key': 'log_id',
+        'columns': [('log_id', 'i8'), ('layer_id', 'i8'), ('ts_ms', 'i8'), ('timestamp', 'text'),
+                    ('temperature', 'f8'), ('humidity', 'f8'),
+                    ('temp_min', 'f8'), ('temp_max', 'f8'), ('temp_std', 'f8'),
+                    ('hum_min', 'f8'), ('hum_max', 'f8'), ('hum_std', 'f8'), ('sample_count', 'i8')],
+    },
+    'ai_reports': {
+        'key': 'report_id',
+        'columns': [('report_id', 'i8'), ('layer_id', 'i8'), ('ts_ms', 'i8'), ('timestamp', 'text'),
+                    ('growth_rate', 'f8'), ('canopy_coverage', 'f8'), ('canopy_area_px', 'i8'),
+                    ('ai_summary', 'text'), ('ai_advice', 'text'), ('image_path', 'text')],
+    },
+    'system_logs': {
+        'key': 'log_id',
+        'columns': [('log_id', 'i8'), ('layer_id', 'i8'), ('ts_ms', 'i8'), ('timestamp', 'text'),
+                    ('log_level', 'text'), ('message', 'text'), ('details', 'text')],
+    },
+}
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'npz')
+
+
+def get_export_columns(table):
+    return [name for name, _ in EXPORT_TABLES[table]['columns']]
+
+
+def iter_chunks(table, layer_id=None, start_ms=None, end_ms=None, after_id=0, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    条件に合う行をチャンク (行タプルのリスト) 単位で返すジェネレータ。
+    チャンクごとに前回の最後の行より後を検索し直すため、読み取りトランザクションを長時間保持しない。
+
+    期間を指定しない場合は主キー順に返す。期間を指定した場合は (layer_id, ts_ms) インデックスで
+    層ごとに期間内だけを検索し、層ごとに (ts_ms, 主キー) 順に返す (狭い期間でもテーブル全体を読まない)。
+
+    :param after_id: この主キーより後の行だけを返す (差分エクスポート用)
+    :param start_ms: 期間の開始 (エポックミリ秒, この値を含む)
+    :param end_ms: 期間の終了 (エポックミリ秒, この値を含まない)
+    """
+    if start_ms is not None or end_ms is not None:
+        layer_ids = [layer_id] if layer_id is not None else _iter_layer_ids(table)
+        for current in layer_ids:
+            yield from _iter_layer_time_chunks(table, current, start_ms, end_ms, after_id, chunk_size)
+        return
+
+    key = EXPORT_TABLES[table]['key']
+    filters = ''
+    params = []
+    if layer_id is not None:
+        filters += ' AND layer_id = ?'
+        params.append(layer_id)
+    query = (f"SELECT {', '.join(get_export_columns(table))} FROM {table} "
+             f"WHERE {key} > ?{filters} ORDER BY {key} LIMIT ?")
+
+    conn = get_connection()
+    last_id = after_id or 0
+    while True:
+        rows = conn.execute(query, [last_id] + params + [chunk_size]).fetchall()
+        if not rows:
+            return
+        yield rows
+        # 主キーは先頭の列
+        last_id = rows[-1][0]
+        if len(rows) < chunk_size:
+            return
+
+
+def _iter_layer_ids(table):
+    """(layer_id, ts_ms) インデックスを飛び飛びに検索して、テーブルにある layer_id を順に返す (NULL を含む)。"""
+    conn = get_connection()
+    if conn.execute(f"SELECT 1 FROM {table} WHERE layer_id IS NULL LIMIT 1").fetchone():
+        yield None
+    row = conn.execute(f"SELECT MIN(layer_id) FROM {table}").fetchone()
+    while row[0] is not None:
+        yield row[0]
+        row = conn.execute(f"SELECT MIN(layer_id) FROM {table} WHERE layer_id > ?", (row[0],)).fetchone()
+
+
+def _iter_layer_time_chunks(table, layer_id, start_ms, end_ms, after_id, chunk_size):
+    """
+    1つの層の期間内の行を (ts_ms, 主キー) 順にチャンクで返す。
+    (layer_id, ts_ms) インデックス (各項目の末尾に rowid = 主キーを持つ) の範囲検索だけで読み進める。
+    """
+    key = EXPORT_TABLES[table]['key']
+    filters = ''
+    params = [layer_id]
+    if start_ms is not None:
+        filters += ' AND ts_ms >= ?'
+        params.append(start_ms)
+    if end_ms is not None:
+        filters += ' AND ts_ms < ?'
+        params.append(end_ms)
+    if after_id:
+        filters += f' AND {key} > ?'
+        params.append(after_id)
+    # layer_id IS ? は NULL の層にも一致し、= ? と同じくインデックスで検索される
+    query = (f"SELECT {', '.join(get_export_columns(table))} FROM {table} "
+             f"WHERE layer_id IS ?{filters} AND (ts_ms, {key}) > (?, ?) "
+             f"ORDER BY ts_ms, {key} LIMIT ?")
+    ts_index = get_export_columns(table).index('ts_ms')
+
+    conn = get_connection()
+    last = (-1, -1) if start_ms is None else (start_ms - 1, -1)
+    while True:
+        rows = conn.execute(query, params + [last[0], last[1], chunk_size]).fetchall()
+        if not rows:
+            return
+        yield rows
+        last = (rows[-1][ts_index], rows[-1][0])
+        if len(rows) < chunk_size:
+            return
+
+
+def iter_rows(table, **filters):
+    """iter_chunks() の行を1行ずつ {列名: 値} の辞書で返す。"""
+    columns = get_export_columns(table)
+    for rows in iter_chunks(table, **filters):
+        for row in rows:
+            yield dict(zip(columns, row))
+
+
+def write_csv(chunks, columns, f):
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+
+
+def write_jsonl(chunks, columns, f):
+    for rows in chunks:
+        f.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows)
+
+
+class _ColumnSpool:
+    """列の値を一時ファイルに追記し、最後に .npy として書き出す (行数が事前に分からなくてよい)。"""
+
+    def __init__(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self.file = tempfile.TemporaryFile()
+        self.count = 0
+
+    def append(self, array):
+        self.file.write(np.ascontiguousarray(array, dtype=self.dtype).tobytes())
+        self.count += len(array)
+
+    def write_npy(self, zf, name):
+        header = {'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False, 'shape': (self.count,)}
+        with zf.open(f'{name}.npy', 'w', force_zip64=True) as out:
+            np.lib.format.write_array_header_1_0(out, header)
+            self.file.seek(0)
+            shutil.copyfileobj(self.file, out)
+        self.file.close()
+
+
+def write_npz(chunks, table, f):
+    """
+    列ごとの配列を圧縮 npz に書き出す。メモリに保持するのは1チャンク分だけ。
+    文字列の列 X は UTF-8 を連結した X.data (uint8) と、各行の開始位置 X.offsets (int64, 行数+1) になる。
+    (load_npz_text() で文字列のリストに戻せる)
+    """
+    spools = {}
+    text_lengths = {}
+    for name, kind in EXPORT_TABLES[table]['columns']:
+        if kind == 'text':
+            spools[f'{name}.data'] = _ColumnSpool(np.uint8)
+            spools[f'{name}.offsets'] = _ColumnSpool(np.int64)
+            spools[f'{name}.offsets'].append([0])
+            text_lengths[name] = 0
+        else:
+            spools[name] = _ColumnSpool(kind)
+
+    for rows in chunks:
+        for i, (name, kind) in enumerate(EXPORT_TABLES[table]['columns']):
+            values = [row[i] for row in rows]
+            if kind == 'text':
+                encoded = [(value or '').encode('utf-8') for value in values]
+                lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+                spools[f'{name}.data'].append(np.frombuffer(b''.join(encoded), dtype=np.uint8))
+                spools[f'{name}.offsets'].append(text_lengths[name] + np.cumsum(lengths))
+                text_lengths[name] += int(lengths.sum())
+            elif kind == 'f8':
+                spools[name].append(np.array(values, dtype=np.float64))
+            else:
+                spools[name].append(np.array([-1 if value is None else value for value in values], dtype=np.int64))
+
+    with zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, spool in spools.items():
+            spool.write_npy(zf, name)
+
+
+def load_npz_text(npz, column):
+    """write_npz() で書き出した文字列の列を文字列のリストに戻す。"""
+    data = npz[f'{column}.data'].tobytes()
+    offsets = npz[f'{column}.offsets']
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+
+def export_table(table, output_path, output_format='csv', layer_id=None, start_ms=None, end_ms=None,
+                 since_mark=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    テーブルの行をファイルに書き出す。ファイルは一時ファイルに書いてから置き換える。
+
+    :param output_path: 出力先 ('-' は標準出力。csv/jsonl のみ)
+    :param since_mark: 差分エクスポート名。前回の位置より後の行だけを出力し、成功後に位置を更新する。
+                       AUTOINCREMENT の主キーは書き込み順に増えるため、前回以降に追加された行だけが対象になる
+    :return: {'rows': 出力行数, 'last_id': 最後の主キー (0 行の場合は開始位置)}
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"エクスポートできないテーブルです: {table}")
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"未対応の形式です: {output_format}")
+    if output_path == '-' and output_format == 'npz':
+        raise ValueError("npz は標準出力に書き出せません。")
+
+    after_id = 0
+    if since_mark:
+        mark = select_export_mark(since_mark)
+        if mark and mark['table_name'] != table:
+            raise ValueError(f"エクスポート名 '{since_mark}' は {mark['table_name']} 用です。")
+        after_id = mark['last_id'] if mark else 0
+
+    result = {'rows': 0, 'last_id': after_id}
+
+    def counted(chunks):
+        for rows in chunks:
+            result['rows'] += len(rows)
+            # 期間指定の出力は主キー順ではないため、最大の主キーを位置として記録する
+            result['last_id'] = max(result['last_id'], max(row[0] for row in rows))
+            yield rows
+
+    chunks = counted(iter_chunks(table, layer_id, start_ms, end_ms, after_id, chunk_size))
+    columns = get_export_columns(table)
+
+    if output_path == '-':
+        writer = write_csv if output_format == 'csv' else write_jsonl
+        writer(chunks, columns, sys.stdout)
+    else:
+        tmp_path = f"{output_path}.tmp"
+        try:
+            if output_format == 'npz':
+                with open(tmp_path, 'wb') as f:
+                    write_npz(chunks, table, f)
+            else:
+                writer = write_csv if output_format == 'csv' else write_jsonl
+                with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+                    writer(chunks, columns, f)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    if since_mark and result['rows']:
+        update_export_mark(since_mark, table, result['last_id'])
+    return result
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    ms = iso_to_epoch_ms(value)
+    if ms is None:
+        raise argparse.ArgumentTypeError(f"ISO 8601 形式の時刻を指定してください: {value}")
+    return ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description='時系列テーブルをチャンク単位で CSV / JSON Lines / npz に書き出す。')
+    parser.add_argument('--table', required=True, choices=sorted(EXPORT_TABLES))
+    parser.add_argument('--format', dest='output_format', default='csv', choices=EXPORT_FORMATS)
+    parser.add_argument('--output', required=True, help="出力ファイル ('-' は標準出力, csv/jsonl のみ)")
+    parser.add_argument('--layer', type=int, default=None, help='対象の層ID (省略時は全層)')
+    parser.add_argument('--start', type=_parse_time, default=None, help='期間の開始 (ISO 8601, この時刻を含む)')
+    parser.add_argument('--end', type=_parse_time, default=None, help='期間の終了 (ISO 8601, この時刻を含まない)')
+    parser.add_argument('--since-mark', default=None, help='差分エクスポート名 (前回の出力以降の行だけを出力)')
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    try:
+        result = export_table(args.table, args.output, args.output_format, args.layer, args.start, args.end,
+                              args.since_mark, args.chunk_size)
+    except (ValueError, OSError, sqlite3.Error) as e:
+        print(f"エクスポートエラー: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"{args.table}: {result['rows']} 行を出力しました (最後の主キー: {result['last_id']})", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
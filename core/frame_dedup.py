@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+import cv2
+import numpy as np
+from config import *
+from core.db_manager import insert_system_log, select_latest_image_path
+
+# 比較用の縮小グレー画像の大きさ (幅, 高さ)。16:9 のカメラで縦横の比率がほぼ保たれる
+THUMBNAIL_SIZE = (32, 18)
+# dHash の大きさ (横に隣接する画素の比較 8 x 8 = 64 ビット)
+_HASH_SIZE = 8
+
+
+class FrameSignature:
+    """フレームの比較用の特徴 (64 ビットの dHash と縮小グレー画像)。"""
+    __slots__ = ('hash', 'thumbnail')
+
+    def __init__(self, hash_value, thumbnail):
+        self.hash = hash_value
+        self.thumbnail = thumbnail
+
+    def distance(self, other, cell_threshold=DEDUP_CELL_DIFF_THRESHOLD):
+        """
+        :param cell_threshold: 縮小画像の1画素 (元画像の一区画) の輝度差がこの値を超えたら変化した区画とみなす
+        :return: (dHash のハミング距離 [ビット], 変化した区画の割合 [0-1])
+        """
+        bits = bin(self.hash ^ other.hash).count('1')
+        # 平均輝度差では小さな葉の変化が画像全体に薄まるため、変化した区画の割合で比べる
+        changed = float((np.abs(self.thumbnail - other.thumbnail) > cell_threshold).mean())
+        return bits, changed
+
+
+def compute_signature(frame):
+    """
+    フレームの dHash と縮小グレー画像を求める。
+    先に間引いてから縮小するため、1280x720 のフレームでも 1 ミリ秒未満で計算できる。
+
+    :param frame: BGR またはグレースケールの画像 (numpy 配列)
+    """
+    height, width = frame.shape[:2]
+    # 縮小後の約4倍の解像度まで間引く (全画素を縮小するより大幅に速く、ノイズは平均される)
+    step = max(1, min(height // (THUMBNAIL_SIZE[1] * 4), width // (THUMBNAIL_SIZE[0] * 4)))
+    sampled = np.ascontiguousarray(frame[::step, ::step])
+    small = cv2.resize(sampled, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    gray = small if small.ndim == 2 else cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    hash_image = cv2.resize(gray, (_HASH_SIZE + 1, _HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = np.packbits(hash_image[:, 1:] > hash_image[:, :-1])
+    return FrameSignature(int.from_bytes(bits.tobytes(), 'big'), gray.astype(np.float32))
+
+
+class FrameDeduplicator:
+    """
+    層ごとに最後に保存したフレームの特徴を保持し、ほぼ同じフレームの保存を省く。
+
+    dHash のハミング距離と、縮小画像で変化した区画の割合の両方がしきい値以下の場合に「変化なし」とみなす。
+    変化が無くても max_interval_sec ごとに1枚は保存する。
+    check() で判定し、保存と DB 記録が成功した後に mark_stored() で比較対象を更新する
+    (保存に失敗したフレームを比較対象にすると、以降の同じフレームが保存されなくなるため)。
+    """
+
+    def __init__(self, hash_threshold=DEDUP_HASH_DISTANCE_THRESHOLD, changed_threshold=DEDUP_CHANGED_RATIO_THRESHOLD,
+                 max_interval_sec=DEDUP_MAX_INTERVAL_SEC):
+        self.hash_threshold = hash_threshold
+        self.changed_threshold = changed_threshold
+        self.max_interval_sec = max_interval_sec
+        # {層ID: (FrameSignature, 保存した時刻 [monotonic 秒])}
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def _load_last_stored(self, layer_id):
+        """再起動直後は、最後に保存された画像を縮小デコードして比較対象にする。"""
+        image_path = select_latest_image_path(layer_id)
+        image = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_4) if image_path else None
+        # 保存時刻は不明なため、変化が無ければ max_interval_sec 後に保存する
+        return (compute_signature(image), time.monotonic()) if image is not None else None
+
+    def _get_last(self, layer_id):
+        with self._lock:
+            if layer_id in self._last:
+                return self._last[layer_id]
+        # DB の参照と画像のデコードは他の層を待たせないようロックの外で行う
+        loaded = self._load_last_stored(layer_id)
+        with self._lock:
+            # 読み込み中に他のスレッドが保存・読み込みした場合はそちらを優先する
+            return self._last.setdefault(layer_id, loaded)
+
+    def check(self, layer_id, frame):
+        """
+        フレームを保存すべきか判定する。保存しない場合は「変化なし」を system_logs に記録する (ログライタ経由の1行のみ)。
+        比較対象は更新しないため、保存が成功した後に mark_stored() を呼び出すこと。
+
+        :return: 保存する場合はフレームの特徴 (FrameSignature)。変化が無く保存しない場合は None
+        """
+        signature = compute_signature(frame)
+        last = self._get_last(layer_id)
+
+        if last is not None and (self.max_interval_sec is None or time.monotonic() - last[1] < self.max_interval_sec):
+            bits, changed = signature.distance(last[0])
+            if bits <= self.hash_threshold and changed <= self.changed_threshold:
+                insert_system_log(layer_id, 'INFO', 'Frame unchanged; not stored.',
+                                  json.dumps({'hash_distance': bits, 'changed_ratio': round(changed, 4)}))
+                return None
+        return signature
+
+    def mark_stored(self, layer_id, signature):
+        """保存と DB 記録が成功したフレームの特徴を、次の比較対象にする。"""
+        with self._lock:
+            self._last[layer_id] = (signature, time.monotonic())
+
+    def reset(self, layer_id=None):
+        """比較対象を破棄する (次のフレームは必ず保存される)。"""
+        with self._lock:
+            for key in (list(self._last) if layer_id is None else [layer_id]):
+                self._last[key] = None
+
+
+# アプリ全体で共有する重複判定
+frame_deduplicator = FrameDeduplicator()
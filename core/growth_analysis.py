@@ -0,0 +1,165 @@
+import argparse
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from config import *
+from core.db_connection import get_connection
+
+_HSV_LOWER = np.array(GROWTH_HSV_LOWER, dtype=np.uint8)
+_HSV_UPPER = np.array(GROWTH_HSV_UPPER, dtype=np.uint8)
+
+
+def _downscale(image, width=GROWTH_ANALYSIS_WIDTH):
+    """解析用に横幅 width まで縮小する (既に小さい場合はそのまま)。"""
+    h, w = image.shape[:2]
+    if w <= width:
+        return image
+    height = max(1, round(h * width / w))
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def analyze_frame(frame, full_size=None):
+    """
+    HSV しきい値で緑の葉 (キャノピー) の画素を抽出し、被覆率と面積を求める。
+
+    :param frame: BGR 画像 (numpy 配列)
+    :param full_size: 元画像の (幅, 高さ)。縮小済みの画像を渡す場合に面積の換算に使う
+    :return: (被覆率 %, 元解像度換算のキャノピー面積 [画素])
+    """
+    small = _downscale(frame)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, _HSV_LOWER, _HSV_UPPER)
+
+    canopy_px = cv2.countNonZero(mask)
+    coverage = canopy_px * 100.0 / mask.size
+
+    if full_size is None:
+        full_size = (frame.shape[1], frame.shape[0])
+    area = int(round(coverage / 100.0 * full_size[0] * full_size[1]))
+    return coverage, area
+
+
+def analyze_image_file(image_path):
+    """
+    画像ファイルを解析する。JPEG は 1/4 サイズで直接デコードし、フル解像度のデコードを避ける。
+
+    :return: (被覆率 %, キャノピー面積 [画素])。読み込めない場合は None
+    """
+    image = cv2.imread(image_path, cv2.IMREAD_REDUCED_COLOR_4)
+    if image is None:
+        return None
+    # 縮小デコードした分を元解像度に換算する
+    full_size = (image.shape[1] * 4, image.shape[0] * 4)
+    return analyze_frame(image, full_size)
+
+
+def compute_growth_rate(coverage, previous_coverage):
+    """
+    直前の画像からの被覆率の変化率 (%) を返す。比較対象が無い場合は 0.0。
+    """
+    if previous_coverage is None or previous_coverage <= 0:
+        return 0.0
+    return (coverage - previous_coverage) * 100.0 / previous_coverage
+
+
+def build_summary(coverage, area, growth_rate):
+    """ai_reports.ai_summary に記録する要約文を作成する。"""
+    return f"Canopy coverage {coverage:.1f}% ({area} px), growth {growth_rate:+.1f}% vs previous image"
+
+
+def select_previous_coverage(conn, layer_id, ts_ms):
+    """指定時刻より前で、解析済みの最新の被覆率を返す (無い場合は None)。"""
+    row = conn.execute(
+        """
+        SELECT canopy_coverage FROM ai_reports
+        WHERE layer_id = ? AND ts_ms < ? AND canopy_coverage IS NOT NULL
+        ORDER BY ts_ms DESC LIMIT 1
+        """,
+        (layer_id, ts_ms)
+    ).fetchone()
+    return row[0] if row else None
+
+
+def backfill_growth_reports(layer_id=None, workers=GROWTH_BACKFILL_WORKERS, chunk_size=GROWTH_BACKFILL_CHUNK_SIZE):
+    """
+    未解析 (canopy_coverage が NULL) の ai_reports を古い順に解析し、
+    growth_rate / ai_summary / canopy_coverage / canopy_area_px を埋める。
+    画像のデコードと解析は複数スレッドで行う (OpenCV は処理中に GIL を解放する)。
+
+    :param layer_id: 対象の層ID (None の場合は全層)
+    :return: {'analyzed': 解析した件数, 'missing': 読み込めなかった画像の件数}
+    """
+    conn = get_connection()
+    if layer_id is None:
+        layer_ids = [r[0] for r in conn.execute(
+            "SELECT DISTINCT layer_id FROM ai_reports WHERE canopy_coverage IS NULL ORDER BY layer_id")]
+    else:
+        layer_ids = [layer_id]
+
+    result = {'analyzed': 0, 'missing': 0}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='growth') as executor:
+        for target_layer in layer_ids:
+            previous = None
+            last_key = (-1, -1)
+            while True:
+                rows = conn.execute(
+                    """
+                    SELECT ts_ms, report_id, image_path FROM ai_reports
+                    WHERE layer_id = ? AND canopy_coverage IS NULL AND (ts_ms, report_id) > (?, ?)
+                    ORDER BY ts_ms, report_id LIMIT ?
+                    """,
+                    (target_layer, last_key[0], last_key[1], chunk_size)
+                ).fetchall()
+                if not rows:
+                    break
+                if last_key == (-1, -1):
+                    previous = select_previous_coverage(conn, target_layer, rows[0][0])
+                last_key = rows[-1][:2]
+
+                updates = []
+                analyses = executor.map(analyze_image_file, [row[2] for row in rows])
+                for (_, report_id, image_path), analysis in zip(rows, analyses):
+                    if analysis is None:
+                        # 画像が無い行は未解析のまま残す
+                        result['missing'] += 1
+                        continue
+                    coverage, area = analysis
+                    growth_rate = compute_growth_rate(coverage, previous)
+                    updates.append((growth_rate, build_summary(coverage, area, growth_rate), coverage, area, report_id))
+                    previous = coverage
+
+                with conn:
+                    conn.executemany(
+                        """
+                        UPDATE ai_reports
+                        SET growth_rate = ?, ai_summary = ?, canopy_coverage = ?, canopy_area_px = ?
+                        WHERE report_id = ?
+                        """,
+                        updates
+                    )
+                result['analyzed'] += len(updates)
+
+                if len(rows) < chunk_size:
+                    break
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='既存の撮影画像を解析し、ai_reports の成長率を埋める。')
+    parser.add_argument('--layer', type=int, default=None, help='対象の層ID (省略時は全層)')
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    try:
+        result = backfill_growth_reports(args.layer)
+    except sqlite3.Error as e:
+        print(f"成長率バックフィルエラー: {e}")
+        return
+    print(f"解析: {result['analyzed']} 件, 画像なし: {result['missing']} 件 ({time.monotonic() - started:.1f} 秒)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""
+撮影画像の保存先を管理する。画像は層・撮影日ごとのディレクトリに保存する。
+
+    plant_images/layer_1/2025/09/10/20250910_100000_000.jpg
+
+ファイル名の末尾は同じ秒の撮影の連番で、同じ秒に2回撮影しても上書きしない。
+日ごとのディレクトリに分けることで、一覧・バックアップが速くなり、保持期間の処理は日単位でディレクトリごと削除できる。
+
+旧形式 (layer_N/ 直下に YYYYMMDD_HHMMSS.jpg) の画像は、次のコマンドで一度だけ移行する:
+
+    python -m core.image_store migrate [--dry-run]
+"""
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from datetime import date, datetime
+from config import *
+from core.db_connection import get_connection
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.webp', '.png')
+
+# 旧形式のファイル名 (YYYYMMDD_HHMMSS.ext)
+_FLAT_NAME = re.compile(r'^(\d{8}_\d{6})(\.\w+)$')
+
+_sequence_lock = threading.Lock()
+# {層ID: (秒単位の撮影時刻, 次の連番)}
+_sequences = {}
+
+
+def get_layer_dir(layer_id, base_dir=BASE_SAVE_DIR):
+    return os.path.join(base_dir, f"layer_{layer_id}")
+
+
+def get_day_dir(layer_id, day, base_dir=BASE_SAVE_DIR):
+    """撮影日のディレクトリ (layer_N/YYYY/MM/DD) を返す。"""
+    return os.path.join(get_layer_dir(layer_id, base_dir), f"{day:%Y}", f"{day:%m}", f"{day:%d}")
+
+
+def _next_sequence(layer_id, stamp):
+    with _sequence_lock:
+        last_stamp, sequence = _sequences.get(layer_id, (None, 0))
+        if last_stamp != stamp:
+            sequence = 0
+        _sequences[layer_id] = (stamp, sequence + 1)
+        return sequence
+
+
+def new_image_path(layer_id, extension='.jpg', captured_at=None, base_dir=BASE_SAVE_DIR):
+    """
+    新しい撮影画像の保存先を決め、撮影日のディレクトリを作成する。
+    同じ秒の撮影には連番を付け、既存のファイル (再起動前の撮影など) とも重ならない名前を返す。
+
+    :param captured_at: 撮影日時 (省略時は現在時刻)
+    :return: 保存先のパス (例: plant_images/layer_1/2025/09/10/20250910_100000_000.jpg)
+    """
+    captured_at = captured_at or datetime.now()
+    day_dir = get_day_dir(layer_id, captured_at, base_dir)
+    os.makedirs(day_dir, exist_ok=True)
+
+    stamp = captured_at.strftime("%Y%m%d_%H%M%S")
+    while True:
+        file_path = os.path.join(day_dir, f"{stamp}_{_next_sequence(layer_id, stamp):03d}{extension}")
+        if not os.path.exists(file_path):
+            return file_path
+
+
+def iter_day_dirs(layer_dir):
+    """
+    層のディレクトリ内の日ごとのディレクトリを古い順に返す (年・月・日のディレクトリ名だけを見る)。
+
+    :return: (撮影日, ディレクトリのパス) のジェネレータ
+    """
+    for year in sorted(_numeric_dirs(layer_dir, 4)):
+        year_dir = os.path.join(layer_dir, year)
+        for month in sorted(_numeric_dirs(year_dir, 2)):
+            month_dir = os.path.join(year_dir, month)
+            for day in sorted(_numeric_dirs(month_dir, 2)):
+                try:
+                    yield date(int(year), int(month), int(day)), os.path.join(month_dir, day)
+                except ValueError:
+                    continue
+
+
+def _numeric_dirs(path, width):
+    try:
+        with os.scandir(path) as entries:
+            return [e.name for e in entries if e.is_dir() and len(e.name) == width and e.name.isdigit()]
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def remove_expired_day_dirs(layer_dir, cutoff_day):
+    """
+    cutoff_day より前の日のディレクトリをディレクトリごと削除し、空になった年・月のディレクトリも削除する。
+
+    :return: {'days': 削除した日数, 'files': 削除したファイル数}
+    """
+    result = {'days': 0, 'files': 0}
+    for day, day_dir in iter_day_dirs(layer_dir):
+        if day >= cutoff_day:
+            break
+        try:
+            files = len(os.listdir(day_dir))
+            shutil.rmtree(day_dir)
+        except OSError as e:
+            print(f"警告: 古い画像ディレクトリ {day_dir} の削除中にエラー: {e}")
+            continue
+        result['days'] += 1
+        result['files'] += files
+        for parent in (os.path.dirname(day_dir), os.path.dirname(os.path.dirname(day_dir))):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break # 空でない (同じ月・年の他の日が残っている)
+    return result
+
+
+def is_sharded_path(image_path):
+    """画像が日ごとのディレクトリ (…/YYYY/MM/DD/ファイル) に保存されている場合 True。"""
+    parts = os.path.normpath(image_path).split(os.sep)
+    return len(parts) >= 4 and [len(p) for p in parts[-4:-1]] == [4, 2, 2] and all(p.isdigit() for p in parts[-4:-1])
+
+
+def _flat_target_path(layer_id, file_name, mtime, base_dir):
+    """旧形式のファイルの移行先。ファイル名の撮影日時 (読めない場合は更新時刻) の日のディレクトリに置く。"""
+    match = _FLAT_NAME.match(file_name)
+    if match:
+        captured_at = datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+        stem, extension = match.group(1), match.group(2)
+    else:
+        captured_at = datetime.fromtimestamp(mtime)
+        stem, extension = os.path.splitext(file_name)
+    day_dir = get_day_dir(layer_id, captured_at, base_dir)
+    sequence = 0
+    while True:
+        # 撮影ジョブが同じ秒に保存した新しい形式の画像と重ならないよう、空いている連番を探す
+        target = os.path.join(day_dir, f"{stem}_{sequence:03d}{extension}")
+        if not os.path.exists(target):
+            return target
+        sequence += 1
+
+
+def _update_image_paths(conn, moves):
+    """
+    ai_reports.image_path を (旧パス, 新パス) の対応表で一括更新する。
+    対応表を一時テーブルに入れて1回の UPDATE で置き換える (1件ずつの UPDATE では行数 x 件数の走査になる)。
+
+    :return: 更新した行数
+    """
+    with conn:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS image_moves (old_path TEXT PRIMARY KEY, new_path TEXT NOT NULL)")
+        conn.execute("DELETE FROM image_moves")
+        conn.executemany("INSERT OR REPLACE INTO image_moves (old_path, new_path) VALUES (?, ?)", moves)
+        updated = conn.execute(
+            """
+            UPDATE ai_reports
+            SET image_path = (SELECT new_path FROM image_moves WHERE old_path = ai_reports.image_path)
+            WHERE image_path IN (SELECT old_path FROM image_moves)
+            """
+        ).rowcount
+        conn.execute("DELETE FROM image_moves")
+    return updated
+
+
+def migrate_flat_layout(base_dir=BASE_SAVE_DIR, chunk_size=RETENTION_CHUNK_SIZE, dry_run=False):
+    """
+    layer_N/ 直下の旧形式の画像を日ごとのディレクトリに移動し、ai_reports.image_path を一括更新する。
+    chunk_size 件ずつ移動と更新を行い、更新に失敗したチャンクはファイルを元の場所に戻す。
+    移動済みのファイルはもう直下に無いため、再実行すると残りだけを移行する。
+
+    :param dry_run: True の場合は移動せず、移行対象の件数だけを数える
+    :return: {'files': 移動したファイル数, 'rows': 更新した行数}
+    """
+    conn = get_connection()
+    result = {'files': 0, 'rows': 0}
+    for layer_name in sorted(os.listdir(base_dir)) if os.path.isdir(base_dir) else []:
+        layer_dir = os.path.join(base_dir, layer_name)
+        if not layer_name.startswith('layer_') or not layer_name[6:].isdigit() or not os.path.isdir(layer_dir):
+            continue
+        layer_id = int(layer_name[6:])
+
+        with os.scandir(layer_dir) as entries:
+            files = sorted((e.name, e.stat().st_mtime) for e in entries
+                           if e.is_file() and e.name.lower().endswith(IMAGE_EXTENSIONS))
+        if dry_run:
+            result['files'] += len(files)
+            continue
+
+        for start in range(0, len(files), chunk_size):
+            moves = []
+            try:
+                for file_name, mtime in files[start:start + chunk_size]:
+                    old_path = os.path.join(layer_dir, file_name)
+                    new_path = _flat_target_path(layer_id, file_name, mtime, base_dir)
+                    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                    os.rename(old_path, new_path)
+                    moves.append((old_path, new_path))
+                result['rows'] += _update_image_paths(conn, moves)
+            except (OSError, sqlite3.Error):
+                # DB と一致しなくならないよう、このチャンクで移動したファイルを元に戻す
+                for old_path, new_path in reversed(moves):
+                    os.rename(new_path, old_path)
+                raise
+            result['files'] += len(moves)
+            print(f"[IMAGE MIGRATION] {layer_name}: {result['files']} 件を移動しました。")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='撮影画像の保存先を管理する。')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate = subparsers.add_parser('migrate', help='旧形式 (layer_N/ 直下) の画像を日ごとのディレクトリに移行する')
+    migrate.add_argument('--dry-run', action='store_true', help='移動せず、対象の件数だけを表示する')
+    args = parser.parse_args()
+
+    try:
+        result = migrate_flat_layout(dry_run=args.dry_run)
+    except (OSError, sqlite3.Error) as e:
+        print(f"画像の移行エラー: {e}")
+        return
+    if args.dry_run:
+        print(f"移行対象: {result['files']} 件")
+    else:
+        print(f"画像 {result['files']} 件を移動し、ai_reports を {result['rows']} 行更新しました。")
+
+
+if __name__ == '__main__':
+    main()
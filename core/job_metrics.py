@@ -0,0 +1,273 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from config import *
+from core import phase_timer
+from core.db_manager import insert_job_metrics_snapshots
+
+# ジョブ所要時間のヒストグラムの上限値 (秒)。最後に +Inf が加わる
+DURATION_BUCKETS_SEC = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class JobTypeMetrics:
+    """1つのジョブタイプの累積値 (プロセス起動からの合計)。"""
+    __slots__ = ('runs', 'failures', 'skipped', 'misfires', 'bucket_counts',
+                 'duration_sum', 'duration_max', 'db_seconds', 'device_seconds')
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.misfires = 0
+        self.bucket_counts = [0] * (len(DURATION_BUCKETS_SEC) + 1)
+        self.duration_sum = 0.0
+        self.duration_max = 0.0
+        self.db_seconds = 0.0
+        self.device_seconds = 0.0
+
+    def percentile(self, q):
+        """ヒストグラムから分位点 (秒) を推定する (バケットの上限値を返す)。"""
+        total = sum(self.bucket_counts)
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        for upper, count in zip(DURATION_BUCKETS_SEC, self.bucket_counts):
+            cumulative += count
+            if cumulative >= rank:
+                return upper
+        return self.duration_max
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class JobMetrics:
+    """ジョブタイプごとの実行回数・失敗・スキップ・ミスファイア・所要時間を集計する。"""
+
+    def __init__(self):
+        self._types = {}
+        self._lock = threading.Lock()
+
+    def _get(self, job_type):
+        metrics = self._types.get(job_type)
+        if metrics is None:
+            metrics = self._types[job_type] = JobTypeMetrics()
+        return metrics
+
+    def record_run(self, job_type, duration, failed=False, phases=None):
+        phases = phases or {}
+        with self._lock:
+            metrics = self._get(job_type)
+            metrics.runs += 1
+            metrics.failures += int(failed)
+            metrics.duration_sum += duration
+            metrics.duration_max = max(metrics.duration_max, duration)
+            metrics.db_seconds += phases.get('db', 0.0)
+            metrics.device_seconds += phases.get('device', 0.0)
+            for i, upper in enumerate(DURATION_BUCKETS_SEC):
+                if duration <= upper:
+                    metrics.bucket_counts[i] += 1
+                    break
+            else:
+                metrics.bucket_counts[-1] += 1
+
+    def record_skip(self, job_type):
+        """max_instances に達して実行されなかった回数を記録する。"""
+        with self._lock:
+            self._get(job_type).skipped += 1
+
+    def record_misfire(self, job_type):
+        """予定時刻から misfire_grace_time 以上遅れて実行されなかった回数を記録する。"""
+        with self._lock:
+            self._get(job_type).misfires += 1
+
+    def items(self):
+        """(ジョブタイプ, JobTypeMetrics のコピー) のリストを返す。"""
+        with self._lock:
+            result = []
+            for job_type, metrics in sorted(self._types.items()):
+                copy = JobTypeMetrics()
+                for name in JobTypeMetrics.__slots__:
+                    value = getattr(metrics, name)
+                    setattr(copy, name, list(value) if isinstance(value, list) else value)
+                result.append((job_type, copy))
+            return result
+
+    def render_prometheus(self):
+        """Prometheus のテキスト形式 (version 0.0.4) で出力する。"""
+        items = self.items()
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.extend(samples)
+
+        def label(job_type, **extra):
+            pairs = [('job_type', job_type)] + list(extra.items())
+            return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + '}'
+
+        for name, attr, help_text in [
+            ('smartgrow_job_runs_total', 'runs', 'Job executions.'),
+            ('smartgrow_job_failures_total', 'failures', 'Job executions that raised an exception.'),
+            ('smartgrow_job_skipped_total', 'skipped', 'Runs skipped because max_instances was reached.'),
+            ('smartgrow_job_misfires_total', 'misfires', 'Runs missed by more than misfire_grace_time.'),
+            ('smartgrow_job_db_seconds_total', 'db_seconds', 'Time spent in SQLite calls during jobs.'),
+            ('smartgrow_job_device_seconds_total', 'device_seconds', 'Time spent on camera/sensor I/O during jobs.'),
+        ]:
+            family(name, 'counter', help_text,
+                   [f"{name}{label(job_type)} {getattr(metrics, attr)}" for job_type, metrics in items])
+
+        samples = []
+        for job_type, metrics in items:
+            cumulative = 0
+            for upper, count in zip(DURATION_BUCKETS_SEC, metrics.bucket_counts):
+                cumulative += count
+                samples.append(f"smartgrow_job_duration_seconds_bucket{label(job_type, le=upper)} {cumulative}")
+            samples.append(f"smartgrow_job_duration_seconds_bucket{label(job_type, le='+Inf')} {metrics.runs}")
+            samples.append(f"smartgrow_job_duration_seconds_sum{label(job_type)} {metrics.duration_sum}")
+            samples.append(f"smartgrow_job_duration_seconds_count{label(job_type)} {metrics.runs}")
+        family('smartgrow_job_duration_seconds', 'histogram', 'Job wall-clock duration.', samples)
+        return '\n'.join(lines) + '\n'
+
+
+# アプリ全体で共有するメトリクス
+job_metrics = JobMetrics()
+
+# 次の1回だけプロファイルするジョブタイプ
+_profile_requests = set()
+_profile_lock = threading.Lock()
+
+
+def request_profile(job_type):
+    """指定したジョブタイプの次の1回の実行を cProfile で計測するよう予約する。"""
+    with _profile_lock:
+        _profile_requests.add(job_type)
+    print(f"[METRICS] 次の {job_type} ジョブの実行をプロファイルします。")
+
+
+def _take_profile_request(job_type):
+    with _profile_lock:
+        if job_type not in _profile_requests:
+            return None
+        _profile_requests.discard(job_type)
+    return cProfile.Profile()
+
+
+def _save_profile(job_type, profiler):
+    """プロファイル結果を METRICS_PROFILE_DIR に保存し、上位の関数をコンソールに出力する。"""
+    os.makedirs(METRICS_PROFILE_DIR, exist_ok=True)
+    file_path = os.path.join(METRICS_PROFILE_DIR, f"{job_type}_{datetime.now():%Y%m%d_%H%M%S}.prof")
+    profiler.dump_stats(file_path)
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(15)
+    print(f"[METRICS] {job_type} ジョブのプロファイルを {file_path} に保存しました。\n{out.getvalue()}")
+
+
+def timed_job(job_type, func):
+    """
+    ジョブ関数を計測用にラップする。実行時間・DB時間・デバイス時間・失敗を job_metrics に記録し、
+    request_profile() で予約されていれば1回だけ cProfile で実行する。
+    """
+    if not JOB_METRICS_ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _take_profile_request(job_type)
+        phase_timer.begin()
+        started = time.perf_counter()
+        failed = False
+        try:
+            if profiler:
+                return profiler.runcall(func, *args, **kwargs)
+            return func(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            job_metrics.record_run(job_type, time.perf_counter() - started, failed, phase_timer.end())
+            if profiler:
+                _save_profile(job_type, profiler)
+
+    return wrapper
+
+
+def write_metrics_snapshot():
+    """現在の累積値を job_metrics_snapshots に記録し、保持期間を過ぎた行を削除する。"""
+    now = datetime.now()
+    ts_ms = int(now.timestamp() * 1000)
+    rows = []
+    for job_type, m in job_metrics.items():
+        p50, p99 = m.percentile(0.5), m.percentile(0.99)
+        rows.append((ts_ms, job_type, m.runs, m.failures, m.skipped, m.misfires,
+                     round(m.duration_sum, 6), None if p50 is None else p50 * 1000,
+                     None if p99 is None else p99 * 1000, round(m.duration_max * 1000, 3),
+                     round(m.db_seconds, 6), round(m.device_seconds, 6)))
+    cutoff_ms = int((now - timedelta(days=METRICS_SNAPSHOT_RETENTION_DAYS)).timestamp() * 1000)
+    insert_job_metrics_snapshots(rows, cutoff_ms)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics: Prometheus 形式, GET /profile?job_type=X: 次の1回のプロファイルを予約。"""
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == '/metrics':
+            self._reply(200, job_metrics.render_prometheus(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif parts.path == '/profile':
+            job_type = parse_qs(parts.query).get('job_type', [''])[0]
+            if not job_type:
+                self._reply(400, 'job_type is required\n')
+                return
+            request_profile(job_type)
+            self._reply(202, f'profiling next {job_type} run\n')
+        else:
+            self._reply(404, 'not found\n')
+
+    def _reply(self, status, text, content_type='text/plain; charset=utf-8'):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # アクセスごとのログは出さない
+        pass
+
+
+_server = None
+
+
+def start_metrics_server(host=METRICS_HTTP_HOST, port=METRICS_HTTP_PORT):
+    """メトリクスの HTTP エンドポイントをバックグラウンドで起動する (port が None の場合は何もしない)。"""
+    global _server
+    if _server or port is None:
+        return
+    try:
+        _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"警告: メトリクスサーバを起動できませんでした ({host}:{port}): {e}")
+        return
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name='metrics-http', daemon=True).start()
+    print(f"メトリクスを http://{host}:{_server.server_port}/metrics で公開しています。")
+
+
+def stop_metrics_server():
+    global _server
+    if _server:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
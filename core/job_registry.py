@@ -0,0 +1,78 @@
+import importlib
+import threading
+from config import *
+
+# ジョブタイプ -> 'モジュール:関数名'。モジュールは最初の実行時 (または preload) まで読み込まない。
+# camera_rack は layer_id=0 の camera スケジュール (有効な全層を一括撮影)
+JOB_HANDLERS = {
+    'camera': 'jobs.camera_jobs:execute_photo_job',
+    'camera_rack': 'jobs.camera_jobs:execute_rack_photo_job',
+    'sensor': 'jobs.sensor_jobs:execute_sensor_job',
+    'water': 'jobs.pump_jobs:execute_pump_job',
+    'retention': 'jobs.maintenance_jobs:execute_retention_job',
+    'image_retention': 'jobs.maintenance_jobs:execute_image_retention_job',
+    'growth_analysis': 'jobs.image_jobs:execute_growth_analysis_job',
+}
+
+_resolved = {}
+_lock = threading.Lock()
+
+
+def register_job_type(job_type, ref):
+    """ジョブタイプを追加・上書きする。ref は 'モジュール:関数名' 形式。"""
+    JOB_HANDLERS[job_type] = ref
+
+
+def resolve_handler(ref):
+    """'モジュール:関数名' を import して関数を返す (2回目以降はキャッシュを返す)。"""
+    func = _resolved.get(ref)
+    if func is not None:
+        return func
+    with _lock:
+        module_name, func_name = ref.split(':')
+        func = _resolved[ref] = getattr(importlib.import_module(module_name), func_name)
+        return func
+
+
+class LazyHandler:
+    """最初に呼ばれた時にハンドラのモジュールを読み込むジョブ関数。"""
+
+    def __init__(self, job_type, ref):
+        self.job_type = job_type
+        self.ref = ref
+        self.__name__ = ref.split(':')[1]
+
+    def __call__(self, *args, **kwargs):
+        return resolve_handler(self.ref)(*args, **kwargs)
+
+    def __repr__(self):
+        return f"LazyHandler({self.job_type!r}, {self.ref!r})"
+
+
+def get_handler(job_type):
+    """
+    ジョブタイプのハンドラを返す (モジュールはまだ読み込まない)。
+
+    :return: LazyHandler (未知のジョブタイプの場合は None)
+    """
+    ref = JOB_HANDLERS.get(job_type)
+    return LazyHandler(job_type, ref) if ref else None
+
+
+def preload(job_types):
+    """
+    登録済みのジョブタイプのモジュールをバックグラウンドで読み込み、初回実行の遅延を無くす。
+    スケジューラの起動はこの読み込みを待たない。
+    """
+    refs = [JOB_HANDLERS[job_type] for job_type in dict.fromkeys(job_types) if job_type in JOB_HANDLERS]
+
+    def run():
+        for ref in refs:
+            try:
+                resolve_handler(ref)
+            except Exception as e:
+                print(f"警告: ジョブハンドラ {ref} の読み込みに失敗しました: {e}")
+
+    thread = threading.Thread(target=run, name='job-preload', daemon=True)
+    thread.start()
+    return thread
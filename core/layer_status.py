@@ -0,0 +1,178 @@
+"""
+層ごとの現在の状態 (最新の温湿度・画像・発生中のアラート) を layer_status テーブルに1行で保持する。
+
+各ジョブの INSERT と同じトランザクションで更新されるため、ダッシュボードは時系列テーブルを
+「層ごとの最新行」で検索せずに、行数に関係なく1回のクエリで現在の状態を読める。
+"""
+import json
+import sqlite3
+from types import MappingProxyType
+from config import *
+from core.db_connection import get_connection
+from core.config_cache import VersionedCache
+
+
+def get_create_layer_status_queries():
+    """
+    layer_status テーブルと、変更回数 (change_counters の 'layer_status') を数えるトリガーの作成文を返す。
+    タンクは全層で共有するため、tank_status の変更も同じ変更回数に数える (キャッシュの読み直しのため)。
+    """
+    queries = [
+        """
+        CREATE TABLE IF NOT EXISTS layer_status (
+            layer_id INTEGER PRIMARY KEY,
+            sensor_ts_ms INTEGER,
+            temperature REAL,
+            humidity REAL,
+            image_ts_ms INTEGER,
+            image_path TEXT,
+            growth_rate REAL,
+            canopy_coverage REAL,
+            open_alerts TEXT NOT NULL DEFAULT '{}',
+            alert_ts_ms INTEGER
+        )
+        """,
+        "INSERT OR IGNORE INTO change_counters (table_name, version) VALUES ('layer_status', 0)",
+    ]
+    for table in ('layer_status', 'tank_status'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            queries.append(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_status_counter
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE change_counters SET version = version + 1 WHERE table_name = 'layer_status';
+                END
+                """
+            )
+    return queries
+
+
+def get_layer_status_backfill_query():
+    """既存の sensor_logs / ai_reports の層ごとの最新行から layer_status を埋める INSERT 文 (移行時に一度だけ使用)。"""
+    return """
+        INSERT OR IGNORE INTO layer_status (layer_id, sensor_ts_ms, temperature, humidity,
+                                            image_ts_ms, image_path, growth_rate, canopy_coverage)
+        SELECT l.layer_id, s.ts_ms, s.temperature, s.humidity,
+               r.ts_ms, r.image_path, r.growth_rate, r.canopy_coverage
+        FROM (SELECT layer_id FROM layers
+              UNION SELECT DISTINCT layer_id FROM sensor_logs
+              UNION SELECT DISTINCT layer_id FROM ai_reports) AS l
+        LEFT JOIN sensor_logs s ON s.log_id = (
+            SELECT log_id FROM sensor_logs WHERE layer_id = l.layer_id ORDER BY ts_ms DESC LIMIT 1)
+        LEFT JOIN ai_reports r ON r.report_id = (
+            SELECT report_id FROM ai_reports WHERE layer_id = l.layer_id ORDER BY ts_ms DESC LIMIT 1)
+        WHERE l.layer_id IS NOT NULL
+    """
+
+
+def update_sensor_status(conn, rows):
+    """
+    センサー値の INSERT と同じトランザクションで、層ごとの最新の温湿度を更新する。
+
+    :param rows: [(layer_id, ts_ms, temperature, humidity), ...]
+    """
+    latest = {}
+    for row in rows:
+        if row[0] not in latest or row[1] >= latest[row[0]][1]:
+            latest[row[0]] = row
+    conn.executemany(
+        """
+        INSERT INTO layer_status (layer_id, sensor_ts_ms, temperature, humidity) VALUES (?, ?, ?, ?)
+        ON CONFLICT (layer_id) DO UPDATE SET
+            sensor_ts_ms = excluded.sensor_ts_ms, temperature = excluded.temperature, humidity = excluded.humidity
+        WHERE layer_status.sensor_ts_ms IS NULL OR excluded.sensor_ts_ms >= layer_status.sensor_ts_ms
+        """,
+        list(latest.values())
+    )
+
+
+def update_image_status(conn, layer_id, ts_ms, image_path, growth_rate, canopy_coverage):
+    """ai_reports の INSERT と同じトランザクションで、層の最新の画像を更新する。"""
+    conn.execute(
+        """
+        INSERT INTO layer_status (layer_id, image_ts_ms, image_path, growth_rate, canopy_coverage)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (layer_id) DO UPDATE SET
+            image_ts_ms = excluded.image_ts_ms, image_path = excluded.image_path,
+            growth_rate = excluded.growth_rate, canopy_coverage = excluded.canopy_coverage
+        WHERE layer_status.image_ts_ms IS NULL OR excluded.image_ts_ms >= layer_status.image_ts_ms
+        """,
+        (layer_id, ts_ms, image_path, growth_rate, canopy_coverage)
+    )
+
+
+def update_alert_status(conn, rows):
+    """
+    アラートのログと同じトランザクションで、層の発生中のアラート (open_alerts) を更新する。
+    open_alerts は {ルール名: {'severity', 'message', 'since_ms'}} の JSON で、発生で追加・解消で削除する。
+
+    :param rows: [(layer_id, ts_ms, ルール名, 'open' または 'resolved', アラートの JSON), ...]
+    """
+    # JSON Merge Patch ({ルール名: 値} で追加、{ルール名: null} で削除) はルール名をパスに埋め込まないため、
+    # 引用符などを含む名前でも安全に更新できる
+    conn.executemany(
+        """
+        INSERT INTO layer_status (layer_id, open_alerts, alert_ts_ms)
+        VALUES (:layer_id, json_patch('{}', json_object(:rule, json(:alert))), :ts_ms)
+        ON CONFLICT (layer_id) DO UPDATE SET
+            open_alerts = json_patch(layer_status.open_alerts, json_object(:rule, json(:alert))),
+            alert_ts_ms = excluded.alert_ts_ms
+        """,
+        [{'layer_id': layer_id, 'ts_ms': ts_ms, 'rule': rule, 'alert': alert if state == 'open' else 'null'}
+         for layer_id, ts_ms, rule, state, alert in rows]
+    )
+
+
+def clear_open_alerts():
+    """
+    すべての層の発生中のアラートを消す。アラートの状態はプロセス内にあり再起動で初期化されるため、
+    スケジューラの起動時に呼び出して DB を合わせる (条件が続いていれば再度発生として記録される)。
+    """
+    try:
+        conn = get_connection()
+        with conn:
+            conn.execute("UPDATE layer_status SET open_alerts = '{}' WHERE open_alerts != '{}'")
+    except sqlite3.Error as e:
+        print(f"発生中のアラートの消去エラー: {e}")
+
+
+def select_layer_status():
+    """
+    全層の現在の状態とタンクの状態を1回のクエリで読み込む (主キー順の全行の走査のみ)。
+
+    :return: {layer_id: 読み取り専用の辞書}。open_alerts は辞書に変換済み
+    """
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+    cursor.execute(
+        """
+        SELECT s.*, t.percentage AS tank_percentage, t.status AS tank_status, t.last_checked AS tank_last_checked
+        FROM layer_status s LEFT JOIN tank_status t ON t.tank_id = 1
+        ORDER BY s.layer_id
+        """
+    )
+    result = {}
+    for row in cursor.fetchall():
+        status = dict(row)
+        status['open_alerts'] = MappingProxyType(json.loads(status['open_alerts'] or '{}'))
+        # 呼び出し側で書き換えられないよう読み取り専用のビューで保持する
+        result[status['layer_id']] = MappingProxyType(status)
+    return result
+
+
+layer_status_cache = VersionedCache('layer_status', select_layer_status)
+
+
+def get_layer_status(layer_id=None):
+    """
+    キャッシュされた層の状態を返す。変更回数が変わった時だけ読み直すため、
+    ダッシュボードのポーリングは通常、変更回数の主キー参照1回で済む。
+
+    :param layer_id: 指定した場合はその層だけ (無い場合は None)
+    :return: {layer_id: 読み取り専用の辞書} または1層分の辞書
+    """
+    statuses = layer_status_cache.get() or {}
+    if layer_id is None:
+        return statuses
+    return statuses.get(layer_id)
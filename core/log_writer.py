@@ -0,0 +1,175 @@
+import queue
+import threading
+import time
+from config import *
+
+# 停止要求を書き込みスレッドに伝えるための番兵
+_STOP = object()
+
+
+class LogWriter:
+    """
+    ログ/センサーレコードをバックグラウンドでまとめて書き込むライトビハインド・ライタ。
+
+    ジョブスレッドは submit() で有界キューにレコードを積むだけで戻る。書き込みスレッドは
+    件数 (batch_size) または経過時間 (flush_interval_sec) のどちらかに達した時点で、
+    溜まったレコードを flush_func にまとめて渡す (1回のコミットで複数行を確定するグループコミット)。
+    キューが満杯の場合は put_timeout_sec だけ待ち (バックプレッシャー)、それでも空かなければ
+    submit() は False を返し、呼び出し側が同期書き込みにフォールバックする。
+    stop() の開始後も submit() は False を返す (停止後のキューに残って失われないよう同期書き込みさせる)。
+
+    書き込みに失敗したバッチは retry_backoff_sec から倍々に待って max_retries 回まで再試行し、
+    それでも失敗した場合は1行ずつ書き込んで、書き込めない行だけを諦める。
+    """
+
+    def __init__(self, flush_func, max_queue_size=LOG_WRITER_QUEUE_SIZE, batch_size=LOG_WRITER_BATCH_SIZE,
+                 flush_interval_sec=LOG_WRITER_FLUSH_INTERVAL_SEC, put_timeout_sec=LOG_WRITER_PUT_TIMEOUT_SEC,
+                 max_retries=LOG_WRITER_MAX_RETRIES, retry_backoff_sec=LOG_WRITER_RETRY_BACKOFF_SEC):
+        """
+        :param flush_func: {種別: [行タプル, ...]} を受け取り、1トランザクションで書き込む関数
+        :param max_queue_size: キューに保持できる最大レコード数
+        :param batch_size: この件数に達したら即座にフラッシュする
+        :param flush_interval_sec: 最初のレコード到着からこの秒数でフラッシュする
+        :param put_timeout_sec: キュー満杯時に submit() が待機する最大秒数
+        :param max_retries: 書き込みに失敗したバッチを再試行する回数
+        :param retry_backoff_sec: 最初の再試行までの待ち時間 (再試行ごとに2倍)
+        """
+        self.flush_func = flush_func
+        self.batch_size = batch_size
+        self.flush_interval_sec = flush_interval_sec
+        self.put_timeout_sec = put_timeout_sec
+        self.max_retries = max_retries
+        self.retry_backoff_sec = retry_backoff_sec
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        # stop() の開始を submit() に伝え、キューへの追加中の submit() が終わるのを待つための状態
+        self._submit_cond = threading.Condition()
+        self._stopping = False
+        self._submitting = 0
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """書き込みスレッドを起動する (起動済みの場合は何もしない)。"""
+        with self._lock:
+            if self.is_running():
+                return
+            with self._submit_cond:
+                self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        キューに残っているレコードをすべて書き込んでから書き込みスレッドを停止する。
+        """
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            # 以降の submit() は同期書き込みにさせ、キューへの追加中の submit() が終わるのを待つ
+            # (番兵の後に入ったレコードが最後の書き出しに間に合わず失われないようにする)
+            with self._submit_cond:
+                self._stopping = True
+                while self._submitting:
+                    self._submit_cond.wait()
+            # 番兵はキューが空くまで待って必ず投入する (取りこぼし防止)
+            self._queue.put(_STOP)
+            thread.join()
+            self._thread = None
+
+    def submit(self, kind, row):
+        """
+        レコードを書き込みキューに追加する。
+
+        :param kind: レコード種別 ('sensor', 'system' など flush_func が解釈するキー)
+        :param row: INSERT に渡す値のタプル
+        :return: キューに追加できた場合 True。未起動・停止中またはキュー満杯の場合 False
+        """
+        with self._submit_cond:
+            if self._stopping or not self.is_running():
+                return False
+            self._submitting += 1
+        try:
+            self._queue.put((kind, row), timeout=self.put_timeout_sec)
+            return True
+        except queue.Full:
+            print(f"警告: ログ書き込みキューが満杯のため同期書き込みに切り替えます ({kind})")
+            return False
+        finally:
+            with self._submit_cond:
+                self._submitting -= 1
+                self._submit_cond.notify_all()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batches = {}
+            count = 0
+            deadline = time.monotonic() + self.flush_interval_sec
+            while True:
+                kind, row = item
+                batches.setdefault(kind, []).append(row)
+                count += 1
+                if count >= self.batch_size:
+                    break
+
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=max(remaining, 0))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+
+            self._flush(batches, count)
+
+        # 停止要求の後にキューへ入ったレコードも書き出す
+        batches = {}
+        count = 0
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                continue
+            kind, row = item
+            batches.setdefault(kind, []).append(row)
+            count += 1
+        if count:
+            self._flush(batches, count)
+
+    def _flush(self, batches, count):
+        """
+        バッチを書き込む。ロック待ちのタイムアウトなど一時的な失敗は待ってから再試行し、
+        それでも失敗した場合は1行ずつ書き込んで、原因の行以外を確定させる。
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.flush_func(batches)
+                return
+            except Exception as e:
+                error = e
+            if attempt < self.max_retries:
+                time.sleep(self.retry_backoff_sec * 2 ** attempt)
+
+        # 書き込みスレッド自体は止めない。ここでの失敗は system_logs に記録できないためコンソールに出力
+        print(f"警告: ログ一括書き込みに失敗したため1行ずつ書き込みます ({count}件): {error}")
+        lost = 0
+        for kind, rows in batches.items():
+            for row in rows:
+                try:
+                    self.flush_func({kind: [row]})
+                except Exception as e:
+                    lost += 1
+                    print(f"致命的なエラー: ログを書き込めませんでした ({kind}): {e} {row}")
+        if lost:
+            print(f"致命的なエラー: ログ一括書き込みで {lost}/{count} 件を書き込めませんでした。")
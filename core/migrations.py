@@ -0,0 +1,298 @@
+import sqlite3
+from datetime import datetime
+from config import *
+from core.sensor_rollups import get_create_rollup_table_queries, get_rollup_backfill_queries
+from core.layer_status import get_create_layer_status_queries, get_layer_status_backfill_query
+
+
+def iso_to_epoch_ms(value):
+    """
+    ISO 8601 形式の時刻文字列をエポックミリ秒に変換する。
+    タイムゾーンを持たない値はローカル時刻として扱う (datetime.now().isoformat() と同じ前提)。
+
+    :param value: ISO 8601 形式の文字列
+    :return: エポックミリ秒 (変換できない場合は None)
+    """
+    if value is None:
+        return None
+    try:
+        return int(datetime.fromisoformat(value).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return None
+
+
+# エポックミリ秒列 ts_ms を持つ時系列テーブル
+TIME_SERIES_TABLES = ['sensor_logs', 'system_logs', 'ai_reports']
+
+
+def outside_transaction(migrate):
+    """VACUUM などトランザクション内で実行できない移行関数に付けるデコレータ。"""
+    migrate.outside_transaction = True
+    return migrate
+
+
+def _add_epoch_ms_columns(conn):
+    """時系列テーブルに ts_ms 列を追加し、既存行を ISO 文字列から埋める。"""
+    conn.create_function('iso_to_epoch_ms', 1, iso_to_epoch_ms, deterministic=True)
+    for table in TIME_SERIES_TABLES:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN ts_ms INTEGER")
+        conn.execute(f"UPDATE {table} SET ts_ms = iso_to_epoch_ms(timestamp) WHERE ts_ms IS NULL")
+
+
+def _add_time_series_indexes(conn):
+    """層ごとの期間検索用に (layer_id, ts_ms) の複合インデックスを作成する。"""
+    for table in TIME_SERIES_TABLES:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_layer_ts ON {table} (layer_id, ts_ms)")
+
+
+def _add_sensor_rollups(conn):
+    """1分/1時間/1日のロールアップテーブルを作成し、既存の sensor_logs から埋める。"""
+    for query in get_create_rollup_table_queries():
+        conn.execute(query)
+    for query in get_rollup_backfill_queries():
+        conn.execute(query)
+
+
+@outside_transaction
+def _enable_incremental_vacuum(conn):
+    """auto_vacuum を INCREMENTAL に切り替える。既存DBへの反映には VACUUM による再構築が必要。"""
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+
+
+def _add_image_expiry_index(conn):
+    """画像の保持期間処理で期限切れ行だけを走査できるよう ai_reports(ts_ms) に索引を作成する。"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_reports_ts ON ai_reports (ts_ms)")
+
+
+def _add_layer_image_settings(conn):
+    """層ごとの画像保存形式と品質の列を layers に追加する。"""
+    conn.execute("ALTER TABLE layers ADD COLUMN image_format TEXT NOT NULL DEFAULT 'jpg'")
+    conn.execute("ALTER TABLE layers ADD COLUMN image_quality INTEGER NOT NULL DEFAULT 95")
+
+
+def _add_canopy_columns(conn):
+    """画像解析結果 (キャノピー被覆率・面積) の列を ai_reports に追加する。"""
+    conn.execute("ALTER TABLE ai_reports ADD COLUMN canopy_coverage REAL")
+    conn.execute("ALTER TABLE ai_reports ADD COLUMN canopy_area_px INTEGER")
+
+
+# 変更回数を記録する設定系テーブル (キャッシュの無効化に使う)
+TRACKED_TABLES = ['layers', 'system_config', 'schedules']
+
+
+def _add_change_counters(conn):
+    """設定系テーブルの変更回数をトリガーで数える change_counters テーブルを作成する。"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS change_counters (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    for table in TRACKED_TABLES:
+        conn.execute("INSERT OR IGNORE INTO change_counters (table_name, version) VALUES (?, 0)", (table,))
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            conn.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_counter
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE change_counters SET version = version + 1 WHERE table_name = '{table}';
+                END
+                """
+            )
+
+
+def _add_schedule_change_log(conn):
+    """schedules の変更をトリガーで記録する schedule_changes テーブルを作成する。"""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schedule_changes (
+            change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            schedule_id INTEGER NOT NULL
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_schedules_insert_log AFTER INSERT ON schedules
+        BEGIN
+            INSERT INTO schedule_changes (schedule_id) VALUES (NEW.schedule_id);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_schedules_update_log AFTER UPDATE ON schedules
+        BEGIN
+            INSERT INTO schedule_changes (schedule_id) VALUES (NEW.schedule_id);
+            INSERT INTO schedule_changes (schedule_id)
+                SELECT OLD.schedule_id WHERE OLD.schedule_id != NEW.schedule_id;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_schedules_delete_log AFTER DELETE ON schedules
+        BEGIN
+            INSERT INTO schedule_changes (schedule_id) VALUES (OLD.schedule_id);
+        END
+        """
+    )
+
+
+def _add_sensor_summary_columns(conn):
+    """高頻度サンプリングの集計値 (最小・最大・標準偏差・件数) の列を sensor_logs に追加する。"""
+    for column, column_type in [('temp_min', 'REAL'), ('temp_max', 'REAL'), ('temp_std', 'REAL'),
+                                ('hum_min', 'REAL'), ('hum_max', 'REAL'), ('hum_std', 'REAL'),
+                                ('sample_count', 'INTEGER')]:
+        conn.execute(f"ALTER TABLE sensor_logs ADD COLUMN {column} {column_type}")
+
+
+def _add_notification_queue(conn):
+    """送信できなかった通知を再起動後も再送できるよう保持するテーブルを追加する。"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notification_queue (
+            notification_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_ms INTEGER NOT NULL,
+            next_attempt_ms INTEGER NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            webhook_url TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            last_error TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notification_queue_next ON notification_queue (next_attempt_ms)")
+
+
+def _add_job_metrics_snapshots(conn):
+    """ジョブメトリクスの定期スナップショットを保存するテーブルを追加する。"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS job_metrics_snapshots (
+            ts_ms INTEGER NOT NULL,
+            job_type TEXT NOT NULL,
+            runs INTEGER NOT NULL,
+            failures INTEGER NOT NULL,
+            skipped INTEGER NOT NULL,
+            misfires INTEGER NOT NULL,
+            duration_sum_sec REAL NOT NULL,
+            p50_ms REAL,
+            p99_ms REAL,
+            max_ms REAL,
+            db_sec REAL NOT NULL,
+            device_sec REAL NOT NULL,
+            PRIMARY KEY (ts_ms, job_type)
+        ) WITHOUT ROWID
+    """)
+
+
+def _add_export_marks(conn):
+    """差分エクスポートの位置 (出力済みの最大の主キー) をエクスポート名ごとに保存するテーブルを追加する。"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS export_marks (
+            export_name TEXT PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            last_id INTEGER NOT NULL,
+            updated_at TEXT NOT NULL
+        )
+    """)
+
+
+def _add_layer_status(conn):
+    """層ごとの現在の状態 (layer_status) を作成し、既存の sensor_logs / ai_reports の最新行から埋める。"""
+    for query in get_create_layer_status_queries():
+        conn.execute(query)
+    conn.execute(get_layer_status_backfill_query())
+
+
+def _mark_daily_interval_schedules(conn):
+    """
+    60分を割り切れない間隔の sensor/water のスケジュール (例: water '12:00:00') は、以前は毎日指定時刻に
+    実行されていた。間隔として読むと実行回数が変わる (12時間おきなど) ため、'@' を付けて毎日の実行のまま残す。
+    """
+    updates = []
+    for schedule_id, exec_time in conn.execute(
+            "SELECT schedule_id, exec_time FROM schedules WHERE job_type IN ('sensor', 'water')").fetchall():
+        try:
+            H, M, S = map(int, exec_time.split(':'))
+        except ValueError:
+            continue # '@' 付き・不正な形式は対象外
+        total_minutes = M + H * 60
+        if total_minutes > 0 and 60 % total_minutes != 0:
+            updates.append(('@' + exec_time, schedule_id))
+    conn.executemany("UPDATE schedules SET exec_time = ? WHERE schedule_id = ?", updates)
+
+
+# (バージョン, 説明, 移行関数) のリスト。バージョンは PRAGMA user_version に記録される。
+# 追加のみ行い、適用済みの移行は変更しないこと。
+MIGRATIONS = [
+    (1, '時系列テーブルにエポックミリ秒列 ts_ms を追加', _add_epoch_ms_columns),
+    (2, '時系列テーブルに (layer_id, ts_ms) 複合インデックスを追加', _add_time_series_indexes),
+    (3, 'センサーロールアップテーブル (1分/1時間/1日) を追加', _add_sensor_rollups),
+    (4, 'auto_vacuum を INCREMENTAL に変更', _enable_incremental_vacuum),
+    (5, 'ai_reports に撮影時刻の索引を追加', _add_image_expiry_index),
+    (6, 'layers に画像保存形式・品質の列を追加', _add_layer_image_settings),
+    (7, 'ai_reports にキャノピー被覆率・面積の列を追加', _add_canopy_columns),
+    (8, '設定系テーブルの変更回数 (change_counters) を追加', _add_change_counters),
+    (9, 'schedules の変更ログ (schedule_changes) を追加', _add_schedule_change_log),
+    (10, 'sensor_logs に集計値の列を追加', _add_sensor_summary_columns),
+    (11, '通知の再送キュー (notification_queue) を追加', _add_notification_queue),
+    (12, 'ジョブメトリクスのスナップショット (job_metrics_snapshots) を追加', _add_job_metrics_snapshots),
+    (13, '差分エクスポートの位置 (export_marks) を追加', _add_export_marks),
+    (14, '層ごとの現在の状態 (layer_status) を追加', _add_layer_status),
+    (15, '毎日指定時刻に実行していた sensor/water のスケジュールに @ を付ける', _mark_daily_interval_schedules),
+]
+
+
+def get_schema_version(conn):
+    """データベースに記録されているスキーマバージョン (PRAGMA user_version) を返す。"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(db_path=DB_PATH):
+    """
+    未適用のマイグレーションを順番に適用し、既存のデータベースを最新スキーマへ移行する。
+    各マイグレーションはバージョン更新と同じトランザクションで適用されるため、
+    途中で失敗してもそのバージョンは未適用のまま残る (outside_transaction を除く)。
+
+    :param db_path: データベースファイルのパス
+    :return: 移行後のスキーマバージョン
+    """
+    conn = None
+    version = 0
+    try:
+        # BEGIN/COMMIT を明示的に制御するため自動トランザクションを無効化する
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        version = get_schema_version(conn)
+
+        for target_version, description, migrate in MIGRATIONS:
+            if target_version <= version:
+                continue
+
+            print(f"スキーマ移行 v{target_version}: {description}")
+            if getattr(migrate, 'outside_transaction', False):
+                migrate(conn)
+                conn.execute(f"PRAGMA user_version = {int(target_version)}")
+                version = target_version
+                continue
+
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                migrate(conn)
+                conn.execute(f"PRAGMA user_version = {int(target_version)}")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            version = target_version
+
+    except sqlite3.Error as e:
+        print(f"スキーマ移行エラー (v{version} で停止): {e}")
+
+    finally:
+        if conn:
+            conn.close()
+
+    return version
@@ -0,0 +1,295 @@
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+from config import *
+from core.db_manager import (insert_system_log, insert_notification, select_due_notifications,
+                             select_next_notification_ms, update_notification_retry, delete_notification)
+from core.config_cache import get_system_config
+
+
+class WebhookClient:
+    """
+    Webhook への POST で1本の keep-alive 接続を使い回す HTTP クライアント。
+    送信先のホストが変わった場合と、接続が切れていた場合だけ接続し直す。
+    """
+
+    def __init__(self, timeout=NOTIFY_HTTP_TIMEOUT_SEC):
+        self.timeout = timeout
+        self._conn = None
+        self._conn_key = None
+
+    def _get_connection(self, scheme, netloc):
+        key = (scheme, netloc)
+        if self._conn is None or self._conn_key != key:
+            self.close()
+            conn_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            self._conn = conn_class(netloc, timeout=self.timeout)
+            self._conn_key = key
+        return self._conn
+
+    def post_json(self, url, payload):
+        """
+        JSON を POST する。
+
+        :return: (ステータスコード, レスポンスヘッダの辞書, 本文)
+        :raises OSError, http.client.HTTPException: 接続・通信に失敗した場合
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        headers = {'Content-Type': 'application/json; charset=utf-8'}
+
+        for attempt in range(2):
+            reused = self._conn is not None and self._conn_key == (parts.scheme, parts.netloc)
+            conn = self._get_connection(parts.scheme, parts.netloc)
+            try:
+                conn.request('POST', path, body=body, headers=headers)
+                response = conn.getresponse()
+                # 接続を再利用するため、本文は必ず最後まで読む
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                self.close()
+                # 待機中にサーバ側で閉じられた keep-alive 接続なら、新しい接続で1回だけやり直す
+                if reused and attempt == 0:
+                    continue
+                raise
+            if response.will_close:
+                self.close()
+            return response.status, {k.lower(): v for k, v in response.getheaders()}, data.decode('utf-8', 'replace')
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+        self._conn_key = None
+
+
+def build_digest(messages, max_lines=NOTIFY_DIGEST_MAX_LINES):
+    """時間窓内に集まったメッセージを1通の本文にまとめる。"""
+    if len(messages) == 1:
+        return messages[0]
+    lines = [f"[Smart Grow] 通知 {len(messages)}件"]
+    lines += [f"• {message}" for message in messages[:max_lines]]
+    if len(messages) > max_lines:
+        lines.append(f"…他 {len(messages) - max_lines}件")
+    return '\n'.join(lines)
+
+
+def _default_webhook_url():
+    return get_system_config().slack_webhook_url
+
+
+class NotificationDispatcher:
+    """
+    通知をバックグラウンドスレッドから Slack Incoming Webhook へ送る。
+
+    * notify() はメモリに積むだけで、呼び出し元 (ジョブのスレッド) を待たせない
+    * 最初の通知から NOTIFY_COALESCE_WINDOW_SEC の間に届いた通知は1通にまとめる
+    * まとめた通知は notification_queue に保存してから送信し、成功したら削除する
+      (送信できなかった通知は再起動後も再送される)
+    * 送信間隔は NOTIFY_MIN_INTERVAL_SEC 以上あけ、429 は Retry-After、
+      5xx・通信エラーは指数バックオフで再送する
+    """
+
+    def __init__(self, client=None, webhook_url_provider=_default_webhook_url,
+                 window_sec=NOTIFY_COALESCE_WINDOW_SEC, min_interval_sec=NOTIFY_MIN_INTERVAL_SEC):
+        self.client = client or WebhookClient()
+        self.webhook_url_provider = webhook_url_provider
+        self.window_sec = window_sec
+        self.min_interval_sec = min_interval_sec
+        self._cond = threading.Condition()
+        self._pending = []
+        self._pending_deadline = None
+        self._next_due_ms = None
+        self._blocked_until = 0.0
+        self._last_sent = 0.0
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """スレッドを停止する。まとめ待ちの通知はキューに保存され、次回の起動時に送信される。"""
+        if not self._thread:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+        self.client.close()
+
+    def notify(self, message):
+        """通知を追加する (送信は時間窓の終了後にまとめて行う)。"""
+        with self._cond:
+            if not self._pending:
+                self._pending_deadline = time.monotonic() + self.window_sec
+            self._pending.append(message)
+            self._cond.notify()
+
+    def flush(self):
+        """まとめ待ちの通知を即座にキューへ保存し、送信できるものを送信する (テスト・手動送信用)。"""
+        self._persist_pending(force=True)
+        self._deliver_due()
+
+    def _next_wakeup(self):
+        now = time.monotonic()
+        wakeup = now + NOTIFY_POLL_INTERVAL_SEC
+        if self._pending_deadline is not None:
+            wakeup = min(wakeup, self._pending_deadline)
+        if self._next_due_ms is not None:
+            due = now + (self._next_due_ms - time.time() * 1000) / 1000
+            wakeup = min(wakeup, max(due, self._blocked_until))
+        return wakeup
+
+    def _run(self):
+        self._next_due_ms = select_next_notification_ms()
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    timeout = self._next_wakeup() - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                stopping = self._stopping
+
+            try:
+                self._persist_pending(force=stopping)
+                if stopping:
+                    return
+                self._deliver_due()
+            except Exception as e:
+                # 想定外のエラーで送信スレッドが止まると再起動まで通知が送られないため、記録して待ってから続ける
+                error_msg = 'Notification dispatcher error.'
+                insert_system_log(0, 'ERROR', error_msg, f'{type(e).__name__}: {e}')
+                print(f"エラー: 通知の送信処理中に例外が発生しました: {e}")
+                if stopping:
+                    return
+                with self._cond:
+                    if not self._stopping:
+                        self._cond.wait(NOTIFY_BACKOFF_BASE_SEC)
+
+    def _persist_pending(self, force=False):
+        with self._cond:
+            if not self._pending or (not force and time.monotonic() < self._pending_deadline):
+                return
+            messages, self._pending, self._pending_deadline = self._pending, [], None
+
+        try:
+            webhook_url = self.webhook_url_provider()
+        except Exception:
+            self._restore_pending(messages)
+            raise
+        if not webhook_url:
+            print(f"通知先 (slack_webhook_url) が未設定のため、{len(messages)}件の通知を破棄しました。")
+            return
+        payload = {'text': build_digest(messages)}
+        if insert_notification(webhook_url, json.dumps(payload, ensure_ascii=False)):
+            self._next_due_ms = 0
+            return
+
+        if force:
+            # 停止時は保存を再試行する機会が無いため、キューを経由せずに直接送る
+            self._send_direct(webhook_url, payload, len(messages))
+            return
+        # 保存できなかった通知は破棄せずまとめ待ちに戻し、少し待ってから保存し直す
+        self._restore_pending(messages)
+        print(f"通知 {len(messages)}件をキューに保存できなかったため、{NOTIFY_BACKOFF_BASE_SEC}秒後に再試行します。")
+
+    def _restore_pending(self, messages):
+        """取り出したメッセージをまとめ待ちの先頭に戻す (NOTIFY_BACKOFF_BASE_SEC 後に再度保存する)。"""
+        with self._cond:
+            self._pending[:0] = messages
+            self._pending_deadline = time.monotonic() + NOTIFY_BACKOFF_BASE_SEC
+
+    def _send_direct(self, webhook_url, payload, count):
+        try:
+            status, _, body = self.client.post_json(webhook_url, payload)
+        except (OSError, http.client.HTTPException) as e:
+            status, body = None, f'{type(e).__name__}: {e}'
+        if status is None or not 200 <= status < 300:
+            insert_system_log(0, 'ERROR', f'通知 {count}件を保存・送信できなかったため破棄しました。', str(body)[:500])
+            print(f"通知 {count}件を保存・送信できませんでした: {str(body)[:200]}")
+
+    def _deliver_due(self):
+        if time.monotonic() < self._blocked_until:
+            return
+        for row in select_due_notifications(int(time.time() * 1000), NOTIFY_BATCH_LIMIT):
+            with self._cond:
+                if self._stopping:
+                    break
+            # 送信間隔を空ける (Slack の Incoming Webhook は 1秒1件程度が上限)
+            wait = self._last_sent + self.min_interval_sec - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            if not self._send(row):
+                break
+        self._next_due_ms = select_next_notification_ms()
+
+    def _send(self, row):
+        """
+        1件を送信し、結果に応じてキューを更新する。
+
+        :return: 続けて次の通知を送ってよい場合 True (429 を受けた場合は False)
+        """
+        notification_id = row['notification_id']
+        attempts = row['attempts'] + 1
+        self._last_sent = time.monotonic()
+        try:
+            status, headers, body = self.client.post_json(row['webhook_url'], json.loads(row['payload']))
+        except (OSError, http.client.HTTPException) as e:
+            self._retry_later(row, attempts, f'{type(e).__name__}: {e}')
+            return True
+
+        if 200 <= status < 300:
+            delete_notification(notification_id)
+            return True
+        if status == 429:
+            try:
+                retry_after = float(headers.get('retry-after', NOTIFY_BACKOFF_BASE_SEC))
+            except ValueError:
+                retry_after = NOTIFY_BACKOFF_BASE_SEC
+            self._blocked_until = time.monotonic() + retry_after
+            update_notification_retry(notification_id, attempts, int((time.time() + retry_after) * 1000),
+                                      f'429: {body[:200]}')
+            print(f"通知の送信が制限されました (429)。{retry_after}秒後に再送します。")
+            return False
+        if 400 <= status < 500:
+            # URL の誤り・無効化されたWebhookなどは再送しても成功しないため破棄する
+            delete_notification(notification_id)
+            insert_system_log(0, 'ERROR', f'通知の送信に失敗しました (HTTP {status})。', body[:500])
+            print(f"通知の送信エラー (HTTP {status}): {body[:200]}")
+            return True
+
+        self._retry_later(row, attempts, f'HTTP {status}: {body[:200]}')
+        return True
+
+    def _retry_later(self, row, attempts, error):
+        notification_id = row['notification_id']
+        if attempts >= NOTIFY_MAX_ATTEMPTS:
+            delete_notification(notification_id)
+            insert_system_log(0, 'ERROR', f'通知を {attempts}回送信できなかったため破棄しました。', error)
+            print(f"通知の送信を断念しました (ID {notification_id}): {error}")
+            return
+        delay = min(NOTIFY_BACKOFF_BASE_SEC * 2 ** (attempts - 1), NOTIFY_BACKOFF_MAX_SEC)
+        update_notification_retry(notification_id, attempts, int((time.time() + delay) * 1000), error)
+        print(f"通知の送信に失敗しました (ID {notification_id}, {attempts}回目)。{delay}秒後に再送します: {error}")
+
+
+# アプリ全体で共有する通知ディスパッチャ
+notification_dispatcher = NotificationDispatcher()
+
+
+def notify_alert_event(event):
+    """AlertEngine のハンドラ。アラートの発生・解消を Slack に通知する。"""
+    level = event.rule.severity if event.state == 'open' else 'RESOLVED'
+    notification_dispatcher.notify(f"[{level}] Layer {event.layer_id}: {event.message()}")
@@ -0,0 +1,46 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# 計測中のスレッドだけが {フェーズ名: 秒} の辞書を持つ
+_local = threading.local()
+
+
+def begin():
+    """呼び出し元スレッドでフェーズ時間の集計を開始する (ジョブの開始時に呼ぶ)。"""
+    _local.totals = {}
+
+
+def end():
+    """
+    集計を終了し、結果を返す。
+
+    :return: {フェーズ名: 秒} (例: {'db': 0.012, 'device': 0.3})
+    """
+    totals = getattr(_local, 'totals', None)
+    _local.totals = None
+    return totals or {}
+
+
+def add(name, seconds):
+    totals = getattr(_local, 'totals', None)
+    if totals is not None:
+        totals[name] = totals.get(name, 0.0) + seconds
+
+
+@contextmanager
+def phase(name):
+    """
+    ブロックの所要時間をフェーズ name に加算する。集計中でないスレッドでは何もしない。
+
+        with phase('device'):
+            ret, frame = device.read()
+    """
+    if getattr(_local, 'totals', None) is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add(name, time.perf_counter() - started)
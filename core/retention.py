@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from config import *
+from core.db_connection import get_connection
+from core.sensor_rollups import ROLLUP_RESOLUTIONS
+from core.image_store import remove_expired_day_dirs, is_sharded_path
+
+# ロールアップテーブルは WITHOUT ROWID のため、主キー (layer_id, bucket_ms) で削除する
+_ROLLUP_TABLES = {table for table, _ in ROLLUP_RESOLUTIONS}
+
+
+def _next_layer_id(conn, table, after):
+    """(layer_id, 時刻) インデックスを使って、after より大きい次の layer_id を返す。"""
+    row = conn.execute(f"SELECT MIN(layer_id) FROM {table} WHERE layer_id > ?", (after,)).fetchone()
+    return row[0]
+
+
+def _delete_chunk(conn, table, layer_id, cutoff_ms, chunk_size):
+    """
+    1チャンク分の期限切れ行を削除し、削除件数を返す。トランザクションはチャンクごとに確定する。
+    layer_id が None の場合は layer_id が NULL の行 (sensor_logs・ai_reports では NULL を許す) を対象にする
+    (layer_id IS ? は = ? と同じく (layer_id, 時刻) インデックスで検索される)。
+    """
+    if table in _ROLLUP_TABLES:
+        query = f"""
+            DELETE FROM {table}
+            WHERE layer_id IS ? AND bucket_ms IN (
+                SELECT bucket_ms FROM {table} WHERE layer_id IS ? AND bucket_ms < ? LIMIT ?
+            )
+        """
+        params = (layer_id, layer_id, cutoff_ms, chunk_size)
+    else:
+        query = f"""
+            DELETE FROM {table}
+            WHERE rowid IN (
+                SELECT rowid FROM {table} WHERE layer_id IS ? AND ts_ms < ? LIMIT ?
+            )
+        """
+        params = (layer_id, cutoff_ms, chunk_size)
+
+    with conn:
+        return conn.execute(query, params).rowcount
+
+
+def purge_table(table, retention_days, chunk_size=RETENTION_CHUNK_SIZE, pause_sec=RETENTION_CHUNK_PAUSE_SEC):
+    """
+    保持期間を過ぎた行を層ごと・チャンクごとに削除する。
+    チャンク間で短く休止し、書き込みロックを長時間保持しないようにする。
+
+    :param table: 対象テーブル名
+    :param retention_days: 保持日数
+    :return: 削除した行数
+    """
+    conn = get_connection()
+    cutoff_ms = int((datetime.now() - timedelta(days=retention_days)).timestamp() * 1000)
+
+    def purge_layer(layer_id):
+        deleted = 0
+        while True:
+            count = _delete_chunk(conn, table, layer_id, cutoff_ms, chunk_size)
+            deleted += count
+            if count < chunk_size:
+                return deleted
+            time.sleep(pause_sec)
+
+    # layer_id > ? では NULL の行に届かないため、最初に layer_id が NULL の行を削除する
+    deleted = purge_layer(None)
+    layer_id = _next_layer_id(conn, table, -1)
+    while layer_id is not None:
+        deleted += purge_layer(layer_id)
+        layer_id = _next_layer_id(conn, table, layer_id)
+
+    return deleted
+
+
+def purge_expired_images(retention_days=RETENTION_DAYS, chunk_size=RETENTION_CHUNK_SIZE,
+                         pause_sec=RETENTION_CHUNK_PAUSE_SEC):
+    """
+    保持期間を過ぎた画像ファイルと ai_reports の行を削除する。
+    日ごとのディレクトリに保存された画像は、期限切れの日のディレクトリごと削除する。
+    旧形式 (layer_N/ 直下) の画像は ai_reports の撮影時刻 (ts_ms) を索引として1件ずつ削除する。
+    保持期間は日単位で数え、cutoff 日の 0 時より前の画像と行が対象になる。
+
+    :param retention_days: 画像の保持日数
+    :return: {'files': 削除したファイル数, 'rows': 削除した行数, 'days': 削除した日のディレクトリ数}
+    """
+    conn = get_connection()
+    cutoff_day = (datetime.now() - timedelta(days=retention_days)).date()
+    cutoff_ms = int(datetime.combine(cutoff_day, datetime.min.time()).timestamp() * 1000)
+
+    result = {'files': 0, 'rows': 0, 'days': 0}
+    if os.path.isdir(BASE_SAVE_DIR):
+        for layer_name in sorted(os.listdir(BASE_SAVE_DIR)):
+            layer_dir = os.path.join(BASE_SAVE_DIR, layer_name)
+            if not os.path.isdir(layer_dir):
+                continue # .DS_Store などのファイルは対象外
+            removed = remove_expired_day_dirs(layer_dir, cutoff_day)
+            result['days'] += removed['days']
+            result['files'] += removed['files']
+
+    # 削除できずに残した行を再度読まないよう (ts_ms, report_id) でページングする
+    last_key = (-1, -1)
+    while True:
+        rows = conn.execute(
+            """
+            SELECT ts_ms, report_id, image_path FROM ai_reports
+            WHERE ts_ms < ? AND (ts_ms, report_id) > (?, ?)
+            ORDER BY ts_ms, report_id LIMIT ?
+            """,
+            (cutoff_ms, last_key[0], last_key[1], chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+        last_key = rows[-1][:2]
+
+        removed_ids = []
+        for _, report_id, image_path in rows:
+            if is_sharded_path(image_path):
+                # 日のディレクトリごと削除済みの行だけを削除する (削除に失敗して残った日の行は次回に再試行する)
+                if not os.path.isdir(os.path.dirname(image_path)):
+                    removed_ids.append((report_id,))
+                continue
+            try:
+                os.remove(image_path)
+                result['files'] += 1
+            except FileNotFoundError:
+                pass # ファイルが既に無い場合は行だけ削除する
+            except OSError as e:
+                # 削除できなかったファイルの行は残し、次回に再試行する
+                print(f"警告: 古い画像ファイル {image_path} の削除中にエラー: {e}")
+                continue
+            removed_ids.append((report_id,))
+
+        with conn:
+            conn.executemany("DELETE FROM ai_reports WHERE report_id = ?", removed_ids)
+        result['rows'] += len(removed_ids)
+
+        if len(rows) < chunk_size:
+            break
+        time.sleep(pause_sec)
+
+    return result
+
+
+def _database_bytes(conn):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    return page_size * page_count
+
+
+def reclaim_space(pages_per_step=RETENTION_VACUUM_PAGES_PER_STEP, pause_sec=RETENTION_CHUNK_PAUSE_SEC):
+    """
+    空きページを少しずつ解放する (PRAGMA incremental_vacuum)。
+    auto_vacuum=INCREMENTAL のデータベースでのみ効果がある。
+
+    :return: 解放したバイト数
+    """
+    conn = get_connection()
+    # 2 = INCREMENTAL。それ以外では incremental_vacuum は何もしない
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+
+    before = _database_bytes(conn)
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while free_pages > 0:
+        with conn:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages_per_step)})").fetchall()
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if remaining >= free_pages:
+            break
+        free_pages = remaining
+        time.sleep(pause_sec)
+    return before - _database_bytes(conn)
+
+
+def apply_retention(policies=None):
+    """
+    テーブルごとの保持ポリシーを適用し、削除行数と解放バイト数を返す。
+
+    :param policies: {テーブル名: 保持日数 (None は無期限)}。省略時は DB_RETENTION_POLICIES
+    :return: {'rows': {テーブル名: 削除行数}, 'bytes_reclaimed': 解放バイト数}
+    """
+    if policies is None:
+        policies = DB_RETENTION_POLICIES
+
+    report = {'rows': {}, 'bytes_reclaimed': 0}
+    for table, retention_days in policies.items():
+        if retention_days is None:
+            continue
+        try:
+            report['rows'][table] = purge_table(table, retention_days)
+        except sqlite3.Error as e:
+            print(f"保持期間処理エラー ({table}): {e}")
+
+    try:
+        report['bytes_reclaimed'] = reclaim_space()
+    except sqlite3.Error as e:
+        print(f"領域解放エラー: {e}")
+
+    return report
@@ -2,28 +2,43 @@
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.events import EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
 import time
 import sys
-from core.db_manager import select_schedules
-from jobs.camera_jobs import execute_photo_job
-from jobs.sensor_jobs import execute_sensor_job
-from jobs.pump_jobs import execute_pump_job 
+from core.db_manager import (select_schedules, select_schedules_by_ids, select_schedule_changes,
+                             select_last_schedule_change_id, delete_schedule_changes,
+                             start_log_writer, stop_log_writer)
+from core.db_connection import close_all_connections
+from core.sensor_sampling import sampling_engine
+from core.alert_engine import alert_engine, evaluate_sample, refresh_alert_rules
+from core.layer_status import clear_open_alerts
+from core.notifier import notification_dispatcher, notify_alert_event
+from core.job_registry import get_handler, preload
+from core.executors import build_executors, get_executor_name, run_in_worker, PROCESS_EXECUTOR
+from core.triggers import build_trigger, split_exec_time
+from core.job_metrics import (job_metrics, timed_job, write_metrics_snapshot,
+                              start_metrics_server, stop_metrics_server)
+from config import *
 
-# グローバルなスケジューラインスタンスを定義
-scheduler = BackgroundScheduler()
+# グローバルなスケジューラインスタンスを定義 (ジョブタイプごとに executor を分ける)
+scheduler = BackgroundScheduler(executors=build_executors())
 
 def get_job_info(job):
-    """DBレコードから実行関数と引数を取得する"""
+    """
+    DBレコードから実行関数と引数を取得する。
+    実行関数は job_registry の LazyHandler で、ジョブのモジュール (cv2 など) は初回実行時に読み込まれる。
+    実行する executor は get_executor_name(job_func.job_type) で決まる。
+    """
     job_type = job['job_type']
     layer_id = job['layer_id']
 
-    if job_type == 'camera':
-        job_func = execute_photo_job
-    elif job_type == 'sensor':
-        job_func = execute_sensor_job
-    elif job_type == 'water':
-        job_func = execute_pump_job
-    else:
+    if job_type == 'camera' and layer_id == 0:
+        # layer_id=0 のカメラジョブは有効な全層を一括撮影する
+        job_type = 'camera_rack'
+
+    job_func = get_handler(job_type)
+    if job_func is None:
         print(f"警告: 未知のジョブタイプ '{job_type}' をスキップしました。")
         return None, None
     
@@ -31,47 +46,109 @@ def get_job_info(job):
     job_args = {'layer_id': layer_id}
     return job_func, job_args
 
-def get_cron_trigger(job_type, exec_time):
+# 登録済みの DB スケジュール: {ジョブID: (job_type, exec_time, layer_id)}
+_registered_schedules = {}
+# メトリクスの集計単位: {ジョブID: ジョブタイプ名}
+_job_labels = {}
+# プロセスプールで実行するジョブのID (メトリクスは実行完了イベントで集計する)
+_process_jobs = set()
+# 反映済みの schedule_changes の最大 change_id
+_last_change_id = 0
+
+
+def _schedule_signature(job):
+    return (job['job_type'], job['exec_time'], job['layer_id'])
+
+
+def _register_schedule(job):
     """
-    ジョブタイプとexec_timeに基づいて適切なCronTriggerを生成する。
-    
-    * sensor/water: 間隔実行 (例: '00:30:00' -> 0,30 * * * *)
-    * camera: 特定時刻の固定実行 (例: '09:00:00' -> 0 9 * * *)
+    1件のスケジュールを APScheduler に登録する。登録済みの場合は実行中のインスタンスに
+    触れずに、関数・引数・トリガーだけを差し替える。
+
+    :return: 登録できた場合 True
     """
+    schedule_id = job['schedule_id']
+    job_type = job['job_type']
+    exec_time = job['exec_time']
+    layer_id = job['layer_id']
+    job_id = f'job_{schedule_id}' # 変更・削除のためにIDを割り当てる
+
+    job_func, job_args = get_job_info(job)
+    if not job_func:
+        return False
+    # 全層一括撮影 (camera_rack) は単層の撮影と所要時間が大きく異なるため別に集計する
+    label = job_func.job_type
+    executor = get_executor_name(label)
+    if executor == PROCESS_EXECUTOR:
+        # 別プロセスには pickle できるモジュールの関数と、ハンドラの参照文字列を渡す
+        job_args = {'ref': job_func.ref, 'job_type': label, 'job_kwargs': job_args}
+        job_func = run_in_worker
+    else:
+        job_func = timed_job(label, job_func)
+
     try:
-        H, M, S = map(int, exec_time.split(':'))
-    except ValueError:
-        print(f"エラー: 不正な時刻形式 '{exec_time}'")
-        return CronTrigger(minute='*') # 毎分実行でフォールバック
-    
-    # センサー/水やりジョブの場合、exec_timeの分/秒を間隔と解釈する
-    if job_type in ['sensor', 'water']:
-        total_minutes = M + H * 60
-        
-        if total_minutes > 0 and 60 % total_minutes == 0:
-            # 60分を割り切れる間隔の場合 (例: 10, 15, 20, 30分)
-            # Cronで分(minute)を指定し、毎時実行
-            minute_interval = ','.join([str(i) for i in range(0, 60, total_minutes)])
-            return CronTrigger(minute=minute_interval, hour='*', second=0)
+        # 適切なトリガーを生成 (間隔実行のジョブは層ごとにオフセットをずらす)
+        trigger, description = build_trigger(job_type, exec_time, layer_id, schedule_id)
+        name = f'Layer {layer_id} / {job_type} @ {split_exec_time(exec_time)[1][:5]}'
+
+        if scheduler.get_job(job_id):
+            scheduler.modify_job(job_id, func=job_func, kwargs=job_args, name=name, executor=executor)
+            if _registered_schedules.get(job_id) != _schedule_signature(job):
+                scheduler.reschedule_job(job_id, trigger=trigger)
+            action = '更新'
+        else:
+            # APSchedulerにジョブを登録
+            scheduler.add_job(
+                func=job_func,
+                trigger=trigger,
+                id=job_id,
+                kwargs=job_args,
+                name=name,
+                executor=executor,
+                max_instances=1 # ジョブが重複して実行されないようにする
+            )
+            action = '登録'
+
+        _registered_schedules[job_id] = _schedule_signature(job)
+        _job_labels[job_id] = label
+        if executor == PROCESS_EXECUTOR:
+            _process_jobs.add(job_id)
+        else:
+            _process_jobs.discard(job_id)
+        print(f"✓ スケジュール{action}: [Layer {layer_id} / {job_type}] {description} に実行 ({executor})")
+        return True
+
+    except Exception as e:
+        print(f"スケジュール登録エラー (ID {schedule_id}): {e}")
+        return False
 
-        elif H > 0 or M > 0:
-            # それ以外は、単なる固定時刻として扱う
-            return CronTrigger(hour=H, minute=M, second=0)
 
-    # カメラジョブまたはその他の固定時刻ジョブの場合
-    # 毎日指定時刻に実行
-    return CronTrigger(hour=H, minute=M, second=0)
+def _unregister_schedule(job_id):
+    """登録済みのスケジュールを削除する (実行中のインスタンスは最後まで実行される)。"""
+    _registered_schedules.pop(job_id, None)
+    _job_labels.pop(job_id, None)
+    _process_jobs.discard(job_id)
+    if scheduler.get_job(job_id):
+        scheduler.remove_job(job_id)
+        print(f"✓ スケジュール削除: {job_id}")
+
+
+def _sync_sampling_layers():
+    """登録済みの sensor スケジュールの層だけを高頻度サンプリングの対象にする。"""
+    sampling_engine.set_layers({layer_id for job_type, _, layer_id in _registered_schedules.values()
+                                if job_type == 'sensor'})
 
 
 def load_and_schedule_jobs():
     """
     データベースから有効なスケジュールを読み込み、APSchedulerに登録する。
+    以降の変更は reconcile_schedules() が差分だけ反映する。
     """
+    global _last_change_id
     print("--- スケジュール設定を開始します (APScheduler) ---")
-    
-    # 既存のすべてのジョブを削除し、再登録に備える
-    scheduler.remove_all_jobs() 
 
+    # 読み込み後に発生した変更を取りこぼさないよう、先に変更ログの位置を記録する
+    _last_change_id = select_last_schedule_change_id()
     schedules = select_schedules()
     
     if not schedules:
@@ -79,49 +156,141 @@ def load_and_schedule_jobs():
         return
 
     for job in schedules:
-        schedule_id = job['schedule_id']
-        job_type = job['job_type']
-        exec_time = job['exec_time']
-        layer_id = job['layer_id']
-
-        job_func, job_args = get_job_info(job)
-        
-        if job_func:
-            try:
-                # 適切なCronTriggerを生成
-                trigger = get_cron_trigger(job_type, exec_time)
-
-                # APSchedulerにジョブを登録
-                scheduler.add_job(
-                    func=job_func,
-                    trigger=trigger,
-                    id=f'job_{schedule_id}', # 変更・削除のためにIDを割り当てる
-                    kwargs=job_args,
-                    name=f'Layer {layer_id} / {job_type} @ {exec_time[:5]}',
-                    max_instances=1 # ジョブが重複して実行されないようにする
-                )
-                
-
-
-                if job_type in ['sensor', 'water']:
-                    # 間隔実行として登録した場合
-                    H, M, S = map(int, exec_time.split(':'))
-                    total_minutes = M + H * 60
-                    if total_minutes > 0 and 60 % total_minutes == 0:
-                        # 30分おきなどの「間隔」を明記
-                        print(f"✓ スケジュール登録: [Layer {layer_id} / {job_type}] 毎時 {total_minutes}分おきに実行 (Cron: 0,{total_minutes}...分)")
-                    else:
-                        # 固定時刻として登録した場合
-                        print(f"✓ スケジュール登録: [Layer {layer_id} / {job_type}] 毎日 {exec_time[:5]} に実行")
-                else:
-                    # カメラジョブ（固定時刻）
-                    print(f"✓ スケジュール登録: [Layer {layer_id} / {job_type}] 毎日 {exec_time[:5]} に実行")
-
-            except Exception as e:
-                print(f"スケジュール登録エラー (ID {schedule_id}): {e}")
+        _register_schedule(job)
+    _sync_sampling_layers()
 
     print("--- スケジュール設定が完了しました ---")
 
+
+def reconcile_schedules():
+    """
+    schedule_changes (schedules テーブルのトリガーが記録する変更ログ) を読み、
+    変更されたスケジュールだけを追加・更新・削除する。変更が無い場合は1回の索引参照のみ。
+    """
+    global _last_change_id
+    last_change_id, schedule_ids = select_schedule_changes(_last_change_id)
+    if not schedule_ids:
+        return
+
+    rows = select_schedules_by_ids(schedule_ids)
+    if rows is None:
+        # 読めなかったスケジュールを削除扱いにしないよう、変更ログを残して次回に再試行する
+        return
+    for schedule_id in schedule_ids:
+        job_id = f'job_{schedule_id}'
+        job = rows.get(schedule_id)
+
+        if job is None or not job['is_enabled']:
+            _unregister_schedule(job_id)
+        elif _registered_schedules.get(job_id) != _schedule_signature(job):
+            if not _register_schedule(job):
+                # 未知のジョブタイプなどに変更された場合は古い登録を残さない
+                _unregister_schedule(job_id)
+
+    _sync_sampling_layers()
+    _last_change_id = last_change_id
+    delete_schedule_changes(last_change_id)
+
+
+def _add_system_job(job_id, func, trigger, description):
+    _job_labels[f'system_{job_id}'] = job_id
+    # システムジョブはプロセス内の状態 (サンプリングのバッファなど) を使うため、スレッドで実行する
+    executor = get_executor_name(job_id)
+    if executor == PROCESS_EXECUTOR:
+        executor = 'default'
+    scheduler.add_job(
+        func=timed_job(job_id, func),
+        trigger=trigger,
+        id=f'system_{job_id}',
+        name=f'System / {job_id}',
+        executor=executor,
+        replace_existing=True,
+        max_instances=1
+    )
+    print(f"✓ システムジョブ登録: [{job_id}] {description}")
+
+
+def _daily_trigger(exec_time):
+    H, M, S = map(int, exec_time.split(':'))
+    return CronTrigger(hour=H, minute=M, second=S)
+
+
+def register_system_jobs():
+    """
+    schedules テーブルに依存しないシステム保守ジョブを登録する。
+    ID は 'system_' で始まり、DBスケジュールのジョブ ('job_{schedule_id}') とは区別される。
+    """
+    _add_system_job('retention', get_handler('retention'), _daily_trigger(RETENTION_JOB_TIME),
+                    f"毎日 {RETENTION_JOB_TIME[:5]} に実行")
+    _add_system_job('image_retention', get_handler('image_retention'), _daily_trigger(IMAGE_RETENTION_JOB_TIME),
+                    f"毎日 {IMAGE_RETENTION_JOB_TIME[:5]} に実行")
+    _add_system_job('camera_idle_check', _camera_idle_check,
+                    IntervalTrigger(seconds=CAMERA_IDLE_CHECK_INTERVAL_SEC),
+                    f"{CAMERA_IDLE_CHECK_INTERVAL_SEC}秒おきに実行")
+    _add_system_job('schedule_reconcile', reconcile_schedules,
+                    IntervalTrigger(seconds=SCHEDULE_RECONCILE_INTERVAL_SEC),
+                    f"{SCHEDULE_RECONCILE_INTERVAL_SEC}秒おきに実行")
+    if SENSOR_SAMPLING_ENABLED or ALERT_ENABLED:
+        # アラートはサンプルごとに取得時刻で評価する (sensor ジョブの実行間隔を待たない)。
+        # 高頻度サンプリングが無効の場合も、アラートの評価のためにサンプリングだけは行う (バッファには溜めない)
+        sampling_engine.add_listener(evaluate_sample)
+        _add_system_job('sensor_sampling', _sample_sensors,
+                        IntervalTrigger(seconds=SENSOR_SAMPLE_INTERVAL_SEC),
+                        f"{SENSOR_SAMPLE_INTERVAL_SEC}秒おきに実行")
+    if JOB_METRICS_ENABLED and METRICS_SNAPSHOT_INTERVAL_SEC:
+        _add_system_job('metrics_snapshot', write_metrics_snapshot,
+                        IntervalTrigger(seconds=METRICS_SNAPSHOT_INTERVAL_SEC),
+                        f"{METRICS_SNAPSHOT_INTERVAL_SEC}秒おきに実行")
+
+
+def _camera_idle_check(layer_id: int = 0):
+    """カメラのモジュールが読み込まれている場合だけアイドルチェックを行う (センサー専用ノードで cv2 を読み込まない)。"""
+    camera_jobs = sys.modules.get('jobs.camera_jobs')
+    if camera_jobs:
+        camera_jobs.execute_camera_idle_check_job(layer_id)
+
+
+def _sample_sensors():
+    """サンプリングの1周ごとにアラートのルールを (設定が変わった場合だけ) 更新してから全層を読み取る。"""
+    refresh_alert_rules()
+    sampling_engine.sample_all()
+
+
+def _shutdown_camera():
+    """保存待ちの画像を書き出し、開いているカメラを閉じる (読み込まれていない場合は何もしない)。"""
+    capture_pipeline_module = sys.modules.get('core.capture_pipeline')
+    if capture_pipeline_module:
+        capture_pipeline_module.capture_pipeline.shutdown(wait=True)
+    camera_session_module = sys.modules.get('core.camera_session')
+    if camera_session_module:
+        camera_session_module.camera_manager.close_all()
+
+
+def _on_job_not_run(event):
+    """実行されなかったジョブ (ミスファイア・max_instances によるスキップ) を記録する。"""
+    label = _job_labels.get(event.job_id, event.job_id)
+    if event.code == EVENT_JOB_MISSED:
+        job_metrics.record_misfire(label)
+        print(f"警告: ジョブ {event.job_id} ({label}) が予定時刻に実行されませんでした (ミスファイア)。")
+    else:
+        job_metrics.record_skip(label)
+        print(f"警告: ジョブ {event.job_id} ({label}) は前回の実行中のためスキップされました。")
+
+
+def _on_process_job_done(event):
+    """プロセスプールで実行したジョブの計測結果 (run_in_worker の戻り値) を集計する。"""
+    if event.job_id not in _process_jobs:
+        return
+    if event.code == EVENT_JOB_EXECUTED and event.retval:
+        result = event.retval
+        job_metrics.record_run(result['job_type'], result['duration'], result['failed'], result['phases'])
+    elif event.code == EVENT_JOB_ERROR:
+        # run_in_worker が結果を返せなかった場合 (ワーカーでの import の失敗など)。
+        # ワーカープロセス自体の異常終了はイベントにならず、APScheduler のログにのみ記録される
+        job_metrics.record_run(_job_labels.get(event.job_id, event.job_id), 0.0, failed=True)
+        print(f"エラー: ジョブ {event.job_id} をワーカープロセスで実行できませんでした: {event.exception}")
+
+
 # main.pyから呼び出される関数
 def run_scheduler():
     """
@@ -129,12 +298,35 @@ def run_scheduler():
     """
     # スケジュール設定を最初に実行
     load_and_schedule_jobs()
+    register_system_jobs()
+
+    # 実行時間はジョブのラッパーで、実行されなかったジョブはイベントで集計する
+    if JOB_METRICS_ENABLED:
+        scheduler.add_listener(_on_job_not_run, EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+        scheduler.add_listener(_on_process_job_done, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+        start_metrics_server()
+
+    # アラートの状態は再起動で初期化されるため、前回の発生中のアラートを layer_status から消す
+    clear_open_alerts()
+
+    # ログの一括書き込みスレッドを起動 (ジョブからのログはキュー経由で書き込まれる)
+    start_log_writer()
+
+    # アラートの Slack 通知はジョブのスレッドを待たせないよう別スレッドから送信する
+    if NOTIFY_ENABLED:
+        alert_engine.add_handler(notify_alert_event)
+        notification_dispatcher.start()
 
     # スケジューラを起動
     if not scheduler.running:
         scheduler.start()
         print("APSchedulerが起動しました。")
 
+    # 登録されたジョブのモジュールを裏で読み込み、初回実行の遅延を無くす
+    # (プロセスプールのジョブはワーカー内で読み込むため、このプロセスでは読み込まない)
+    if JOB_PRELOAD_HANDLERS:
+        preload(label for job_id, label in _job_labels.items() if job_id not in _process_jobs)
+
     # メインスレッドを維持する。ジョブはバックグラウンドで実行される。
     try:
         # スケジューラ起動中は time.sleep でプロセスを維持する
@@ -144,6 +336,13 @@ def run_scheduler():
         # 終了シグナルを受け取った際、スケジューラをシャットダウン
         print("\nAPSchedulerをシャットダウンします...")
         if scheduler.running:
-            scheduler.shutdown(wait=False)
+            # 実行中のジョブがDB接続を使い終わるまで待ってから接続を閉じる
+            scheduler.shutdown(wait=True)
+        # 保存待ちの画像を書き出してからカメラ・ログ・接続を閉じる
+        _shutdown_camera()
+        notification_dispatcher.stop()
+        stop_metrics_server()
+        stop_log_writer()
+        close_all_connections()
         # main.py の KeyboardInterrupt 処理に任せる
         raise
\ No newline at end of file
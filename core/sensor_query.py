@@ -0,0 +1,72 @@
+import sqlite3
+import numpy as np
+from config import *
+from core.db_connection import get_connection
+from core.sensor_rollups import ROLLUP_RESOLUTIONS
+
+_COLUMNS = ['layer_id', 'timestamp_ms', 'count',
+            'temperature_min', 'temperature_max', 'temperature_mean',
+            'humidity_min', 'humidity_max', 'humidity_mean']
+
+
+def choose_resolution(start_ms: int, end_ms: int, max_points: int):
+    """
+    期間と点数上限から使用するロールアップテーブルを選ぶ。
+    1層あたりのバケット数が max_points 以下になる範囲で最も細かい解像度を返し、
+    どれも収まらない場合は最も粗い解像度 (1日) を返す。
+
+    :return: (テーブル名, 集計間隔ミリ秒)
+    """
+    span_ms = max(end_ms - start_ms, 0)
+    for table, interval_ms in ROLLUP_RESOLUTIONS:
+        if span_ms // interval_ms + 1 <= max_points:
+            return table, interval_ms
+    return ROLLUP_RESOLUTIONS[-1]
+
+
+def query_sensor_range(layer_id, start_ms: int, end_ms: int, max_points: int = ROLLUP_DEFAULT_MAX_POINTS):
+    """
+    指定期間の温湿度をロールアップテーブルから取得し、列ごとの NumPy 配列で返す。
+
+    :param layer_id: 対象の層ID (None の場合は全層)
+    :param start_ms: 期間の開始 (エポックミリ秒, この値を含む)
+    :param end_ms: 期間の終了 (エポックミリ秒, この値を含まない)
+    :param max_points: 1層あたりの最大点数。これを超えない解像度が自動で選ばれる
+    :return: {'resolution_ms': int, 'layer_id': ndarray, 'timestamp_ms': ndarray, 'count': ndarray,
+              'temperature_min'/'_max'/'_mean': ndarray, 'humidity_min'/'_max'/'_mean': ndarray}
+              値が無いバケットの統計値は NaN。エラー時は空配列
+    """
+    table, interval_ms = choose_resolution(start_ms, end_ms, max_points)
+
+    # 開始時刻を含むバケットから取得する
+    params = [start_ms - start_ms % interval_ms, end_ms]
+    layer_filter = ''
+    if layer_id is not None:
+        layer_filter = 'AND layer_id = ?'
+        params.append(layer_id)
+
+    try:
+        rows = get_connection().execute(
+            f"""
+            SELECT layer_id, bucket_ms, sample_count,
+                   temp_min, temp_max, CASE WHEN temp_count > 0 THEN temp_sum / temp_count END,
+                   hum_min, hum_max, CASE WHEN hum_count > 0 THEN hum_sum / hum_count END
+            FROM {table}
+            WHERE bucket_ms >= ? AND bucket_ms < ? {layer_filter}
+            ORDER BY layer_id, bucket_ms
+            """,
+            params
+        ).fetchall()
+    except sqlite3.Error as e:
+        print(f"センサー履歴取得エラー: {e}")
+        rows = []
+
+    # None は float 変換で NaN になる
+    data = np.array(rows, dtype=np.float64).reshape(len(rows), len(_COLUMNS))
+    result = {'resolution_ms': interval_ms}
+    for i, name in enumerate(_COLUMNS):
+        column = data[:, i]
+        if name in ('layer_id', 'timestamp_ms', 'count'):
+            column = column.astype(np.int64)
+        result[name] = column
+    return result
@@ -0,0 +1,113 @@
+from config import *
+
+# (テーブル名, 集計間隔ミリ秒) を細かい順に並べたもの
+ROLLUP_RESOLUTIONS = [
+    ('sensor_rollup_1m', 60 * 1000),
+    ('sensor_rollup_1h', 60 * 60 * 1000),
+    ('sensor_rollup_1d', 24 * 60 * 60 * 1000),
+]
+
+
+def get_create_rollup_table_queries():
+    """
+    ロールアップテーブルの CREATE 文を返す。
+    平均値は sum/count で求めるため、合計と件数を保持する (件数は NULL を除いたもの)。
+    バケットはエポックミリ秒を間隔で切り捨てた値 (1日バケットは UTC 日単位)。
+    """
+    return [
+        f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            layer_id INTEGER NOT NULL,
+            bucket_ms INTEGER NOT NULL,
+            sample_count INTEGER NOT NULL,
+            temp_min REAL,
+            temp_max REAL,
+            temp_sum REAL NOT NULL DEFAULT 0,
+            temp_count INTEGER NOT NULL DEFAULT 0,
+            hum_min REAL,
+            hum_max REAL,
+            hum_sum REAL NOT NULL DEFAULT 0,
+            hum_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (layer_id, bucket_ms)
+        ) WITHOUT ROWID;
+        """
+        for table, _ in ROLLUP_RESOLUTIONS
+    ]
+
+
+def get_rollup_backfill_queries():
+    """既存の sensor_logs から各ロールアップテーブルを埋める INSERT 文を返す (移行時に一度だけ使用)。"""
+    return [
+        f"""
+        INSERT OR REPLACE INTO {table}
+            (layer_id, bucket_ms, sample_count,
+             temp_min, temp_max, temp_sum, temp_count,
+             hum_min, hum_max, hum_sum, hum_count)
+        SELECT layer_id, (ts_ms / {interval_ms}) * {interval_ms}, COUNT(*),
+               MIN(temperature), MAX(temperature), TOTAL(temperature), COUNT(temperature),
+               MIN(humidity), MAX(humidity), TOTAL(humidity), COUNT(humidity)
+        FROM sensor_logs
+        WHERE ts_ms IS NOT NULL AND layer_id IS NOT NULL
+        GROUP BY 1, 2
+        """
+        for table, interval_ms in ROLLUP_RESOLUTIONS
+    ]
+
+
+def _merge(a, b, func):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return func(a, b)
+
+
+def update_rollups(conn, rows):
+    """
+    書き込まれたセンサー行でロールアップテーブルを差分更新する。
+    呼び出し側のトランザクション内で実行し、sensor_logs への INSERT と同時に確定させる。
+
+    :param conn: 書き込み中の sqlite3.Connection
+    :param rows: [(layer_id, ts_ms, temperature, humidity, temp_min, temp_max, hum_min, hum_max), ...]
+                 最小・最大が None の行 (単発の測定) は測定値そのものを最小・最大とする
+    """
+    for table, interval_ms in ROLLUP_RESOLUTIONS:
+        # 同じバケットに入る行はまとめてから UPSERT し、UPDATE 回数を減らす
+        buckets = {}
+        for layer_id, ts_ms, temperature, humidity, temp_min, temp_max, hum_min, hum_max in rows:
+            key = (layer_id, ts_ms - ts_ms % interval_ms)
+            agg = buckets.get(key)
+            if agg is None:
+                agg = buckets[key] = [0, None, None, 0.0, 0, None, None, 0.0, 0]
+            agg[0] += 1
+            if temperature is not None:
+                agg[1] = _merge(agg[1], temperature if temp_min is None else temp_min, min)
+                agg[2] = _merge(agg[2], temperature if temp_max is None else temp_max, max)
+                agg[3] += temperature
+                agg[4] += 1
+            if humidity is not None:
+                agg[5] = _merge(agg[5], humidity if hum_min is None else hum_min, min)
+                agg[6] = _merge(agg[6], humidity if hum_max is None else hum_max, max)
+                agg[7] += humidity
+                agg[8] += 1
+
+        conn.executemany(
+            f"""
+            INSERT INTO {table}
+                (layer_id, bucket_ms, sample_count,
+                 temp_min, temp_max, temp_sum, temp_count,
+                 hum_min, hum_max, hum_sum, hum_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (layer_id, bucket_ms) DO UPDATE SET
+                sample_count = sample_count + excluded.sample_count,
+                temp_min = MIN(COALESCE(temp_min, excluded.temp_min), COALESCE(excluded.temp_min, temp_min)),
+                temp_max = MAX(COALESCE(temp_max, excluded.temp_max), COALESCE(excluded.temp_max, temp_max)),
+                temp_sum = temp_sum + excluded.temp_sum,
+                temp_count = temp_count + excluded.temp_count,
+                hum_min = MIN(COALESCE(hum_min, excluded.hum_min), COALESCE(excluded.hum_min, hum_min)),
+                hum_max = MAX(COALESCE(hum_max, excluded.hum_max), COALESCE(excluded.hum_max, hum_max)),
+                hum_sum = hum_sum + excluded.hum_sum,
+                hum_count = hum_count + excluded.hum_count
+            """,
+            [key + tuple(agg) for key, agg in buckets.items()]
+        )
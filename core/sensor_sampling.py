@@ -0,0 +1,208 @@
+import random
+import threading
+import time
+from dataclasses import dataclass, asdict
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from config import *
+from core.phase_timer import phase
+
+
+class DummySensorBackend:
+    """物理センサが無い環境用のダミー値を返すバックエンド。"""
+
+    def read(self, layer_id):
+        """
+        :return: (温度, 湿度)
+        """
+        temperature = round(random.uniform(25.0, 32.0), 1)  # 25.0℃〜32.0℃の範囲
+        humidity = round(random.uniform(50.0, 75.0), 1)     # 50%〜75%の範囲
+        return temperature, humidity
+
+
+def create_sensor_backend(name=SENSOR_BACKEND):
+    """設定名からセンサーバックエンドを生成する (実センサの実装時はここに追加する)。"""
+    if name != 'dummy':
+        print(f"警告: 未知のセンサーバックエンド '{name}' のためダミー値を使用します。")
+    return DummySensorBackend()
+
+
+class RingBuffer:
+    """(温度, 湿度) の組を固定長の配列に上書きしながら保持するリングバッファ。"""
+
+    def __init__(self, capacity=SENSOR_BUFFER_CAPACITY):
+        self._data = np.empty((capacity, 2), dtype=np.float64)
+        self._index = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, temperature, humidity):
+        self._data[self._index] = (temperature, humidity)
+        self._index = (self._index + 1) % len(self._data)
+        self._count = min(self._count + 1, len(self._data))
+
+    def values(self):
+        """古い順に並べたサンプルのコピーを返す (形状: (件数, 2))。"""
+        if self._count < len(self._data):
+            return self._data[:self._count].copy()
+        return np.roll(self._data, -self._index, axis=0)
+
+    def clear(self):
+        self._index = 0
+        self._count = 0
+
+
+@dataclass(frozen=True)
+class SensorSummary:
+    """一定期間のサンプルの集計値。temperature/humidity は平均値。"""
+    temperature: float
+    humidity: float
+    temp_min: float
+    temp_max: float
+    temp_std: float
+    hum_min: float
+    hum_max: float
+    hum_std: float
+    sample_count: int
+
+    def as_stats(self):
+        """insert_sensor_log の stats 引数に渡す辞書を返す。"""
+        stats = asdict(self)
+        del stats['temperature'], stats['humidity']
+        return stats
+
+
+def filter_samples(samples, median_window=SENSOR_MEDIAN_WINDOW, outlier_k=SENSOR_OUTLIER_K):
+    """
+    メディアンフィルタでスパイク状のノイズを抑え、MAD (中央絶対偏差) で外れ値を除く。
+
+    :param samples: 形状 (件数, 列数) の配列
+    :return: 列ごとに外れ値を NaN にした配列
+    """
+    filtered = samples.astype(np.float64, copy=True)
+    n = len(filtered)
+    if median_window > 1 and n >= median_window:
+        half = median_window // 2
+        windows = sliding_window_view(filtered, median_window, axis=0)
+        filtered[half:n - half] = np.median(windows, axis=-1)
+
+    median = np.median(filtered, axis=0)
+    mad = np.median(np.abs(filtered - median), axis=0) * 1.4826
+    with np.errstate(invalid='ignore'):
+        outliers = np.abs(filtered - median) > outlier_k * np.where(mad > 0, mad, np.inf)
+    filtered[outliers] = np.nan
+    return filtered
+
+
+def summarize_samples(samples):
+    """
+    サンプルをフィルタリングして平均・最小・最大・標準偏差を求める。
+
+    :param samples: 形状 (件数, 2) の配列 (温度, 湿度)
+    :return: SensorSummary (サンプルが無い場合は None)
+    """
+    if len(samples) == 0:
+        return None
+    filtered = filter_samples(samples)
+    mean = np.nanmean(filtered, axis=0)
+    low = np.nanmin(filtered, axis=0)
+    high = np.nanmax(filtered, axis=0)
+    std = np.nanstd(filtered, axis=0)
+    return SensorSummary(
+        temperature=round(float(mean[0]), 2),
+        humidity=round(float(mean[1]), 2),
+        temp_min=float(low[0]),
+        temp_max=float(high[0]),
+        temp_std=round(float(std[0]), 3),
+        hum_min=float(low[1]),
+        hum_max=float(high[1]),
+        hum_std=round(float(std[1]), 3),
+        sample_count=len(samples),
+    )
+
+
+class SamplingEngine:
+    """
+    センサーを短い間隔で読み取り、層ごとのリングバッファに溜める。
+    DBへは sensor ジョブの実行時に drain_summary() で集計値だけを記録する。
+    buffering が False の場合は読み取った値をリスナー (アラートの評価) に渡すだけで溜めない。
+    """
+
+    def __init__(self, backend=None, capacity=SENSOR_BUFFER_CAPACITY, buffering=SENSOR_SAMPLING_ENABLED):
+        self.backend = backend or create_sensor_backend()
+        self.capacity = capacity
+        self.buffering = buffering
+        self._buffers = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        """サンプルごとに呼ばれる関数 listener(layer_id, temperature, humidity, ts) を登録する。"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+
+    def add_layer(self, layer_id):
+        """サンプリング対象の層を追加する (追加済みの場合は何もしない)。"""
+        with self._lock:
+            self._buffers.setdefault(layer_id, RingBuffer(self.capacity))
+
+    def remove_layer(self, layer_id):
+        with self._lock:
+            self._buffers.pop(layer_id, None)
+
+    def set_layers(self, layer_ids):
+        """サンプリング対象を layer_ids に揃える (既存の層のバッファは保持する)。"""
+        with self._lock:
+            for layer_id in set(self._buffers) - set(layer_ids):
+                del self._buffers[layer_id]
+            for layer_id in layer_ids:
+                self._buffers.setdefault(layer_id, RingBuffer(self.capacity))
+
+    def read(self, layer_id):
+        """バッファを経由せずに1回だけ読み取る。"""
+        with phase('device'):
+            return self.backend.read(layer_id)
+
+    def sample_all(self):
+        """対象の全層を1回ずつ読み取り、バッファに追加する。"""
+        with self._lock:
+            layer_ids = list(self._buffers)
+
+        for layer_id in layer_ids:
+            try:
+                with phase('device'):
+                    temperature, humidity = self.backend.read(layer_id)
+            except Exception as e:
+                print(f"警告: Layer {layer_id} のセンサー読み取りに失敗しました: {e}")
+                continue
+            ts = time.time()
+            with self._lock:
+                buffer = self._buffers.get(layer_id)
+                if buffer is not None and self.buffering:
+                    buffer.append(temperature, humidity)
+
+            for listener in self._listeners:
+                try:
+                    listener(layer_id, temperature, humidity, ts)
+                except Exception as e:
+                    print(f"警告: Layer {layer_id} のサンプル処理に失敗しました: {e}")
+
+    def drain_summary(self, layer_id):
+        """
+        層のバッファを集計して空にする。
+
+        :return: SensorSummary (サンプルが無い場合は None)
+        """
+        with self._lock:
+            buffer = self._buffers.get(layer_id)
+            if buffer is None or len(buffer) == 0:
+                return None
+            samples = buffer.values()
+            buffer.clear()
+        return summarize_samples(samples)
+
+
+# アプリ全体で共有するサンプリングエンジン
+sampling_engine = SamplingEngine()
@@ -0,0 +1,53 @@
+import importlib
+import sys
+import time
+
+# 起動時間に大きく影響するモジュール (読み込まれたかどうかを報告する)
+HEAVY_MODULES = ('cv2', 'numpy', 'apscheduler')
+
+
+def _timed(phases, name, func):
+    started = time.perf_counter()
+    result = func()
+    phases.append((name, time.perf_counter() - started))
+    return result
+
+
+def report_startup():
+    """
+    起動処理 (モジュールの import・DB初期化・スケジュール登録) の各段階の所要時間を計測して表示する。
+    スケジューラは起動しない。モジュール単位の内訳は `python -X importtime main.py --startup-report` で確認できる。
+    """
+    started = time.perf_counter()
+    modules_before = len(sys.modules)
+    phases = []
+
+    _timed(phases, 'import config', lambda: importlib.import_module('config'))
+    db_manager = _timed(phases, 'import core.db_manager', lambda: importlib.import_module('core.db_manager'))
+    _timed(phases, 'init_db()', db_manager.init_db)
+    scheduler = _timed(phases, 'import core.scheduler', lambda: importlib.import_module('core.scheduler'))
+    _timed(phases, 'load_and_schedule_jobs()', scheduler.load_and_schedule_jobs)
+    _timed(phases, 'register_system_jobs()', scheduler.register_system_jobs)
+    startup_sec = time.perf_counter() - started
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    modules_loaded = len(sys.modules) - modules_before
+
+    # 起動後に読み込まれるジョブハンドラ (初回実行または preload の時点で発生するコスト)
+    from core.job_registry import JOB_HANDLERS, resolve_handler
+    handler_phases = []
+    for job_type in dict.fromkeys(scheduler._job_labels.values()):
+        if job_type in JOB_HANDLERS:
+            _timed(handler_phases, f'{job_type} ({JOB_HANDLERS[job_type]})',
+                   lambda ref=JOB_HANDLERS[job_type]: resolve_handler(ref))
+
+    print("\n--- 起動時間レポート ---")
+    for name, seconds in phases:
+        print(f"  {name:<40} {seconds * 1000:9.1f} ms")
+    print(f"  {'合計 (スケジューラ起動まで)':<40} {startup_sec * 1000:9.1f} ms")
+    print(f"  読み込まれたモジュール数: {modules_loaded}")
+    print(f"  起動時に読み込まれた重いモジュール: {', '.join(loaded) or 'なし'}")
+    print("\n--- ジョブハンドラの読み込み時間 (起動後・初回実行時) ---")
+    for name, seconds in handler_phases:
+        print(f"  {name:<60} {seconds * 1000:9.1f} ms")
+    newly_loaded = [name for name in HEAVY_MODULES if name in sys.modules and name not in loaded]
+    print(f"  ジョブハンドラで読み込まれた重いモジュール: {', '.join(newly_loaded) or 'なし'}")
@@ -0,0 +1,285 @@
+"""
+層ごとのタイムラプス動画を撮影のたびに少しずつ作る。
+
+撮影したフレームは capture_pipeline から append_frame() に渡され、その日のセグメント
+(TIMELAPSE_DIR/layer_N/YYYYMMDD_NN.ts と縮小プレビューの YYYYMMDD_NN.preview.ts) に追記される。
+セグメントは MPEG-TS のため、バイト列をつなげるだけで1本の動画になる (過去のフレームを再エンコードしない)。
+
+    python -m core.timelapse build --layer 1 --output layer1.ts [--preview] [--start 2025-01-01] [--end 2025-04-01]
+    python -m core.timelapse backfill --layer 1   # 保存済みの画像から過去の日のセグメントを作る (導入時に1回)
+"""
+import argparse
+import glob
+import os
+import shutil
+import sqlite3
+import threading
+from datetime import date, datetime
+import cv2
+from config import *
+from core.db_connection import get_connection
+
+SEGMENT_EXTENSION = '.ts'
+PREVIEW_EXTENSION = '.preview.ts'
+
+
+def get_segment_dir(layer_id, base_dir=TIMELAPSE_DIR):
+    return os.path.join(base_dir, f"layer_{layer_id}")
+
+
+def _even(value):
+    # MPEG-4 のエンコーダは幅・高さが偶数である必要がある
+    return max(2, int(value) // 2 * 2)
+
+
+def _preview_size(size, preview_width=TIMELAPSE_PREVIEW_WIDTH):
+    width, height = size
+    if width <= preview_width:
+        return _even(width), _even(height)
+    return _even(preview_width), _even(height * preview_width / width)
+
+
+def _parse_segment_day(file_name):
+    try:
+        return datetime.strptime(file_name[:8], '%Y%m%d').date()
+    except ValueError:
+        return None
+
+
+def list_segments(layer_id, start_day=None, end_day=None, preview=False, base_dir=TIMELAPSE_DIR):
+    """
+    層のセグメントを撮影日・作成順に返す。
+
+    :param start_day: この日以降 (date, 含む)
+    :param end_day: この日より前 (date, 含まない)
+    :param preview: True の場合は縮小プレビューのセグメント
+    :return: [(撮影日, パス), ...]
+    """
+    segments = []
+    for path in sorted(glob.glob(os.path.join(get_segment_dir(layer_id, base_dir), '*' + SEGMENT_EXTENSION))):
+        name = os.path.basename(path)
+        if name.endswith(PREVIEW_EXTENSION) != preview:
+            continue
+        day = _parse_segment_day(name)
+        if day is None or (start_day and day < start_day) or (end_day and day >= end_day):
+            continue
+        segments.append((day, path))
+    return segments
+
+
+class _Segment:
+    """1つの層の1日分のセグメント (本編とプレビュー) の VideoWriter。"""
+
+    def __init__(self, layer_id, day, frame_size, base_dir=TIMELAPSE_DIR, fps=TIMELAPSE_FPS,
+                 fourcc=TIMELAPSE_FOURCC, preview_width=TIMELAPSE_PREVIEW_WIDTH):
+        segment_dir = get_segment_dir(layer_id, base_dir)
+        os.makedirs(segment_dir, exist_ok=True)
+        # 同じ日に再起動した場合は続き番号の新しいセグメントを作る (VideoWriter は追記できない)
+        part = len([path for path in glob.glob(os.path.join(segment_dir, f"{day:%Y%m%d}_*{SEGMENT_EXTENSION}"))
+                    if not path.endswith(PREVIEW_EXTENSION)])
+        stem = os.path.join(segment_dir, f"{day:%Y%m%d}_{part:02d}")
+
+        self.day = day
+        self.path = stem + SEGMENT_EXTENSION
+        self.size = (_even(frame_size[0]), _even(frame_size[1]))
+        self.frames = 0
+        # MPEG-TS はタグを持たないため、OpenCV は FOURCC 非対応の警告を出してタグ無しで書き込む (コーデックはそのまま)
+        codec = cv2.VideoWriter_fourcc(*fourcc)
+        self._writer = cv2.VideoWriter(self.path, codec, fps, self.size)
+        if not self._writer.isOpened():
+            raise OSError(f"VideoWriter を開けませんでした: {self.path}")
+
+        self._preview = None
+        if preview_width:
+            self.preview_size = _preview_size(self.size, preview_width)
+            self._preview = cv2.VideoWriter(stem + PREVIEW_EXTENSION, codec, fps, self.preview_size)
+            if not self._preview.isOpened():
+                self._writer.release()
+                raise OSError(f"VideoWriter を開けませんでした: {stem + PREVIEW_EXTENSION}")
+
+    def write(self, frame):
+        # 解像度が途中で変わった場合はセグメントの解像度に合わせる
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        self._writer.write(frame)
+        if self._preview is not None:
+            self._preview.write(cv2.resize(frame, self.preview_size, interpolation=cv2.INTER_AREA))
+        self.frames += 1
+
+    def close(self):
+        self._writer.release()
+        if self._preview is not None:
+            self._preview.release()
+
+
+class TimelapseWriter:
+    """
+    層ごとに当日のセグメントを開いたまま保持し、撮影のたびにフレームを1枚追記する。
+    日付が変わると前日のセグメントを閉じて新しいセグメントを作る。
+    書き込み中のセグメントは閉じるまで末尾が確定しないため、build_timelapse() は既定で当日を含めない。
+    """
+
+    def __init__(self, base_dir=TIMELAPSE_DIR):
+        self.base_dir = base_dir
+        self._segments = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _layer_lock(self, layer_id):
+        with self._lock:
+            return self._locks.setdefault(layer_id, threading.Lock())
+
+    def append_frame(self, layer_id, frame, captured_at=None):
+        """
+        撮影したフレームを層の当日のセグメントに追記する。
+
+        :param captured_at: 撮影日時 (省略時は現在時刻)。日付でセグメントを切り替える
+        :raises OSError: セグメントを作成できない場合
+        """
+        day = (captured_at or datetime.now()).date()
+        with self._layer_lock(layer_id):
+            segment = self._segments.get(layer_id)
+            if segment is not None and segment.day != day:
+                segment.close()
+                segment = None
+            if segment is None:
+                segment = self._segments[layer_id] = _Segment(layer_id, day, (frame.shape[1], frame.shape[0]),
+                                                              self.base_dir)
+            segment.write(frame)
+
+    def close_stale(self, today=None):
+        """
+        前日以前のセグメントを閉じる (日付が変わった後に撮影が無い層のセグメントを確定させる)。
+
+        :return: 閉じたセグメント数
+        """
+        today = today or date.today()
+        closed = 0
+        for layer_id in list(self._segments):
+            with self._layer_lock(layer_id):
+                segment = self._segments.get(layer_id)
+                if segment is not None and segment.day < today:
+                    segment.close()
+                    del self._segments[layer_id]
+                    closed += 1
+        return closed
+
+    def close_all(self):
+        """すべてのセグメントを閉じる (シャットダウン時に呼び出す)。"""
+        for layer_id in list(self._segments):
+            with self._layer_lock(layer_id):
+                segment = self._segments.pop(layer_id, None)
+                if segment is not None:
+                    segment.close()
+
+
+# アプリ全体で共有するタイムラプスライタ
+timelapse_writer = TimelapseWriter()
+
+
+def build_timelapse(layer_id, output_path, preview=False, start_day=None, end_day=None, base_dir=TIMELAPSE_DIR):
+    """
+    層のセグメントを撮影日順につなげて1本の動画にする。フレームのデコード・再エンコードは行わず、
+    セグメントのバイト列をコピーするだけなので、期間が長くても新しいフレームの分しか計算しない。
+
+    :param end_day: この日より前のセグメントだけを使う (省略時は今日。書き込み中の当日分を含めない)
+    :return: {'segments': つなげたセグメント数, 'bytes': 出力サイズ}
+    """
+    if end_day is None:
+        end_day = date.today()
+    segments = list_segments(layer_id, start_day, end_day, preview, base_dir)
+
+    tmp_path = f"{output_path}.tmp"
+    written = 0
+    try:
+        with open(tmp_path, 'wb') as out:
+            for _, path in segments:
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+            written = out.tell()
+        os.replace(tmp_path, output_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return {'segments': len(segments), 'bytes': written}
+
+
+def backfill_segments(layer_id, end_day=None, base_dir=TIMELAPSE_DIR):
+    """
+    ai_reports に記録された保存済みの画像から、セグメントが無い日のセグメントを作る。
+    セグメントがある日は読み込まないため、2回目以降は新しい日の分しか処理しない。
+
+    :param end_day: この日より前の画像だけを使う (省略時は今日。当日分は撮影ジョブが書き込む)
+    :return: {'days': 作成した日数, 'frames': 書き込んだフレーム数, 'missing': 読み込めなかった画像数}
+    """
+    if end_day is None:
+        end_day = date.today()
+    end_ms = int(datetime.combine(end_day, datetime.min.time()).timestamp() * 1000)
+    existing_days = {day for day, _ in list_segments(layer_id, base_dir=base_dir)}
+
+    result = {'days': 0, 'frames': 0, 'missing': 0}
+    segment = None
+    rows = get_connection().execute(
+        "SELECT ts_ms, image_path FROM ai_reports WHERE layer_id = ? AND ts_ms < ? ORDER BY ts_ms",
+        (layer_id, end_ms)
+    )
+    try:
+        for ts_ms, image_path in rows:
+            day = datetime.fromtimestamp(ts_ms / 1000).date()
+            if day in existing_days:
+                continue
+            if segment is not None and segment.day != day:
+                segment.close()
+                segment = None
+            frame = cv2.imread(image_path) if image_path else None
+            if frame is None:
+                result['missing'] += 1
+                continue
+            if segment is None:
+                segment = _Segment(layer_id, day, (frame.shape[1], frame.shape[0]), base_dir)
+                result['days'] += 1
+            segment.write(frame)
+            result['frames'] += 1
+    finally:
+        if segment is not None:
+            segment.close()
+    return result
+
+
+def _parse_day(value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"YYYY-MM-DD 形式の日付を指定してください: {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='層ごとのタイムラプス動画を作成する。')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='日ごとのセグメントをつなげて1本の動画にする')
+    build.add_argument('--layer', type=int, required=True, help='対象の層ID')
+    build.add_argument('--output', required=True, help='出力ファイル (.ts)')
+    build.add_argument('--preview', action='store_true', help='縮小プレビューのセグメントを使う')
+    build.add_argument('--start', type=_parse_day, default=None, help='開始日 (YYYY-MM-DD, この日を含む)')
+    build.add_argument('--end', type=_parse_day, default=None, help='終了日 (YYYY-MM-DD, この日を含まない。省略時は今日)')
+
+    backfill = subparsers.add_parser('backfill', help='保存済みの画像からセグメントの無い日のセグメントを作る')
+    backfill.add_argument('--layer', type=int, required=True, help='対象の層ID')
+
+    args = parser.parse_args()
+    try:
+        if args.command == 'build':
+            result = build_timelapse(args.layer, args.output, args.preview, args.start, args.end)
+            print(f"{result['segments']} セグメントをつなげて {args.output} ({result['bytes']} バイト) を作成しました。")
+        else:
+            result = backfill_segments(args.layer)
+            print(f"{result['days']} 日分 ({result['frames']} フレーム) のセグメントを作成しました。"
+                  f" (読み込めなかった画像: {result['missing']} 件)")
+    except (OSError, sqlite3.Error, cv2.error) as e:
+        print(f"タイムラプス作成エラー: {e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import zlib
+from datetime import datetime, timedelta
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from config import *
+
+# 黄金比の小数部。layer_id が連番でもオフセットが区間内に均等に散らばる
+_GOLDEN_RATIO_FRACTION = 0.6180339887498949
+
+# exec_time を実行間隔として解釈するジョブタイプ
+INTERVAL_JOB_TYPES = ['sensor', 'water']
+
+# exec_time の先頭に付けると、間隔実行のジョブタイプでも毎日指定時刻の実行になる (例: '@12:00:00')
+DAILY_PREFIX = '@'
+
+
+def split_exec_time(exec_time):
+    """
+    exec_time を (毎日指定時刻の実行か, 'HH:MM:SS') に分ける。
+
+    :return: (bool, str)
+    """
+    if exec_time.startswith(DAILY_PREFIX):
+        return True, exec_time[len(DAILY_PREFIX):]
+    return False, exec_time
+
+
+def compute_stagger_offset(job_type, layer_id, schedule_id, interval_sec):
+    """
+    同じタイプのジョブが同じ秒に集中しないよう、実行間隔内のオフセット (秒) を決める。
+
+    * STAGGER_OFFSETS_SEC に schedule_id があればその値を使う
+    * それ以外は layer_id とジョブタイプから決定的に求める (再起動しても同じ値)
+
+    :return: 0 以上 interval_sec 未満のオフセット秒
+    """
+    if schedule_id in STAGGER_OFFSETS_SEC:
+        return int(STAGGER_OFFSETS_SEC[schedule_id]) % interval_sec
+    if not STAGGER_ENABLED:
+        return 0
+
+    window = min(STAGGER_WINDOW_SEC, interval_sec)
+    salt = zlib.crc32(job_type.encode()) % 1000
+    fraction = ((layer_id or 0) + salt) * _GOLDEN_RATIO_FRACTION % 1.0
+    return int(fraction * window)
+
+
+def _jitter():
+    return STAGGER_JITTER_SEC or None
+
+
+def build_trigger(job_type, exec_time, layer_id=0, schedule_id=None):
+    """
+    ジョブタイプと exec_time から APScheduler のトリガーを生成する。
+
+    * sensor/water: exec_time を実行間隔と解釈する (例: '00:30:00' -> 30分おき)
+        - 60分を割り切れる間隔は CronTrigger。毎時の実行分・秒をオフセット分ずらす
+        - それ以外 (45分, 2時間など) は IntervalTrigger。当日 0時 + オフセットを起点にする
+    * camera など、または '@' 付きの exec_time: 毎日指定時刻の固定実行 (例: '09:00:00', '@12:00:00' -> 0 9 * * *, 0 12 * * *)
+
+    :return: (トリガー, 登録ログ用の説明文)
+    """
+    daily, time_text = split_exec_time(exec_time)
+    try:
+        H, M, S = map(int, time_text.split(':'))
+    except ValueError:
+        print(f"エラー: 不正な時刻形式 '{exec_time}'")
+        return CronTrigger(minute='*'), '毎分 (不正な時刻形式のためフォールバック)' # 毎分実行でフォールバック
+
+    total_minutes = M + H * 60
+    if job_type in INTERVAL_JOB_TYPES and not daily and total_minutes > 0:
+        interval_sec = total_minutes * 60
+        offset = compute_stagger_offset(job_type, layer_id, schedule_id, interval_sec)
+        offset_text = f"オフセット {offset // 60}分{offset % 60:02d}秒"
+        if STAGGER_JITTER_SEC:
+            offset_text += f", ジッタ 最大{STAGGER_JITTER_SEC}秒"
+
+        if 60 % total_minutes == 0:
+            # 60分を割り切れる間隔の場合 (例: 10, 15, 20, 30分)
+            # Cronで分(minute)を指定し、毎時実行
+            minutes = ','.join(str(i) for i in range(offset // 60, 60, total_minutes))
+            trigger = CronTrigger(minute=minutes, hour='*', second=offset % 60, jitter=_jitter())
+            return trigger, f"毎時 {total_minutes}分おき (実行分: {minutes}, {offset_text})"
+
+        # 割り切れない間隔は IntervalTrigger で正確な間隔を保つ
+        anchor = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        trigger = IntervalTrigger(minutes=total_minutes, start_date=anchor + timedelta(seconds=offset), jitter=_jitter())
+        return trigger, f"{total_minutes}分おき (0時起点, {offset_text})"
+
+    # カメラジョブまたはその他の固定時刻ジョブの場合
+    # 毎日指定時刻に実行
+    return CronTrigger(hour=H, minute=M, second=0), f"毎日 {time_text[:5]}"
@@ -1,30 +1,49 @@
-import cv2
 import datetime
+import functools
+import json
 import os
 import glob
-from core.db_manager import insert_camera_log, insert_system_log, select_layer_info
+from core.db_manager import insert_system_log, select_active_layers
+from core.config_cache import get_layer_info
+from core.camera_session import camera_manager, CameraOpenError
+from core.capture_pipeline import capture_pipeline, encode_image, write_atomic, get_extension
+from core.capture_coordinator import run_capture_plan
+from core.timelapse import timelapse_writer
+from core.image_store import new_image_path, remove_expired_day_dirs
+from core.frame_dedup import frame_deduplicator
 from config import *
 
-def get_file_name():
-    """ファイル名を生成（例: 20250910_100000.jpg）"""
-    now = datetime.datetime.now()
-    return now.strftime("%Y%m%d_%H%M%S.jpg")
+def save_image(frame, file_path, image_format=IMAGE_DEFAULT_FORMAT, quality=IMAGE_DEFAULT_QUALITY):
+    """
+    画像を同期的にエンコードし、アトミックに保存する。
+    撮影ジョブは capture_pipeline 経由で非同期に保存するため、ツールなどから直接保存する場合に使用する。
 
-def save_image(frame, file_path):
-    """画像をJPEG形式で保存"""
-    # [int(cv2.IMWRITE_JPEG_QUALITY), 95] は画像品質設定です
-    cv2.imwrite(file_path, frame, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
+    :return: 保存と検証に成功した場合 True
+    """
+    try:
+        write_atomic(encode_image(frame, image_format, quality), file_path)
+        return True
+    except (OSError, ValueError) as e:
+        print(f"エラー: 画像 {file_path} の保存に失敗しました: {e}")
+        return False
 
 def delete_old_images(save_dir):
-    """指定期間より古い画像を自動削除"""
+    """
+    指定期間より古い画像をディレクトリ走査で削除する。
+    日ごとのディレクトリ (YYYY/MM/DD) は期限切れの日をディレクトリごと削除し、
+    直下に残っている旧形式の画像はファイルの更新時刻で1件ずつ削除する。
+    通常の削除は画像保持期間ジョブが行うため、DBに記録されていない画像を手動で掃除する場合にのみ使用する。
+    """
     today = datetime.datetime.now()
     cutoff_date = today - datetime.timedelta(days=RETENTION_DAYS)
+    remove_expired_day_dirs(save_dir, cutoff_date.date())
     
     image_files = glob.glob(os.path.join(save_dir, "*.jp*g"))
     
     for file_path in image_files:
         try:
-            timestamp = os.path.getctime(file_path)
+            # ctime はコピー・復元時に更新されるため、内容の更新時刻 (mtime) を使う
+            timestamp = os.path.getmtime(file_path)
             file_date = datetime.datetime.fromtimestamp(timestamp)
             
             if file_date < cutoff_date:
@@ -34,64 +53,104 @@ def delete_old_images(save_dir):
             print(f"警告: 古い画像ファイル {file_path} の削除中にエラー: {e}")
 
 
-# --- メインジョブ関数 ---
-def execute_photo_job(layer_id: int):
+def capture_layer(layer_info):
     """
-    指定された層 (layer_id) のカメラを起動し、撮影、保存、DB記録を行う。
-    """
-    SAVE_DIR = os.path.join(BASE_SAVE_DIR, f"layer_{layer_id}")
-    
-    # 1. 保存ディレクトリを作成
-    if not os.path.exists(SAVE_DIR):
-        os.makedirs(SAVE_DIR)
+    1つの層のカメラで撮影し、フレームを保存パイプラインに渡す。
 
-    layer_info = select_layer_info(layer_id)
-    
-    if not layer_info:
-        error_msg = f"Layer {layer_id} の情報がDBに見つかりません。"
-        insert_system_log(layer_id, 'ERROR', error_msg, 'Layer ID not found in layers table.')
-        print(f"エラー: {error_msg}")
-        return
-        
+    :param layer_info: layers テーブルの1行 (select_layer_info の戻り値)
+    :return: 撮影に成功し保存を依頼できた場合 (前回から変化が無く保存を省いた場合を含む) True
+    """
+    layer_id = layer_info['layer_id']
     camera_id = layer_info['cam_id'] # cam_id (例: '/dev/video0' または 0) を使用
-    
-    cap = cv2.VideoCapture(camera_id)
 
-    if not cap.isOpened():
+    try:
+        # デバイスはセッションマネージャが開いたまま保持し、同じカメラへのアクセスを直列化する
+        ret, frame = camera_manager.capture(camera_id)
+    except CameraOpenError as e:
         error_msg = f"カメラ(ID:{camera_id})接続失敗。"
-        insert_system_log(layer_id, 'ERROR', error_msg, f'VideoCapture({camera_id}) failed to open.')
+        insert_system_log(layer_id, 'ERROR', error_msg, str(e))
         print(f"エラー: {error_msg}")
-        return
+        return False
 
     try:
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, IMAGE_WIDTH)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, IMAGE_HEIGHT)
-
-        ret, frame = cap.read()
-        cap.release() 
-
         if not ret:
             error_msg = f"Layer {layer_id} のフレーム読み込み失敗。"
             insert_system_log(layer_id, 'ERROR', error_msg, 'cap.read() returned False.')
             print(f"エラー: {error_msg}")
-            return
-        
-        file_name = get_file_name()
-        relative_file_path = os.path.join(SAVE_DIR, file_name) 
-        
-        save_image(frame, relative_file_path)
-        
-        insert_camera_log(layer_id, relative_file_path)
-        
-        insert_system_log(layer_id, 'INFO', 'Camera job finished successfully.', f'Path: {relative_file_path}')
+            return False
+
+        # 直前に保存したフレームから変化が無い場合は、エンコード・保存・DB記録を省く
+        on_stored = None
+        if DEDUP_ENABLED:
+            signature = frame_deduplicator.check(layer_id, frame)
+            if signature is None:
+                print(f"[CAMERA JOB] Layer {layer_id} のフレームは前回から変化が無いため保存しませんでした。")
+                return True
+            # 比較対象は保存と DB 記録が成功した後に更新する
+            on_stored = functools.partial(frame_deduplicator.mark_stored, layer_id, signature)
         
-        delete_old_images(SAVE_DIR)
+        image_format = layer_info.get('image_format') or IMAGE_DEFAULT_FORMAT
+        quality = layer_info.get('image_quality') or IMAGE_DEFAULT_QUALITY
+
+        # 撮影日のディレクトリに、同じ秒の撮影とも重ならない名前で保存する
+        relative_file_path = new_image_path(layer_id, get_extension(image_format))
         
-        print(f"[CAMERA JOB] Layer {layer_id} の画像を {relative_file_path} に保存しました。")
+        # エンコード・保存・DB記録はエンコードプールで行い、スケジューラのスレッドをすぐに解放する
+        capture_pipeline.submit(layer_id, frame, relative_file_path, image_format, quality, on_stored)
+        return True
 
     except Exception as e:
         insert_system_log(layer_id, 'ERROR', 'Unexpected error during photo job.', str(e))
         print(f"[CRITICAL ERROR] Photo job failed: {e}")
-    finally:
-        if cap.isOpened():
-            cap.release()
\ No newline at end of file
+        return False
+
+
+# --- メインジョブ関数 ---
+def execute_photo_job(layer_id: int):
+    """
+    指定された層 (layer_id) のカメラを起動し、撮影、保存、DB記録を行う。
+    """
+    layer_info = get_layer_info(layer_id)
+    
+    if not layer_info:
+        error_msg = f"Layer {layer_id} の情報がDBに見つかりません。"
+        insert_system_log(layer_id, 'ERROR', error_msg, 'Layer ID not found in layers table.')
+        print(f"エラー: {error_msg}")
+        return
+
+    capture_layer(layer_info)
+
+
+def execute_rack_photo_job(layer_id: int = 0):
+    """
+    有効な全層 (layers.is_active=1) を一括で撮影する (layer_id=0 の camera スケジュール)。
+    異なるカメラ/USBバスは並列に、同じカメラ/USBバスは順番に撮影する。
+    """
+    layers = select_active_layers()
+    if not layers:
+        print("[RACK CAMERA JOB] 有効な層が見つかりませんでした。")
+        return
+
+    try:
+        report = run_capture_plan(layers, capture_layer)
+
+        failed = [r['layer_id'] for r in report['layers'] if not r['ok']]
+        level = 'ERROR' if failed else 'INFO'
+        insert_system_log(layer_id, level, 'Rack camera job finished.', json.dumps(report))
+        print(f"[RACK CAMERA JOB] {len(layers)} 層を {report['wall_time_sec']:.2f} 秒で撮影しました。 (失敗: {failed})")
+
+    except Exception as e:
+        insert_system_log(layer_id, 'ERROR', 'Unexpected error during rack camera job.', str(e))
+        print(f"[CRITICAL ERROR] Rack camera job failed: {e}")
+
+
+def execute_camera_idle_check_job(layer_id: int = 0):
+    """
+    一定時間使われていないカメラセッションと、前日以前のタイムラプスのセグメントを閉じる。
+    """
+    closed = camera_manager.close_idle()
+    if closed:
+        print(f"[CAMERA IDLE CHECK] 未使用のカメラセッションを {closed} 件閉じました。")
+    segments = timelapse_writer.close_stale()
+    if segments:
+        print(f"[CAMERA IDLE CHECK] 前日のタイムラプスのセグメントを {segments} 件閉じました。")
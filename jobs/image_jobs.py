@@ -0,0 +1,19 @@
+import json
+from core.db_manager import insert_system_log
+from core.growth_analysis import backfill_growth_reports
+
+
+def execute_growth_analysis_job(layer_id: int = 0):
+    """
+    未解析の ai_reports (撮影時の解析に失敗した画像など) を解析し、成長率を埋める。
+    layer_id=0 の場合は全層が対象。CPU 負荷が高いため image プロセスプールで実行される。
+    """
+    try:
+        result = backfill_growth_reports(layer_id or None)
+
+        insert_system_log(layer_id, 'INFO', 'Growth analysis job finished successfully.', json.dumps(result))
+        print(f"[GROWTH ANALYSIS JOB] 解析: {result['analyzed']} 件, 画像なし: {result['missing']} 件")
+
+    except Exception as e:
+        insert_system_log(layer_id, 'ERROR', 'Unexpected error during growth analysis job.', str(e))
+        print(f"[CRITICAL ERROR] Growth analysis job failed: {e}")
@@ -0,0 +1,34 @@
+import json
+from core.db_manager import insert_system_log
+from core.retention import apply_retention, purge_expired_images
+
+
+def execute_retention_job(layer_id: int = 0):
+    """
+    各テーブルの保持ポリシーに従って古い行を削除し、空き領域を解放する。
+    """
+    try:
+        report = apply_retention()
+        total_rows = sum(report['rows'].values())
+
+        insert_system_log(layer_id, 'INFO', 'Retention job finished successfully.', json.dumps(report))
+        print(f"[RETENTION JOB] {total_rows} 行を削除し、{report['bytes_reclaimed']} バイトを解放しました。 {report['rows']}")
+
+    except Exception as e:
+        insert_system_log(layer_id, 'ERROR', 'Unexpected error during retention job.', str(e))
+        print(f"[CRITICAL ERROR] Retention job failed: {e}")
+
+
+def execute_image_retention_job(layer_id: int = 0):
+    """
+    保持期間 (RETENTION_DAYS) を過ぎた画像ファイルと ai_reports の行を削除する。
+    """
+    try:
+        result = purge_expired_images()
+
+        insert_system_log(layer_id, 'INFO', 'Image retention job finished successfully.', json.dumps(result))
+        print(f"[IMAGE RETENTION JOB] 画像 {result['files']} 件、レポート {result['rows']} 行を削除しました。")
+
+    except Exception as e:
+        insert_system_log(layer_id, 'ERROR', 'Unexpected error during image retention job.', str(e))
+        print(f"[CRITICAL ERROR] Image retention job failed: {e}")
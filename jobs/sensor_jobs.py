@@ -1,39 +1,20 @@
-import random
-import datetime
-from core.db_manager import insert_system_log, insert_sensor_log, select_system_config
-from config import DEFAULT_SYSTEM_CONFIG # 閾値を取得するためにconfigもインポート
+from core.db_manager import insert_system_log, insert_sensor_log
+from core.sensor_sampling import sampling_engine
 
 def execute_sensor_job(layer_id: int):
     """
-    指定された層 (layer_id) の温湿度データを読み込み、DBに記録し、アラートをチェックする。
-    物理センサがないため、ここではダミー値を使用する。
+    指定された層 (layer_id) の温湿度データを読み込み、DBに記録する。
+    高頻度サンプリングのバッファにデータがあれば集計値を、無ければ1回の測定値を記録する。
     """
     try:
-        # 実際のセンサ実装時はこの部分を置き換える
-        temperature = round(random.uniform(25.0, 32.0), 1)  # 25.0℃〜32.0℃の範囲
-        humidity = round(random.uniform(50.0, 75.0), 1)     # 50%〜75%の範囲
-
-        insert_sensor_log(layer_id, temperature, humidity)
-        
-        # 3. システム設定からアラート閾値を取得
-        config = select_system_config()
-        
-        temp_high_threshold = config.get('temp_high_threshold', DEFAULT_SYSTEM_CONFIG['temp_high_threshold'])
-        temp_low_threshold = config.get('temp_low_threshold', DEFAULT_SYSTEM_CONFIG['temp_low_threshold']) 
-        
-        # 4. アラートチェック
-        if temperature > temp_high_threshold:
-            # 高温アラート
-            alert_msg = f"温度アラート: {temperature}℃ (高温閾値 {temp_high_threshold}℃ 超過)"
-            insert_system_log(layer_id, 'CRITICAL', alert_msg, f'Current temp: {temperature}')
-            print(f"[SENSOR JOB - CRITICAL ALERT] {alert_msg}")
-        
-        elif temperature < temp_low_threshold:
-            # 【追加】低温アラート
-            alert_msg = f"温度アラート: {temperature}℃ (低温閾値 {temp_low_threshold}℃ 未満)"
-            insert_system_log(layer_id, 'CRITICAL', alert_msg, f'Current temp: {temperature}')
-            print(f"[SENSOR JOB - CRITICAL ALERT] {alert_msg}")
-         
+        summary = sampling_engine.drain_summary(layer_id)
+        if summary:
+            temperature, humidity = summary.temperature, summary.humidity
+            insert_sensor_log(layer_id, temperature, humidity, summary.as_stats())
+        else:
+            temperature, humidity = sampling_engine.read(layer_id)
+            insert_sensor_log(layer_id, temperature, humidity)
+        # アラートはサンプリングの各サンプルを取得時点で評価済みのため、ここでは評価しない
         insert_system_log(layer_id, 'INFO', 'Sensor data recorded successfully.', f'Temp: {temperature}℃, Hum: {humidity}%')
         print(f"[SENSOR JOB] Layer {layer_id} のデータを記録しました。 (温: {temperature}℃, 湿: {humidity}%)")
 
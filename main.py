@@ -1,8 +1,16 @@
 import sys
-from core.db_manager import init_db 
-from core.scheduler import run_scheduler
 
 def main():
+    if '--startup-report' in sys.argv[1:]:
+        # 起動時間の計測モード (各段階の所要時間を表示して終了する)
+        from core.startup_report import report_startup
+        report_startup()
+        return
+
+    # 計測モードで import の時間を測れるよう、ここで読み込む
+    from core.db_manager import init_db
+    from core.scheduler import run_scheduler
+
     # データベースの確認と初期化
     init_db() 
 
@@ -13,4 +21,4 @@ def main():
         print("\nメインスケジューラを停止しました。")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()